@@ -2,22 +2,80 @@
 Electronic Components AI - API Server
 FastAPI backend serving trained EfficientNet model for 36 electronic components
 """
-from fastapi import FastAPI, File, UploadFile, HTTPException, Query
+from fastapi import FastAPI, Depends, File, Header, UploadFile, HTTPException, Query, Request
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import FileResponse, JSONResponse
-from fastapi.staticfiles import StaticFiles
+from fastapi.responses import JSONResponse, PlainTextResponse, Response, StreamingResponse
 import uvicorn
-from PIL import Image
-import io
+import hmac
+import json
+import asyncio
 import torch
-import torchvision.transforms as transforms
-from torchvision import models
-import torch.nn as nn
 import os
-from typing import Optional, List
-from database import SessionLocal, Product, Vendor
+import time
+from contextlib import asynccontextmanager
+from typing import Awaitable, Callable, Optional, List
+from urllib.parse import urlencode
+from pydantic import BaseModel, Field
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+from database import Product, Vendor, async_engine, engine, get_async_session, prepare_database
+from catalog import (
+    PRODUCT_COLUMNS, VENDOR_COLUMNS, InvalidListingRequest,
+    build_listing_query, fetch_catalogue_matches, fetch_listings, paginate, serialize_product_row,
+    watch_catalogue_writes
+)
+from inference import PreprocessPool, QueueFullError, content_key
+from model_registry import LoadedModel, ModelRegistry, read_class_names
+from catalog_import import FORMATS, detect_format, import_file
+from orders import ORDER_MAX_LINES, OrderBatcher, OrderError, fetch_order, normalize_lines
+from cache import TTLCache, make_etag, make_response_cache
+from vector_index import make_vector_index
+from static_assets import PrecompressedStaticFiles, ThumbnailCache, static_root
+from metrics import (
+    Gauge, MetricsMiddleware, StageTimer, instrument_engine, model_confidence, model_latency,
+    registry as metrics_registry
+)
+
+# Model is loaded in the background by the lifespan hook, so pages and
+# marketplace APIs serve immediately and a missing checkpoint can't take them down
+registry = ModelRegistry()
+
+# Decode/preprocess pool: PIL and torchvision transforms run off the event loop
+preprocess_pool = PreprocessPool()
+
+# Checkouts are group-committed: concurrent orders share one transaction
+order_batcher = OrderBatcher()
+
+# Catalogue read responses, cached as pre-serialized bytes and invalidated by
+# bumping a version whenever a products/vendors write commits
+response_cache = make_response_cache()
+watch_catalogue_writes(response_cache.bump)
+
+# Nearest-neighbour search over product image embeddings (pgvector or in-memory)
+vector_index = make_vector_index()
 
-app = FastAPI(title="current nai API")
+# Per-request SQL count and time, for both the sync and the async engine
+instrument_engine(engine)
+instrument_engine(async_engine.sync_engine)
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    try:
+        await asyncio.to_thread(prepare_database)
+    except Exception as e:
+        print(f"⚠️  Database indexes unavailable: {e}")
+    preprocess_pool.start()
+    await order_batcher.start()
+    print(f"✅ Preprocess pool ready ({preprocess_pool.workers} {preprocess_pool.kind} workers, queue ≤ {preprocess_pool.max_queue})")
+    load_task = asyncio.create_task(registry.load())
+    yield
+    load_task.cancel()
+    await registry.stop()
+    await order_batcher.stop()
+    preprocess_pool.stop()
+    await async_engine.dispose()
+
+app = FastAPI(title="current nai API", lifespan=lifespan)
 
 # CORS
 app.add_middleware(
@@ -28,220 +86,619 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
-# Serve static files
-if os.path.exists("css"):
-    app.mount("/css", StaticFiles(directory="css"), name="css")
-if os.path.exists("js"):
-    app.mount("/js", StaticFiles(directory="js"), name="js")
-if os.path.exists("images"):
-    app.mount("/images", StaticFiles(directory="images"), name="images")
+# Request metrics: latency and status per route, SQL per request, optional profiling
+app.add_middleware(MetricsMiddleware)
+
+# Serve static files: from the repo, or from the precompressed build with STATIC_MODE=build
+STATIC_ROOT = static_root()
+for asset_dir in ("css", "js", "images"):
+    if os.path.exists(os.path.join(STATIC_ROOT, asset_dir)):
+        app.mount(f"/{asset_dir}", PrecompressedStaticFiles(directory=os.path.join(STATIC_ROOT, asset_dir)), name=asset_dir)
 if os.path.exists("dataset"):
-    app.mount("/dataset", StaticFiles(directory="dataset"), name="dataset")
+    app.mount("/dataset", PrecompressedStaticFiles(directory="dataset"), name="dataset")
+
+# Pages get the same precompression and ETag/Last-Modified revalidation
+pages = PrecompressedStaticFiles(directory=STATIC_ROOT)
 
-# Load model
-print("Loading Electronic Components AI Model...")
+async def serve_page(request: Request, name: str) -> Response:
+    return await pages.get_response(name, request.scope)
 
-device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
-MODEL_PATH = "./models/electronics_best_model.pth"
+# Downscaled dataset images for product cards, generated once and cached on disk
+thumbnails = ThumbnailCache()
 
-checkpoint = torch.load(MODEL_PATH, map_location=device)
-class_names = checkpoint['class_names']
-num_classes = len(class_names)
+# Upper bound on images per /api/identify-parts request
+IDENTIFY_BATCH_MAX_FILES = int(os.getenv("IDENTIFY_BATCH_MAX_FILES", "64"))
 
-print(f"✅ Found {num_classes} categories")
+# Prediction cache: identical uploads skip decode and inference entirely
+PREDICTION_CACHE_SIZE = int(os.getenv("PREDICTION_CACHE_SIZE", "4096"))
+PREDICTION_CACHE_TTL = float(os.getenv("PREDICTION_CACHE_TTL", "3600"))
+prediction_cache = TTLCache(max_entries=PREDICTION_CACHE_SIZE, ttl=PREDICTION_CACHE_TTL)
 
-# Create model
-model = models.efficientnet_b0(pretrained=False)
-model.classifier[1] = nn.Linear(model.classifier[1].in_features, num_classes)
-model.load_state_dict(checkpoint['model_state_dict'])
-model = model.to(device)
-model.eval()
+def prediction_key(loaded: LoadedModel, contents: bytes) -> tuple:
+    # Keyed to the loaded checkpoint and backend so a model swap invalidates old entries
+    return (loaded.fingerprint, loaded.backend_name, content_key(contents))
 
-print(f"✅ Model loaded! Accuracy: {checkpoint['val_acc']:.2f}%")
+# Seconds clients are told to back off when a stage queue is full or the model is loading
+RETRY_AFTER_SECONDS = "1"
 
-# Image preprocessing
-preprocess = transforms.Compose([
-    transforms.Resize((224, 224)),
-    transforms.ToTensor(),
-    transforms.Normalize([0.485, 0.456, 0.406], [0.229, 0.224, 0.225])
-])
+def describe_prediction(loaded: LoadedModel, probabilities: torch.Tensor) -> dict:
+    """Summarize one row of class probabilities"""
+    confidence, predicted_idx = torch.max(probabilities, 0)
+    predicted_class = loaded.class_names[predicted_idx.item()]
+    confidence_pct = confidence.item() * 100
+    return {
+        'name': predicted_class.replace('-', ' ').title(),
+        'category': 'Electronic Component',
+        'confidence': round(confidence_pct, 2),
+        'detected_type': predicted_class
+    }
+
+def top_predictions(loaded: LoadedModel, probabilities: torch.Tensor, k: int) -> List[dict]:
+    """Top-k classes with their probabilities, most likely first"""
+    values, indices = torch.topk(probabilities, min(k, probabilities.shape[0]))
+    return [
+        {
+            'class': loaded.class_names[idx],
+            'name': loaded.class_names[idx].replace('-', ' ').title(),
+            'probability': round(value * 100, 2)
+        }
+        for value, idx in zip(values.tolist(), indices.tolist())
+    ]
+
+def queue_full(e: QueueFullError) -> HTTPException:
+    return HTTPException(status_code=429, detail=str(e), headers={"Retry-After": RETRY_AFTER_SECONDS})
+
+def require_model(loaded: Optional[LoadedModel] = None) -> LoadedModel:
+    """The serving model (or `loaded`), or 503 while it is still loading (or failed to load)"""
+    loaded = loaded or registry.current
+    if loaded is None:
+        raise HTTPException(
+            status_code=503,
+            detail=f"Model not ready ({registry.state})",
+            headers={"Retry-After": RETRY_AFTER_SECONDS}
+        )
+    return loaded
+
+async def routed_model():
+    """Model for one identify request (primary or A/B candidate), held until the response is sent"""
+    loaded = require_model(registry.route())
+    with loaded.serving():
+        yield loaded
+
+async def primary_model():
+    """The primary model, held until the response is sent"""
+    loaded = require_model()
+    with loaded.serving():
+        yield loaded
+
+def record_prediction(loaded: LoadedModel, seconds: float, confidence: float):
+    """Per-model latency and confidence, for comparing A/B variants"""
+    loaded.stats.record(seconds, confidence)
+    model_latency.observe(seconds, loaded.variant, loaded.fingerprint)
+    model_confidence.observe(confidence, loaded.variant, loaded.fingerprint)
+
+# Admin endpoints and catalogue import are disabled unless ADMIN_TOKEN is
+# set; send it as X-Admin-Token
+ADMIN_TOKEN = os.getenv("ADMIN_TOKEN", "")
+
+def require_admin(x_admin_token: Optional[str] = Header(None)):
+    if not ADMIN_TOKEN:
+        raise HTTPException(status_code=403, detail="Admin API disabled (set ADMIN_TOKEN)")
+    if not hmac.compare_digest((x_admin_token or '').encode(), ADMIN_TOKEN.encode()):
+        raise HTTPException(status_code=401, detail="Invalid admin token")
+
+# Health probes
+@app.get("/healthz")
+async def healthz():
+    """Liveness: the process is up and serving"""
+    return {'status': 'ok'}
+
+@app.get("/readyz")
+async def readyz():
+    """Readiness: the model is loaded and identify requests can be served"""
+    status = registry.status()
+    return JSONResponse(status_code=200 if registry.ready else 503, content=status)
 
 # Routes
 @app.get("/")
-async def root():
-    return FileResponse("index.html")
+async def root(request: Request):
+    return await serve_page(request, "index.html")
 
 @app.get("/index.html")
-async def index_page():
-    return FileResponse("index.html")
+async def index_page(request: Request):
+    return await serve_page(request, "index.html")
 
 @app.get("/identify")
-async def identify_page():
-    return FileResponse("identify.html")
+async def identify_page(request: Request):
+    return await serve_page(request, "identify.html")
 
 @app.get("/identify.html")
-async def identify_html_page():
-    return FileResponse("identify.html")
+async def identify_html_page(request: Request):
+    return await serve_page(request, "identify.html")
 
 @app.get("/marketplace.html")
-async def marketplace_page():
-    return FileResponse("marketplace.html")
+async def marketplace_page(request: Request):
+    return await serve_page(request, "marketplace.html")
 
 @app.get("/vendors.html")
-async def vendors_page():
-    return FileResponse("vendors.html")
+async def vendors_page(request: Request):
+    return await serve_page(request, "vendors.html")
 
 @app.get("/pricing.html")
-async def pricing_page():
-    return FileResponse("pricing.html")
+async def pricing_page(request: Request):
+    return await serve_page(request, "pricing.html")
+
+@app.get("/thumbnails/{width}/{path:path}")
+async def dataset_thumbnail(width: int, path: str, request: Request):
+    """A /dataset image scaled to fit `width` (one of THUMBNAIL_SIZES), as JPEG"""
+    return await thumbnails.response(width, path, request.scope)
 
 @app.post("/api/identify-part")
-async def identify_part(file: UploadFile = File(...)):
+async def identify_part(
+    file: UploadFile = File(...),
+    top_k: int = Query(3, ge=1, le=10),
+    products_per_class: int = Query(4, ge=0, le=20),
+    loaded: LoadedModel = Depends(routed_model)
+):
+    timer = StageTimer()
     try:
         # Read image
         contents = await file.read()
-        image = Image.open(io.BytesIO(contents)).convert('RGB')
+        timer.mark('read')
         
-        # Preprocess
-        input_tensor = preprocess(image).unsqueeze(0).to(device)
+        cache_key = prediction_key(loaded, contents)
+        probabilities = prediction_cache.get(cache_key)
+        cached = probabilities is not None
         
-        # Inference
-        with torch.no_grad():
-            outputs = model(input_tensor)
-            probabilities = torch.nn.functional.softmax(outputs[0], dim=0)
-            confidence, predicted_idx = torch.max(probabilities, 0)
+        if not cached:
+            inference_started = time.perf_counter()
+            # Decode + preprocess in the worker pool
+            input_tensor, decode_s, preprocess_s = await preprocess_pool.run(contents, timed=True)
+            timer.mark('preprocess_wait', {'decode': decode_s, 'preprocess': preprocess_s})
+            
+            # Inference (batched with other in-flight requests); softmax runs inside the forward pass
+            engine_timings = {}
+            probabilities = (await loaded.engine.submit(input_tensor.unsqueeze(0), engine_timings))[0]
+            timer.mark('inference_wait', engine_timings)
+            inference_seconds = time.perf_counter() - inference_started
+            # clone: a row view would pin the whole batch output in memory
+            prediction_cache.set(cache_key, probabilities.clone())
         
         # Get prediction
-        predicted_class = class_names[predicted_idx.item()]
-        confidence_pct = confidence.item() * 100
+        part = describe_prediction(loaded, probabilities)
+        confidence_pct = part['confidence']
+        predictions = top_predictions(loaded, probabilities, top_k)
+        if not cached:
+            record_prediction(loaded, inference_seconds, confidence_pct)
+        timer.mark('postprocess')
+        
+        # Join the top-k classes against the catalogue in one round trip
+        matches = await asyncio.to_thread(
+            fetch_catalogue_matches, [p['class'] for p in predictions], products_per_class
+        )
+        timer.mark('catalogue')
+        for prediction in predictions:
+            match = matches.get(prediction['class'])
+            prediction['price_range'] = match['price_range'] if match else None
+            prediction['products'] = match['products'] if match else []
+        
+        # Pricing and vendors for the top prediction come from real listings
+        top_match = matches.get(part['detected_type'])
+        if top_match:
+            price_range = top_match['price_range']
+            pricing = {
+                'estimated_range': f"{price_range['min']:.0f}-{price_range['max']:.0f} BDT",
+                'currency': 'BDT',
+                'listings': price_range['listings']
+            }
+        else:
+            pricing = {'estimated_range': None, 'currency': 'BDT', 'listings': 0}
+        
+        vendors = {}
+        for product in (top_match['products'] if top_match else []):
+            vendors.setdefault(product['vendor']['id'], product['vendor'])
         
         # Build response
         response = {
             'success': True,
-            'part': {
-                'name': predicted_class.replace('-', ' ').title(),
-                'category': 'Electronic Component',
-                'confidence': round(confidence_pct, 2),
-                'detected_type': predicted_class
-            },
+            'part': part,
+            'predictions': predictions,
             'specifications': {'Type': 'Electronic Component'},
             'applications': ['Various electronic applications'],
-            'pricing': {
-                'estimated_range': '100-5000 BDT',
-                'currency': 'BDT'
-            },
-            'vendors': [
-                {'name': 'Electronics BD', 'location': 'Dhaka', 'rating': 4.7},
-                {'name': 'Component House', 'location': 'Chittagong', 'rating': 4.5}
-            ],
+            'pricing': pricing,
+            'vendors': list(vendors.values()),
             'method': 'EfficientNet-B0',
+            'model': {'variant': loaded.variant, 'fingerprint': loaded.fingerprint},
+            'cached': cached,
             'note': f'AI Confidence: {confidence_pct:.1f}%'
         }
         
-        return response
+        # Serialize here rather than in FastAPI so it shows up as its own stage
+        json_response = JSONResponse(response)
+        timer.mark('serialize')
+        timer.observe()
+        json_response.headers['Server-Timing'] = timer.server_timing()
+        return json_response
         
+    except QueueFullError as e:
+        raise queue_full(e)
+    except Exception as e:
+        print(f"Error: {str(e)}")
+        raise HTTPException(status_code=500, detail=str(e))
+
+@app.post("/api/identify-parts")
+async def identify_parts(files: List[UploadFile] = File(...), loaded: LoadedModel = Depends(routed_model)):
+    """Identify many images in one request, streaming NDJSON results per chunk"""
+    if len(files) > IDENTIFY_BATCH_MAX_FILES:
+        raise HTTPException(
+            status_code=413,
+            detail=f"At most {IDENTIFY_BATCH_MAX_FILES} images per request"
+        )
+    
+    # Read every upload before streaming starts; the files are closed afterwards
+    uploads = [(f.filename, await f.read()) for f in files]
+    cache_keys = [prediction_key(loaded, contents) for _, contents in uploads]
+    cached = [prediction_cache.get(key) for key in cache_keys]
+    
+    # Reject up front rather than half-processing a batch we can't queue
+    misses = sum(1 for probabilities in cached if probabilities is None)
+    if not preprocess_pool.has_capacity(misses):
+        raise queue_full(QueueFullError("Image preprocessing queue is full"))
+    
+    # Decode all cache misses concurrently in the worker pool
+    decode_tasks = {
+        i: asyncio.ensure_future(preprocess_pool.run(contents))
+        for i, (_, contents) in enumerate(uploads)
+        if cached[i] is None
+    }
+    chunk_size = loaded.engine.max_batch_size
+    
+    async def stream_results():
+        try:
+            for start in range(0, len(uploads), chunk_size):
+                indices = range(start, min(start + chunk_size, len(uploads)))
+                lines = {}
+                for i in indices:
+                    if cached[i] is not None:
+                        lines[i] = {'index': i, 'filename': uploads[i][0], 'success': True,
+                                    'part': describe_prediction(loaded, cached[i]), 'cached': True}
+                
+                pending = [i for i in indices if i in decode_tasks]
+                decoded = await asyncio.gather(
+                    *(decode_tasks[i] for i in pending), return_exceptions=True
+                )
+                
+                ready = []
+                for i, tensor in zip(pending, decoded):
+                    if isinstance(tensor, Exception):
+                        lines[i] = {'index': i, 'filename': uploads[i][0], 'success': False,
+                                    'error': f'Could not decode image: {tensor}'}
+                    else:
+                        ready.append((i, tensor))
+                
+                if ready:
+                    try:
+                        probabilities = await loaded.engine.submit(torch.stack([t for _, t in ready]))
+                        for (i, _), row in zip(ready, probabilities):
+                            prediction_cache.set(cache_keys[i], row.clone())
+                            lines[i] = {'index': i, 'filename': uploads[i][0], 'success': True,
+                                        'part': describe_prediction(loaded, row), 'cached': False}
+                    except Exception as e:
+                        print(f"Error: {str(e)}")
+                        for i, _ in ready:
+                            lines[i] = {'index': i, 'filename': uploads[i][0], 'success': False,
+                                        'error': str(e)}
+                
+                yield ''.join(json.dumps(lines[i]) + '\n' for i in indices)
+        finally:
+            # Client went away mid-stream: don't keep decoding for nobody
+            for task in decode_tasks.values():
+                task.cancel()
+    
+    return StreamingResponse(stream_results(), media_type="application/x-ndjson")
+
+@app.post("/api/similar-products")
+async def similar_products(
+    file: UploadFile = File(...),
+    k: int = Query(12, ge=1, le=50),
+    db: AsyncSession = Depends(get_async_session),
+    # Embeddings are backfilled for the primary checkpoint, so the candidate never serves this
+    loaded: LoadedModel = Depends(primary_model)
+):
+    """Find listings whose product images look like the upload"""
+    try:
+        contents = await file.read()
+        input_tensor = (await preprocess_pool.run(contents)).unsqueeze(0)
+        embedding = (await loaded.embed_engine.submit(input_tensor))[0].numpy()
+    except QueueFullError as e:
+        raise queue_full(e)
     except Exception as e:
         print(f"Error: {str(e)}")
         raise HTTPException(status_code=500, detail=str(e))
+    
+    # Only vectors produced by the serving checkpoint are comparable
+    matches = await vector_index.search(db, loaded.fingerprint, embedding, k)
+    listings = await fetch_listings(db, [product_id for product_id, _ in matches])
+    products = [
+        dict(listings[product_id], similarity=round(score, 4))
+        for product_id, score in matches if product_id in listings
+    ]
+    return {'success': True, 'index': vector_index.name, 'count': len(products), 'products': products}
+
+@app.get("/api/model")
+async def model_info():
+    """Loaded checkpoint(s) and inference backend details"""
+    info = {'success': True, 'model': require_model().info()}
+    if registry.candidate is not None:
+        info['candidate'] = registry.candidate.info()
+        info['candidate_weight'] = registry.candidate_weight
+    return info
+
+@app.get("/metrics")
+async def metrics():
+    """Prometheus metrics for this worker process"""
+    return PlainTextResponse(metrics_registry.render(), media_type="text/plain; version=0.0.4")
+
+def _queue_depths() -> dict:
+    depths = {('preprocess', ''): preprocess_pool.in_flight, ('orders', ''): order_batcher.queue_depth}
+    for loaded in registry.models():
+        depths[('classifier', loaded.variant)] = loaded.engine.queue_depth
+        depths[('embedding', loaded.variant)] = loaded.embed_engine.queue_depth
+    return depths
+
+def _engine_counter(attribute: str) -> Callable[[], dict]:
+    def read():
+        values = {}
+        for loaded in registry.models():
+            values[('classifier', loaded.variant)] = getattr(loaded.engine, attribute)
+            values[('embedding', loaded.variant)] = getattr(loaded.embed_engine, attribute)
+        return values
+    return read
+
+def _cache_stat(key: str) -> Callable[[], dict]:
+    def read():
+        return {('prediction',): prediction_cache.stats()[key], ('catalogue',): response_cache.stats()[key]}
+    return read
+
+metrics_registry.register(Gauge("queue_depth", "Requests waiting per stage", ("stage", "variant"), _queue_depths))
+metrics_registry.register(Gauge("inference_batches_total", "Forward passes run", ("engine", "variant"), _engine_counter('batches_run'), "counter"))
+metrics_registry.register(Gauge("inference_rows_total", "Images run through forward passes", ("engine", "variant"), _engine_counter('rows_run'), "counter"))
+metrics_registry.register(Gauge("inference_rejected_total", "Requests refused with a full queue", ("engine", "variant"), _engine_counter('rejected'), "counter"))
+metrics_registry.register(Gauge("cache_hits_total", "Cache hits", ("cache",), _cache_stat('hits'), "counter"))
+metrics_registry.register(Gauge("cache_misses_total", "Cache misses", ("cache",), _cache_stat('misses'), "counter"))
+metrics_registry.register(Gauge("cache_hit_ratio", "Cache hit ratio since start", ("cache",), _cache_stat('hit_ratio')))
+metrics_registry.register(Gauge("model_ready", "1 once the model has loaded", (), lambda: {(): 1 if registry.ready else 0}))
+metrics_registry.register(Gauge("model_candidate_weight", "Share of identify traffic routed to the candidate", (),
+                                lambda: {(): registry.candidate_weight if registry.candidate is not None else 0}))
+
+@app.get("/api/identify-part/cache")
+async def prediction_cache_stats():
+    """Prediction cache hit/miss counters"""
+    model = registry.current.fingerprint if registry.ready else None
+    return {'success': True, 'model': model, 'cache': prediction_cache.stats()}
 
 # ============================================
 # MARKETPLACE APIs
 # ============================================
 
+def etag_matches(request: Request, etag: str) -> bool:
+    header = request.headers.get('if-none-match')
+    if not header:
+        return False
+    tags = [tag.strip().removeprefix('W/') for tag in header.split(',')]
+    return '*' in tags or etag in tags
+
+async def cached_json(request: Request, key: str, build: Callable[[], Awaitable[dict]]) -> Response:
+    """Serve a catalogue read from the response cache, with ETag revalidation"""
+    version = await response_cache.version()
+    cache_key = f"{version}:{key}"
+    entry = await response_cache.get(cache_key) if version >= 0 else None
+    hit = entry is not None
+    if not hit:
+        body = JSONResponse(await build()).body
+        entry = (make_etag(body), body)
+        if version >= 0:
+            await response_cache.set(cache_key, entry)
+    
+    etag, body = entry
+    # no-cache: browsers may store it but must revalidate, which costs a 304
+    headers = {'ETag': etag, 'Cache-Control': 'no-cache', 'X-Cache': 'HIT' if hit else 'MISS'}
+    if etag_matches(request, etag):
+        return Response(status_code=304, headers=headers)
+    return Response(content=body, media_type='application/json', headers=headers)
+
 @app.get("/api/products")
 async def get_products(
+    request: Request,
     category: Optional[str] = None,
     search: Optional[str] = None,
-    limit: int = Query(50, le=100)
+    sort: Optional[str] = Query(None, description="id, price_asc, price_desc, newest, stock or relevance (search only)"),
+    cursor: Optional[str] = None,
+    limit: int = Query(50, ge=1, le=100),
+    db: AsyncSession = Depends(get_async_session)
 ):
-    """Get products from marketplace with optional filtering"""
-    db = SessionLocal()
+    """Get products from marketplace with optional filtering, sorting and cursor paging"""
     try:
-        query = db.query(Product).join(Vendor)
-        
-        if category:
-            query = query.filter(Product.category == category)
-        
-        if search:
-            query = query.filter(
-                (Product.name.contains(search)) | 
-                (Product.description.contains(search))
-            )
-        
-        products = query.limit(limit).all()
-        
-        result = []
-        for product in products:
-            result.append({
-                'id': product.id,
-                'name': product.name,
-                'description': product.description,
-                'category': product.category,
-                'price': product.price,
-                'stock': product.stock,
-                'manufacturer': product.manufacturer,
-                'image_url': product.image_url,
-                'vendor': {
-                    'name': product.vendor.name,
-                    'location': product.vendor.location,
-                    'rating': product.vendor.rating
-                }
-            })
-        
-        return {'success': True, 'count': len(result), 'products': result}
+        query, sort, offset = build_listing_query(category, search, sort, cursor, limit)
+    except InvalidListingRequest as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    
+    async def build():
+        if query is None:
+            return {'success': True, 'count': 0, 'products': [], 'next_cursor': None}
+        rows = (await db.execute(query)).mappings().all()
+        result, next_cursor = paginate(rows, sort, offset, limit)
+        return {'success': True, 'count': len(result), 'products': result, 'next_cursor': next_cursor}
     
-    finally:
-        db.close()
+    key = 'products?' + urlencode(sorted(request.query_params.multi_items()))
+    return await cached_json(request, key, build)
 
 @app.get("/api/products/{product_id}")
-async def get_product(product_id: int):
+async def get_product(product_id: int, db: AsyncSession = Depends(get_async_session)):
     """Get single product details"""
-    db = SessionLocal()
-    try:
-        product = db.query(Product).filter(Product.id == product_id).first()
-        
-        if not product:
-            raise HTTPException(status_code=404, detail="Product not found")
-        
-        return {
-            'success': True,
-            'product': {
-                'id': product.id,
-                'name': product.name,
-                'description': product.description,
-                'category': product.category,
-                'price': product.price,
-                'stock': product.stock,
-                'manufacturer': product.manufacturer,
-                'vendor': {
-                    'name': product.vendor.name,
-                    'location': product.vendor.location,
-                    'rating': product.vendor.rating,
-                    'email': product.vendor.email
-                }
-            }
-        }
-    finally:
-        db.close()
+    query = (
+        select(*PRODUCT_COLUMNS, *VENDOR_COLUMNS, Vendor.email.label('vendor_email'))
+        .join(Vendor, Product.vendor_id == Vendor.id)
+        .where(Product.id == product_id)
+    )
+    row = (await db.execute(query)).mappings().first()
+    
+    if not row:
+        raise HTTPException(status_code=404, detail="Product not found")
+    
+    return {
+        'success': True,
+        'product': serialize_product_row(row, vendor_fields=('name', 'location', 'rating', 'email'))
+    }
 
 @app.get("/api/categories")
-async def get_categories():
+async def get_categories(request: Request, db: AsyncSession = Depends(get_async_session)):
     """Get all product categories"""
-    db = SessionLocal()
-    try:
-        categories = db.query(Product.category).distinct().all()
+    async def build():
+        categories = (await db.execute(select(Product.category).distinct())).all()
         return {
             'success': True,
             'categories': [cat[0] for cat in categories if cat[0]]
         }
-    finally:
-        db.close()
+    
+    return await cached_json(request, 'categories', build)
+
+@app.post("/api/catalogue/import", dependencies=[Depends(require_admin)])
+async def import_catalogue(
+    file: UploadFile = File(...),
+    format: Optional[str] = Query(None, description="csv or jsonl (default: from the filename)")
+):
+    """Bulk upsert products from a CSV/JSONL inventory, reporting per-row errors"""
+    try:
+        fmt = format or detect_format(file.filename)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    if fmt not in FORMATS:
+        raise HTTPException(status_code=400, detail=f"Unknown format '{fmt}'")
+    
+    # Categories are validated against the classes the model can identify
+    try:
+        if registry.ready:
+            class_names = registry.current.class_names
+        else:
+            class_names = await asyncio.to_thread(read_class_names, registry.path)
+    except Exception as e:
+        raise HTTPException(status_code=503, detail=f"Model categories unavailable: {e}")
+    
+    # The upload is spooled to disk; parse and write it off the event loop
+    report = await asyncio.to_thread(import_file, file.file, fmt, class_names)
+    return {'success': True, 'format': fmt, **report.to_dict()}
+
+@app.get("/api/catalogue/cache")
+async def response_cache_stats():
+    """Catalogue response cache counters"""
+    return {'success': True, 'cache': response_cache.stats()}
+
+# ============================================
+# MODEL ADMIN
+# ============================================
+
+class ReloadRequest(BaseModel):
+    path: Optional[str] = None
+
+class CandidateRequest(BaseModel):
+    path: str
+    weight: float = Field(0.1, ge=0, le=1)
+
+class RoutingRequest(BaseModel):
+    weight: float = Field(..., ge=0, le=1)
+
+def models_status() -> dict:
+    status = registry.status()
+    status['models'] = [dict(loaded.info(), stats=loaded.stats.summary(), in_flight=loaded.active)
+                        for loaded in registry.models()]
+    return {'success': True, **status}
+
+async def load_or_400(load: Awaitable[LoadedModel]) -> dict:
+    try:
+        await load
+    except Exception as e:
+        # The previous model is still serving
+        raise HTTPException(status_code=400, detail=f"Could not load checkpoint: {e}")
+    return models_status()
+
+@app.get("/api/admin/models", dependencies=[Depends(require_admin)])
+async def admin_models():
+    """Loaded models, routing weight and per-model latency/confidence"""
+    return models_status()
+
+@app.post("/api/admin/models/reload", dependencies=[Depends(require_admin)])
+async def admin_reload(body: Optional[ReloadRequest] = None):
+    """Load a checkpoint (default: the current path) and swap it in as the primary"""
+    return await load_or_400(registry.reload(body.path if body else None))
+
+@app.post("/api/admin/models/candidate", dependencies=[Depends(require_admin)])
+async def admin_load_candidate(body: CandidateRequest):
+    """Load a second checkpoint and route `weight` of identify requests to it"""
+    return await load_or_400(registry.load_candidate(body.path, body.weight))
+
+@app.delete("/api/admin/models/candidate", dependencies=[Depends(require_admin)])
+async def admin_remove_candidate():
+    await registry.remove_candidate()
+    return models_status()
+
+@app.post("/api/admin/models/routing", dependencies=[Depends(require_admin)])
+async def admin_routing(body: RoutingRequest):
+    try:
+        registry.set_weight(body.weight)
+    except ValueError as e:
+        raise HTTPException(status_code=409, detail=str(e))
+    return models_status()
+
+@app.post("/api/admin/models/promote", dependencies=[Depends(require_admin)])
+async def admin_promote():
+    """Make the candidate the primary model"""
+    try:
+        await registry.promote()
+    except ValueError as e:
+        raise HTTPException(status_code=409, detail=str(e))
+    return models_status()
+
+# ============================================
+# ORDERS
+# ============================================
+
+class OrderLine(BaseModel):
+    product_id: int
+    quantity: int = Field(1, ge=1, le=10000)
+
+class OrderRequest(BaseModel):
+    items: List[OrderLine] = Field(..., min_length=1, max_length=ORDER_MAX_LINES)
+
+@app.post("/api/orders", status_code=201)
+async def create_order(order: OrderRequest):
+    """Place an order; every line's stock is reserved atomically or none is"""
+    lines = normalize_lines((item.product_id, item.quantity) for item in order.items)
+    try:
+        placed = await order_batcher.submit(lines)
+    except OrderError as e:
+        raise HTTPException(status_code=e.status_code, detail=e.to_dict())
+    except QueueFullError as e:
+        raise queue_full(e)
+    return {'success': True, 'order': placed}
+
+@app.get("/api/orders/stats")
+async def order_stats():
+    """Order batching counters"""
+    return {'success': True, 'orders': order_batcher.stats()}
+
+@app.get("/api/orders/{reference}")
+async def get_order(reference: str, db: AsyncSession = Depends(get_async_session)):
+    """Get an order by its reference"""
+    order = await fetch_order(db, reference)
+    if order is None:
+        raise HTTPException(status_code=404, detail="Order not found")
+    return {'success': True, 'order': order}
 
 if __name__ == "__main__":
     print("\n" + "="*70)
     print("🔌 current nai API Server")
-    print(f"📋 Components: {num_classes}")
-    print(f"🎯 Accuracy: {checkpoint['val_acc']:.2f}%")
+    print(f"🧠 Model: {registry.path} (loads in background)")
     print("🌐 http://0.0.0.0:8000")
     print("="*70 + "\n")
     uvicorn.run(app, host="0.0.0.0", port=8000)
\ No newline at end of file
@@ -0,0 +1,270 @@
+"""
+Inference backends for current nai
+Quantized, traced/compiled and ONNX Runtime variants of the EfficientNet-B0
+classifier, gated by an accuracy check against the checkpoint's val_acc
+"""
+import contextlib
+import copy
+import os
+import tempfile
+from typing import Callable, List, Optional, Tuple
+
+import torch
+import torch.nn as nn
+
+from inference import IMAGE_SIZE, decode_image
+
+# Backend selection
+INFERENCE_BACKEND = os.getenv("INFERENCE_BACKEND", "eager")
+BACKEND_ACCURACY_TOLERANCE = float(os.getenv("BACKEND_ACCURACY_TOLERANCE", "1.0"))  # percentage points
+VALIDATION_DIR = os.getenv("VALIDATION_DIR", "./dataset/electronic-components/images")
+VALIDATION_IMAGES_PER_CLASS = int(os.getenv("VALIDATION_IMAGES_PER_CLASS", "10"))
+# static_int8 calibration images, taken from the other end of each class directory
+CALIBRATION_IMAGES_PER_CLASS = int(os.getenv("CALIBRATION_IMAGES_PER_CLASS", "4"))
+# Without labelled images a backend's accuracy can't be checked; it is refused unless this is set
+BACKEND_ALLOW_UNVALIDATED = os.getenv("BACKEND_ALLOW_UNVALIDATED", "0") == "1"
+ONNX_DIR = os.getenv("ONNX_DIR", "./models")
+
+BACKENDS = ("eager", "channels_last", "jit", "compile", "dynamic_int8", "static_int8", "onnx")
+CPU_ONLY_BACKENDS = ("dynamic_int8", "static_int8", "onnx")
+
+ForwardFn = Callable[[torch.Tensor], torch.Tensor]
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.bmp', '.webp')
+
+
+def _example_input(batch_size: int = 1) -> torch.Tensor:
+    return torch.randn(batch_size, 3, IMAGE_SIZE, IMAGE_SIZE)
+
+
+def _channels_last(model: nn.Module, device: torch.device) -> ForwardFn:
+    model = copy.deepcopy(model).to(device, memory_format=torch.channels_last)
+
+    def forward(batch):
+        return model(batch.to(device, memory_format=torch.channels_last))
+    return forward
+
+
+def _jit(model: nn.Module, device: torch.device) -> ForwardFn:
+    model = copy.deepcopy(model).to(device, memory_format=torch.channels_last)
+    example = _example_input().to(device, memory_format=torch.channels_last)
+    with torch.no_grad():
+        traced = torch.jit.trace(model, example)
+        traced = torch.jit.optimize_for_inference(torch.jit.freeze(traced))
+
+    def forward(batch):
+        return traced(batch.to(device, memory_format=torch.channels_last))
+    return forward
+
+
+def _compile(model: nn.Module, device: torch.device) -> ForwardFn:
+    model = copy.deepcopy(model).to(device, memory_format=torch.channels_last)
+    # dynamic=True: the engine sends a different batch size almost every call
+    compiled = torch.compile(model, dynamic=True)
+
+    def forward(batch):
+        return compiled(batch.to(device, memory_format=torch.channels_last))
+    return forward
+
+
+def _dynamic_int8(model: nn.Module, device: torch.device) -> ForwardFn:
+    # EfficientNet is conv-heavy; dynamic quantization only covers the Linear head
+    quantized = torch.ao.quantization.quantize_dynamic(
+        copy.deepcopy(model).cpu(), {nn.Linear}, dtype=torch.qint8
+    )
+    return quantized
+
+
+def _static_int8(model: nn.Module, device: torch.device, calibration: torch.Tensor) -> ForwardFn:
+    from torch.ao.quantization import get_default_qconfig_mapping
+    from torch.ao.quantization.quantize_fx import convert_fx, prepare_fx
+
+    float_model = copy.deepcopy(model).cpu().eval()
+    prepared = prepare_fx(float_model, get_default_qconfig_mapping("x86"), (_example_input(),))
+    with torch.no_grad():
+        for chunk in torch.split(calibration, 32):
+            prepared(chunk)
+    return convert_fx(prepared)
+
+
+def _onnx(model: nn.Module, device: torch.device, fingerprint: str) -> ForwardFn:
+    import onnxruntime as ort
+
+    path = os.path.join(ONNX_DIR, f"electronics_{fingerprint}.onnx")
+    if not os.path.exists(path):
+        # Export once per checkpoint; later starts reuse the file. Workers
+        # starting together each export to their own temp file, and the
+        # rename means the .onnx is only ever a complete export.
+        os.makedirs(ONNX_DIR, exist_ok=True)
+        with tempfile.NamedTemporaryFile(dir=ONNX_DIR, prefix=".", suffix=".onnx.tmp", delete=False) as tmp:
+            tmp_path = tmp.name
+        try:
+            torch.onnx.export(
+                copy.deepcopy(model).cpu().eval(), _example_input(), tmp_path,
+                input_names=['input'], output_names=['logits'],
+                dynamic_axes={'input': {0: 'batch'}, 'logits': {0: 'batch'}},
+                opset_version=17,
+            )
+            os.replace(tmp_path, path)
+        except BaseException:
+            with contextlib.suppress(FileNotFoundError):
+                os.unlink(tmp_path)
+            raise
+
+    options = ort.SessionOptions()
+    options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+    session = ort.InferenceSession(path, options, providers=['CPUExecutionProvider'])
+
+    def forward(batch):
+        logits = session.run(None, {'input': batch.cpu().numpy()})[0]
+        return torch.from_numpy(logits)
+    return forward
+
+
+def build_backend(
+    name: str,
+    model: nn.Module,
+    device: torch.device,
+    fingerprint: str,
+    calibration: Optional[torch.Tensor] = None,
+) -> ForwardFn:
+    """Build a forward function (images -> logits) for the named backend"""
+    if name not in BACKENDS:
+        raise ValueError(f"Unknown INFERENCE_BACKEND '{name}' (expected one of {', '.join(BACKENDS)})")
+    if name in CPU_ONLY_BACKENDS and device.type != "cpu":
+        raise ValueError(f"Backend '{name}' only runs on CPU")
+
+    if name == "eager":
+        return model
+    if name == "channels_last":
+        return _channels_last(model, device)
+    if name == "jit":
+        return _jit(model, device)
+    if name == "compile":
+        return _compile(model, device)
+    if name == "dynamic_int8":
+        return _dynamic_int8(model, device)
+    if name == "static_int8":
+        return _static_int8(model, device, calibration if calibration is not None else _example_input(64))
+    return _onnx(model, device, fingerprint)
+
+
+def _load_labelled(class_names: List[str], pick: Callable[[List[str]], List[str]]) -> Optional[Tuple[torch.Tensor, torch.Tensor]]:
+    """Images chosen by `pick` from each VALIDATION_DIR/<class>/ listing, with their labels"""
+    if not os.path.isdir(VALIDATION_DIR):
+        return None
+
+    images, labels = [], []
+    for label, class_name in enumerate(class_names):
+        class_dir = os.path.join(VALIDATION_DIR, class_name)
+        if not os.path.isdir(class_dir):
+            continue
+        files = sorted(f for f in os.listdir(class_dir) if f.lower().endswith(IMAGE_EXTENSIONS))
+        for filename in pick(files):
+            try:
+                with open(os.path.join(class_dir, filename), 'rb') as f:
+                    images.append(decode_image(f.read()))
+                labels.append(label)
+            except Exception as e:
+                print(f"⚠️  Skipping validation image {filename}: {e}")
+
+    if not images:
+        return None
+    return torch.stack(images), torch.tensor(labels)
+
+
+def load_validation_set(class_names: List[str], per_class: int = VALIDATION_IMAGES_PER_CLASS) -> Optional[Tuple[torch.Tensor, torch.Tensor]]:
+    """Labelled images from the end of VALIDATION_DIR/<class>/, or None if unavailable"""
+    if per_class <= 0:
+        return None
+    return _load_labelled(class_names, lambda files: files[-per_class:])
+
+
+def load_calibration_set(
+    class_names: List[str],
+    per_class: int = CALIBRATION_IMAGES_PER_CLASS,
+    held_out: int = VALIDATION_IMAGES_PER_CLASS,
+) -> Optional[torch.Tensor]:
+    """Images from the start of each class directory, never overlapping the `held_out` validation images"""
+    if per_class <= 0:
+        return None
+    calibration = _load_labelled(class_names, lambda files: files[:max(0, min(per_class, len(files) - held_out))])
+    return calibration[0] if calibration is not None else None
+
+
+def _predict(forward: ForwardFn, inputs: torch.Tensor, batch_size: int = 32) -> torch.Tensor:
+    with torch.no_grad():
+        return torch.cat([forward(chunk).argmax(dim=1).cpu() for chunk in torch.split(inputs, batch_size)])
+
+
+def select_backend(
+    name: str,
+    model: nn.Module,
+    device: torch.device,
+    class_names: List[str],
+    val_acc: float,
+    fingerprint: str,
+    tolerance: float = BACKEND_ACCURACY_TOLERANCE,
+    allow_unvalidated: bool = BACKEND_ALLOW_UNVALIDATED,
+) -> Tuple[str, ForwardFn, dict]:
+    """Build the requested backend, falling back to eager if it fails or loses accuracy.
+
+    The regression is the drop in top-1 accuracy relative to the eager model
+    on labelled images; static_int8 is calibrated on a disjoint set of
+    images, so it isn't scored on what it was tuned to. The backend is
+    rejected when `val_acc - regression` falls more than `tolerance` points
+    below val_acc. Without labelled images it is refused, unless
+    BACKEND_ALLOW_UNVALIDATED is set; then only its top-1 agreement with
+    eager on synthetic inputs is checked, which catches a broken backend
+    but says nothing about accuracy.
+    """
+    report = {'requested': name, 'backend': 'eager', 'val_acc': val_acc, 'tolerance': tolerance}
+    if name == "eager":
+        return "eager", model, report
+
+    validation = load_validation_set(class_names)
+    if validation is None and not allow_unvalidated:
+        print(f"⚠️  Backend '{name}' refused: no labelled images in {VALIDATION_DIR} to check its accuracy "
+              f"(set BACKEND_ALLOW_UNVALIDATED=1 to override); using eager")
+        report['error'] = "no labelled validation set"
+        return "eager", model, report
+    calibration = load_calibration_set(class_names) if name == "static_int8" else None
+
+    try:
+        candidate = build_backend(name, model, device, fingerprint, calibration)
+    except Exception as e:
+        print(f"⚠️  Backend '{name}' unavailable ({e}); using eager")
+        report['error'] = str(e)
+        return "eager", model, report
+
+    try:
+        if validation is not None:
+            inputs, labels = validation
+            eager_acc = (_predict(model, inputs.to(device)) == labels).float().mean().item() * 100
+            candidate_acc = (_predict(candidate, inputs) == labels).float().mean().item() * 100
+            regression = max(0.0, eager_acc - candidate_acc)
+            report.update(method='labelled', images=len(labels),
+                          eager_acc=round(eager_acc, 2), candidate_acc=round(candidate_acc, 2))
+            if calibration is not None:
+                report['calibration_images'] = len(calibration)
+        else:
+            print(f"⚠️  Backend '{name}' has no labelled images to check against; "
+                  f"BACKEND_ALLOW_UNVALIDATED is set, so only agreement with eager is checked")
+            inputs = _example_input(128)
+            agreement = (_predict(model, inputs.to(device)) == _predict(candidate, inputs)).float().mean().item()
+            regression = (1 - agreement) * 100
+            report.update(method='agreement', images=len(inputs), agreement=round(agreement, 4), unvalidated=True)
+    except Exception as e:
+        print(f"⚠️  Backend '{name}' failed its accuracy check ({e}); using eager")
+        report['error'] = str(e)
+        return "eager", model, report
+
+    estimated_acc = val_acc - regression
+    report.update(regression=round(regression, 2), estimated_acc=round(estimated_acc, 2))
+    if regression > tolerance:
+        print(f"⚠️  Backend '{name}' blocked: est. accuracy {estimated_acc:.2f}% vs val_acc {val_acc:.2f}% "
+              f"(tolerance {tolerance:.2f} pts); using eager")
+        return "eager", model, report
+
+    print(f"✅ Inference backend: {name} (est. accuracy {estimated_acc:.2f}%)")
+    report['backend'] = name
+    return name, candidate, report
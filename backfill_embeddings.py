@@ -0,0 +1,230 @@
+"""
+Embedding backfill for current nai
+Computes image embeddings for every catalogue product, offline and resumably
+
+    python backfill_embeddings.py                   # into product_embeddings
+    python backfill_embeddings.py --store npy       # into a memory-mapped .npy store
+    python backfill_embeddings.py --force           # recompute everything
+
+Products are streamed from the database in id order, one chunk at a time.
+Each chunk's images are decoded in parallel DataLoader workers and embedded
+in batched forward passes, then written in bulk. Progress is committed after
+every chunk, so an interrupted run picks up where it stopped.
+"""
+import argparse
+import os
+import time
+import urllib.request
+from datetime import datetime
+from typing import Iterator, List, Tuple
+
+import numpy as np
+import torch
+from sqlalchemy import exists, func, select
+from sqlalchemy.dialects import postgresql, sqlite
+from torch.utils.data import DataLoader, Dataset
+
+from database import Product, ProductEmbedding, SessionLocal, engine, prepare_database
+from inference import IMAGE_SIZE, decode_image, make_embedding_fn
+from model_registry import MODEL_PATH, load_model
+from vector_index import EmbeddingStore
+
+# Root that catalogue image URLs like /dataset/... are resolved against
+IMAGE_ROOT = os.getenv("IMAGE_ROOT", ".")
+IMAGE_FETCH_TIMEOUT = float(os.getenv("IMAGE_FETCH_TIMEOUT", "10"))
+
+HAS_IMAGE = (Product.image_url.isnot(None), Product.image_url != '')
+
+
+def read_image(image_url: str, image_root: str = IMAGE_ROOT) -> bytes:
+    """Bytes for a catalogue image: local path under image_root, or http(s) URL"""
+    if image_url.startswith(("http://", "https://")):
+        with urllib.request.urlopen(image_url, timeout=IMAGE_FETCH_TIMEOUT) as response:
+            return response.read()
+    with open(os.path.join(image_root, image_url.lstrip("/")), "rb") as f:
+        return f.read()
+
+
+class CatalogueImages(Dataset):
+    """(product id, preprocessed image) for one chunk; unreadable images yield None"""
+
+    def __init__(self, items: List[Tuple[int, str]], image_root: str = IMAGE_ROOT):
+        self.items = items
+        self.image_root = image_root
+
+    def __len__(self):
+        return len(self.items)
+
+    def __getitem__(self, index):
+        product_id, image_url = self.items[index]
+        try:
+            return product_id, decode_image(read_image(image_url, self.image_root))
+        except Exception as e:
+            print(f"⚠️  Product {product_id}: cannot read {image_url} ({e})")
+            return product_id, None
+
+
+def collate_images(samples):
+    samples = [(product_id, image) for product_id, image in samples if image is not None]
+    if not samples:
+        return torch.empty(0, dtype=torch.long), torch.empty(0, 3, IMAGE_SIZE, IMAGE_SIZE)
+    ids, images = zip(*samples)
+    return torch.tensor(ids), torch.stack(images)
+
+
+def _init_worker(worker_id):
+    # Workers only decode; one thread each leaves the cores to the forward pass
+    torch.set_num_threads(1)
+
+
+def _embedded(model: str):
+    return exists().where(ProductEmbedding.product_id == Product.id, ProductEmbedding.model == model)
+
+
+def count_pending(model: str, after_id: int, last_id: int, skip_done: bool) -> int:
+    query = select(func.count()).select_from(Product).where(Product.id > after_id, Product.id <= last_id, *HAS_IMAGE)
+    if skip_done:
+        query = query.where(~_embedded(model))
+    with SessionLocal() as db:
+        return db.scalar(query)
+
+
+def pending_products(
+    model: str, after_id: int, last_id: int, chunk_size: int, skip_done: bool
+) -> Iterator[List[Tuple[int, str]]]:
+    """Keyset-stream (id, image_url) chunks of products with ids in (after_id, last_id],
+    optionally skipping ones already embedded"""
+    done = _embedded(model)
+    while True:
+        query = (
+            select(Product.id, Product.image_url)
+            .where(Product.id > after_id, Product.id <= last_id, *HAS_IMAGE)
+            .order_by(Product.id)
+            .limit(chunk_size)
+        )
+        if skip_done:
+            query = query.where(~done)
+        with SessionLocal() as db:
+            chunk = [(row.id, row.image_url) for row in db.execute(query)]
+        if not chunk:
+            return
+        yield chunk
+        after_id = chunk[-1][0]
+
+
+def write_embeddings(model: str, ids: np.ndarray, vectors: np.ndarray):
+    """Upsert one chunk of embeddings as a single executemany"""
+    insert = postgresql.insert if engine.dialect.name == "postgresql" else sqlite.insert
+    stmt = insert(ProductEmbedding)
+    stmt = stmt.on_conflict_do_update(
+        index_elements=[ProductEmbedding.product_id, ProductEmbedding.model],
+        set_={'embedding': stmt.excluded.embedding, 'updated_at': stmt.excluded.updated_at},
+    )
+    updated_at = datetime.utcnow()
+    rows = [
+        {'product_id': int(product_id), 'model': model, 'embedding': vector, 'updated_at': updated_at}
+        for product_id, vector in zip(ids, vectors)
+    ]
+    with engine.begin() as conn:
+        conn.execute(stmt, rows)
+
+
+def embed_chunk(embed, items: List[Tuple[int, str]], batch_size: int, workers: int, image_root: str):
+    """Decode a chunk in DataLoader workers and embed it batch by batch"""
+    loader = DataLoader(
+        CatalogueImages(items, image_root),
+        batch_size=batch_size,
+        num_workers=workers,
+        collate_fn=collate_images,
+        worker_init_fn=_init_worker if workers else None,
+        prefetch_factor=4 if workers else None,
+    )
+    all_ids, all_vectors = [], []
+    with torch.inference_mode():
+        for ids, images in loader:
+            if len(ids):
+                all_ids.append(ids.numpy())
+                all_vectors.append(embed(images).numpy())
+    if not all_ids:
+        return np.empty(0, dtype=np.int64), None
+    return np.concatenate(all_ids), np.concatenate(all_vectors)
+
+
+def backfill(
+    model_path: str = MODEL_PATH,
+    store: str = "db",
+    chunk_size: int = 4096,
+    batch_size: int = 64,
+    workers: int = max(1, (os.cpu_count() or 2) - 1),
+    force: bool = False,
+    image_root: str = IMAGE_ROOT,
+):
+    device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
+    loaded = load_model(model_path, device, backend="eager")
+    embed = make_embedding_fn(loaded.model, device)
+    model = loaded.fingerprint
+
+    prepare_database()
+    # Products added while the run is going are left for the next run, so the
+    # count (and the .npy store's capacity) matches what is streamed
+    with SessionLocal() as db:
+        last_id = db.scalar(select(func.max(Product.id))) or 0
+    after_id = 0
+    skip_done = store == "db" and not force
+    npy_store = None
+    if store == "npy":
+        npy_store = EmbeddingStore(model)
+        if force:
+            npy_store.reset()
+        # The store is filled in id order, so resuming is a keyset from last_id
+        after_id = npy_store.last_id
+        npy_store.open_for_write(npy_store.rows + count_pending(model, after_id, last_id, skip_done))
+        print(f"📦 Writing to {npy_store.path} (resuming after {npy_store.rows} rows)")
+
+    total = count_pending(model, after_id, last_id, skip_done)
+    print(f"🧠 Model {model}, {total} products to scan, batch {batch_size}, {workers} decode workers")
+
+    started = time.perf_counter()
+    scanned = embedded = 0
+    for items in pending_products(model, after_id, last_id, chunk_size, skip_done):
+        ids, vectors = embed_chunk(embed, items, batch_size, workers, image_root)
+        if len(ids):
+            if npy_store is not None:
+                npy_store.append(ids, vectors)
+            else:
+                write_embeddings(model, ids, vectors)
+        if npy_store is not None:
+            # Skipped images still advance the keyset, so they aren't retried forever
+            npy_store.last_id = items[-1][0]
+            npy_store.flush()
+
+        scanned += len(items)
+        embedded += len(ids)
+        elapsed = time.perf_counter() - started
+        rate = scanned / elapsed if elapsed else 0.0
+        print(f"   {scanned}/{total} scanned, {embedded} embedded, {rate:.1f} img/s, "
+              f"ETA {max(total - scanned, 0) / rate / 60 if rate else 0:.1f} min")
+
+    elapsed = time.perf_counter() - started
+    print(f"✅ Backfill complete: {embedded} embeddings in {elapsed:.1f}s")
+    return embedded
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Backfill product image embeddings")
+    parser.add_argument("--model", default=MODEL_PATH, help="checkpoint path (default: MODEL_PATH)")
+    parser.add_argument("--store", choices=("db", "npy"), default="db",
+                        help="product_embeddings table, or a memory-mapped .npy store per checkpoint")
+    parser.add_argument("--chunk-size", type=int, default=4096, help="products read from the database per chunk")
+    parser.add_argument("--batch-size", type=int, default=64, help="images per forward pass")
+    parser.add_argument("--workers", type=int, default=max(1, (os.cpu_count() or 2) - 1),
+                        help="DataLoader decode workers (0 decodes in-process)")
+    parser.add_argument("--image-root", default=IMAGE_ROOT, help="directory image URLs are relative to")
+    parser.add_argument("--force", action="store_true", help="recompute embeddings that already exist")
+    args = parser.parse_args()
+
+    backfill(args.model, args.store, args.chunk_size, args.batch_size, args.workers, args.force, args.image_root)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,158 @@
+"""
+Mixed read throughput: blocking sync sessions vs the async (aiosqlite) layer
+
+Seeds a throwaway SQLite catalogue through the database.py models, then runs
+`--concurrency` coroutines issuing the marketplace read mix (listing pages,
+category pages, search, product detail, categories) for `--seconds`. The
+same mix is run through a sync Session called inside the coroutines, which
+is what the routes used to do, and through AsyncSession on the async engine.
+
+Besides throughput and latency it reports event-loop lag: how late a 1 ms
+ticker wakes up. That lag is what every other request on the worker, such as
+identify uploads and static files, waits behind.
+
+    python benchmarks/bench_db_concurrency.py --products 100000 --concurrency 1,8,32
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import statistics
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from sqlalchemy import create_engine, event, select  # noqa: E402
+from sqlalchemy.ext.asyncio import async_sessionmaker  # noqa: E402
+from sqlalchemy.orm import sessionmaker  # noqa: E402
+
+from catalog import PRODUCT_COLUMNS, VENDOR_COLUMNS, build_listing_query, paginate  # noqa: E402
+from database import (  # noqa: E402
+    Product, Vendor, _sqlite_pragmas, ensure_indexes, ensure_search_index, make_async_engine
+)
+
+from common import CATEGORIES, percentile, seed_catalogue  # noqa: E402
+
+WORDS = ["capacitor", "resistor", "transistor", "relay", "diode", "regulator", "sensor", "module"]
+
+
+def seed(engine, size: int):
+    seed_catalogue(engine, size, seed=size, product=lambda rng, n: {
+        'name': f"{rng.choice(WORDS).title()} LM{n % 1000}", 'description': f"Synthetic {rng.choice(WORDS)} part",
+        'manufacturer': 'Generic'
+    })
+    ensure_indexes(engine)
+    ensure_search_index(engine)
+
+
+def next_statement(rng: random.Random, size: int):
+    """One request from the read mix, as (statement, listing sort/offset or None)"""
+    roll = rng.random()
+    if roll < 0.35:
+        query, sort, offset = build_listing_query(sort='price_asc', limit=50)
+    elif roll < 0.65:
+        query, sort, offset = build_listing_query(category=rng.choice(CATEGORIES), sort='newest', limit=50)
+    elif roll < 0.75:
+        query, sort, offset = build_listing_query(search=rng.choice(WORDS)[:4], limit=50)
+    elif roll < 0.95:
+        query = (
+            select(*PRODUCT_COLUMNS, *VENDOR_COLUMNS)
+            .join(Vendor, Product.vendor_id == Vendor.id)
+            .where(Product.id == rng.randint(1, size))
+        )
+        return query, None
+    else:
+        return select(Product.category).distinct(), None
+    return query, (sort, offset)
+
+
+async def loop_lag_probe(stop: asyncio.Event, samples: list):
+    while not stop.is_set():
+        started = time.perf_counter()
+        await asyncio.sleep(0.001)
+        samples.append((time.perf_counter() - started - 0.001) * 1000)
+
+
+async def run_mode(mode: str, db_url: str, size: int, concurrency: int, seconds: float) -> dict:
+    latencies, lag = [], []
+    stop = asyncio.Event()
+
+    if mode == 'sync':
+        engine = create_engine(db_url, connect_args={"check_same_thread": False})
+        event.listen(engine, "connect", _sqlite_pragmas)
+        Session = sessionmaker(bind=engine)
+
+        async def execute(statement):
+            db = Session()
+            try:
+                return db.execute(statement).mappings().all()
+            finally:
+                db.close()
+    else:
+        engine = make_async_engine(db_url)
+        Session = async_sessionmaker(engine, expire_on_commit=False)
+
+        async def execute(statement):
+            async with Session() as db:
+                return (await db.execute(statement)).mappings().all()
+
+    async def client(seed_value: int):
+        rng = random.Random(seed_value)
+        while not stop.is_set():
+            statement, listing = next_statement(rng, size)
+            started = time.perf_counter()
+            rows = await execute(statement)
+            if listing is not None:
+                paginate(rows, listing[0], listing[1], 50)
+            latencies.append((time.perf_counter() - started) * 1000)
+            await asyncio.sleep(0)
+
+    probe = asyncio.create_task(loop_lag_probe(stop, lag))
+    clients = [asyncio.create_task(client(i)) for i in range(concurrency)]
+    started = time.perf_counter()
+    await asyncio.sleep(seconds)
+    stop.set()
+    await asyncio.gather(probe, *clients)
+    elapsed = time.perf_counter() - started
+
+    if mode == 'sync':
+        engine.dispose()
+    else:
+        await engine.dispose()
+
+    return {
+        'mode': mode,
+        'concurrency': concurrency,
+        'requests_per_sec': round(len(latencies) / elapsed, 1),
+        'p50_ms': round(statistics.median(latencies), 2),
+        'p95_ms': round(percentile(latencies, 95), 2),
+        'loop_lag_p95_ms': round(percentile(lag, 95), 2) if lag else None,
+        'loop_lag_max_ms': round(max(lag), 2) if lag else None,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--products', type=int, default=100_000)
+    parser.add_argument('--concurrency', default='1,8,32')
+    parser.add_argument('--seconds', type=float, default=5)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        db_url = f"sqlite:///{tmp}/bench.db"
+        seed_engine = create_engine(db_url)
+        seed(seed_engine, args.products)
+        seed_engine.dispose()
+
+        report = []
+        for concurrency in (int(c) for c in args.concurrency.split(',')):
+            for mode in ('sync', 'async'):
+                report.append(asyncio.run(run_mode(mode, db_url, args.products, concurrency, args.seconds)))
+        print(json.dumps({'products': args.products, 'results': report}, indent=2))
+
+
+if __name__ == '__main__':
+    main()
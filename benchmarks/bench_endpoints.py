@@ -0,0 +1,321 @@
+"""
+End-to-end benchmark for the identify and marketplace endpoints
+
+For each `--sizes` value a fresh process seeds a throwaway SQLite catalogue
+with synthetic products through the database.py models, boots the real app
+in-process (ASGI transport, lifespan included) and drives every scenario
+at each `--concurrency` level:
+
+    identify           POST /api/identify-part with a synthesized JPEG
+    products           GET /api/products, random sort
+    products_search    GET /api/products?search=<term>
+    products_category  GET /api/products?category=<class>
+    categories         GET /api/categories
+
+Throughput, p50/p95/p99 latency and process RSS are reported as JSON, with
+the git commit and library versions, so runs can be diffed across commits:
+
+    python benchmarks/bench_endpoints.py --sizes 1000,100000 --concurrency 1,8,32 --output before.json
+
+When MODEL_PATH doesn't exist a randomly initialized EfficientNet-B0 is
+used; predictions are meaningless but the cost of a forward pass is the
+same. Caches are kept cold by default: every identify upload is unique and
+the catalogue response cache is invalidated before each request, so the
+numbers measure decode, inference and SQL. `--warm-cache` leaves both
+caches on, and `cache_hit_ratio` reports how often they answered.
+"""
+import argparse
+import asyncio
+import io
+import itertools
+import json
+import multiprocessing
+import os
+import platform
+import queue
+import random
+import resource
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from common import percentile, seed_catalogue  # noqa: E402
+
+SCENARIOS = ('identify', 'products', 'products_search', 'products_category', 'categories')
+SORTS = ('id', 'price_asc', 'price_desc', 'newest', 'stock')
+# Product names and descriptions are drawn from these, so every search term has hits
+WORDS = ('ceramic', 'smd', 'through-hole', 'precision', 'low-noise', 'high-voltage', 'miniature',
+         'audio', 'power', 'signal', 'switching', 'automotive', 'industrial', 'dual', 'quad', 'logic')
+MANUFACTURERS = ('Murata', 'Nichicon', 'Vishay', 'Texas Instruments', 'STMicro', 'Omron', 'Yageo', 'Kemet')
+NUM_RANDOM_CLASSES = 36
+
+# Numbers every identify upload in the process, so no two are byte-identical
+_uploads = itertools.count()
+
+
+# ============================================
+# FIXTURES
+# ============================================
+
+def random_checkpoint(path: str, num_classes: int = NUM_RANDOM_CLASSES):
+    """Save a seeded, randomly initialized EfficientNet-B0 checkpoint"""
+    import torch
+
+    from inference import build_model
+
+    torch.manual_seed(0)
+    class_names = [f"component-{i:02d}" for i in range(num_classes)]
+    torch.save({'model_state_dict': build_model(num_classes).state_dict(),
+                'class_names': class_names, 'val_acc': 0.0}, path)
+
+
+def synthesize_images(count: int, size: int, seed: int) -> list:
+    """JPEG photos-to-be: noise background with a few coloured shapes, like a part on a desk"""
+    from PIL import Image, ImageDraw
+
+    rng = random.Random(seed)
+    images = []
+    for i in range(count):
+        width, height = size, size * 3 // 4
+        image = Image.effect_noise((width, height), rng.uniform(20, 80)).convert('RGB')
+        draw = ImageDraw.Draw(image)
+        for _ in range(rng.randint(1, 4)):
+            x0, y0 = rng.randrange(width // 2), rng.randrange(height // 2)
+            box = (x0, y0, x0 + rng.randint(20, width // 2), y0 + rng.randint(20, height // 2))
+            colour = tuple(rng.randrange(256) for _ in range(3))
+            (draw.ellipse if rng.random() < 0.5 else draw.rectangle)(box, fill=colour)
+        buf = io.BytesIO()
+        image.save(buf, format='JPEG', quality=90)
+        images.append(buf.getvalue())
+    return images
+
+
+def rss_mb() -> float:
+    """Current resident set size of this process"""
+    try:
+        with open('/proc/self/status') as f:
+            for line in f:
+                if line.startswith('VmRSS:'):
+                    return round(int(line.split()[1]) / 1024, 1)
+    except OSError:
+        pass
+    return peak_rss_mb()
+
+
+def peak_rss_mb() -> float:
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # kB on Linux, bytes on macOS
+    return round(peak / (1024 * 1024 if sys.platform == 'darwin' else 1024), 1)
+
+
+# ============================================
+# LOAD GENERATION
+# ============================================
+
+def make_request(scenario: str, rng: random.Random, images: list, class_names: list, cold: bool):
+    """(method, url, httpx kwargs) for one request of a scenario"""
+    if scenario == 'identify':
+        image = rng.choice(images)
+        if cold:
+            # Trailing bytes after the JPEG end marker are ignored by the decoder but
+            # give every upload its own content hash, so the prediction cache misses
+            image += next(_uploads).to_bytes(8, 'little')
+        return 'POST', '/api/identify-part', {'files': {'file': ('part.jpg', image, 'image/jpeg')}}
+    if scenario == 'products':
+        return 'GET', '/api/products', {'params': {'sort': rng.choice(SORTS)}}
+    if scenario == 'products_search':
+        return 'GET', '/api/products', {'params': {'search': rng.choice(WORDS)}}
+    if scenario == 'products_category':
+        return 'GET', '/api/products', {'params': {'category': rng.choice(class_names), 'sort': rng.choice(SORTS)}}
+    return 'GET', '/api/categories', {}
+
+
+async def drive(http, scenario: str, concurrency: int, total: int, images: list, class_names: list,
+                cold: bool, seed: int) -> dict:
+    import api_server
+
+    issued = 0
+    latencies, statuses, cache_hits = [], {}, 0
+
+    async def client(rng: random.Random):
+        nonlocal issued, cache_hits
+        while issued < total:
+            issued += 1
+            method, url, kwargs = make_request(scenario, rng, images, class_names, cold)
+            if cold:
+                api_server.response_cache.bump()
+            started = time.perf_counter()
+            response = await http.request(method, url, **kwargs)
+            latencies.append((time.perf_counter() - started) * 1000)
+            statuses[response.status_code] = statuses.get(response.status_code, 0) + 1
+            if response.headers.get('x-cache') == 'HIT' or (scenario == 'identify' and response.status_code == 200
+                                                            and response.json().get('cached')):
+                cache_hits += 1
+
+    started = time.perf_counter()
+    await asyncio.gather(*(client(random.Random(seed * 1000 + i)) for i in range(concurrency)))
+    elapsed = time.perf_counter() - started
+
+    return {
+        'concurrency': concurrency,
+        'requests': len(latencies),
+        'statuses': {str(k): v for k, v in sorted(statuses.items())},
+        'throughput_rps': round(len(latencies) / elapsed, 1),
+        'p50_ms': round(statistics.median(latencies), 2),
+        'p95_ms': round(percentile(latencies, 95), 2),
+        'p99_ms': round(percentile(latencies, 99), 2),
+        'cache_hit_ratio': round(cache_hits / len(latencies), 3),
+        'rss_mb': rss_mb(),
+    }
+
+
+async def bench_app(args, size: int) -> dict:
+    import httpx
+
+    import api_server
+
+    class_names = api_server.read_class_names(api_server.registry.path)
+    images = synthesize_images(args.images, args.image_size, args.seed)
+    scenarios = args.scenarios.split(',')
+    concurrency_levels = [int(c) for c in args.concurrency.split(',')]
+    results = {}
+
+    async with api_server.app.router.lifespan_context(api_server.app):
+        deadline = time.perf_counter() + args.model_timeout
+        while api_server.registry.state == 'loading' and time.perf_counter() < deadline:
+            await asyncio.sleep(0.1)
+        model = api_server.registry.current.info() if api_server.registry.ready else None
+        boot_rss = rss_mb()
+
+        transport = httpx.ASGITransport(app=api_server.app)
+        async with httpx.AsyncClient(transport=transport, base_url='http://bench', timeout=120) as http:
+            for scenario in scenarios:
+                if scenario == 'identify' and model is None:
+                    results[scenario] = {'error': f"model not ready ({api_server.registry.state})"}
+                    continue
+                # Warm-up: first-request costs (lazy imports, page cache, query plans) aren't measured
+                await drive(http, scenario, 1, args.warmup, images, class_names, not args.warm_cache, args.seed)
+                results[scenario] = [
+                    await drive(http, scenario, level, args.requests, images, class_names,
+                                not args.warm_cache, args.seed)
+                    for level in concurrency_levels
+                ]
+
+    return {
+        'products': size,
+        'model': {'fingerprint': model['fingerprint'], 'num_classes': model['num_classes'],
+                  'backend': api_server.registry.current.backend_name} if model else None,
+        'boot_rss_mb': boot_rss,
+        'peak_rss_mb': peak_rss_mb(),
+        'scenarios': results,
+    }
+
+
+def bench_size(args, size: int, model_path: str, db_path: str, results):
+    """Runs in its own process: the app binds DATABASE_URL and MODEL_PATH at import"""
+    os.environ['DATABASE_URL'] = f"sqlite:///{db_path}"
+    os.environ['MODEL_PATH'] = model_path
+    os.chdir(ROOT)
+
+    from database import engine
+    from model_registry import read_class_names
+
+    started = time.perf_counter()
+    class_names = read_class_names(model_path)
+    seed_catalogue(engine, size, args.seed, categories=class_names, product=lambda rng, n: {
+        'name': f"{rng.choice(WORDS).title()} {rng.choice(class_names)} {n}",
+        'description': ' '.join(rng.sample(WORDS, 4)), 'manufacturer': rng.choice(MANUFACTURERS)
+    })
+    seed_seconds = time.perf_counter() - started
+
+    report = asyncio.run(bench_app(args, size))
+    results.put({'seed_seconds': round(seed_seconds, 1), **report})
+
+
+# ============================================
+# REPORT
+# ============================================
+
+def environment() -> dict:
+    import torch
+
+    try:
+        commit = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=ROOT, capture_output=True,
+                                text=True, check=True).stdout.strip()
+        dirty = bool(subprocess.run(['git', 'status', '--porcelain', '--untracked-files=no'], cwd=ROOT,
+                                    capture_output=True, text=True).stdout.strip())
+    except (OSError, subprocess.CalledProcessError):
+        commit, dirty = None, None
+    return {
+        'commit': commit,
+        'dirty': dirty,
+        'python': platform.python_version(),
+        'torch': torch.__version__,
+        'cpus': os.cpu_count(),
+        'platform': platform.platform(),
+    }
+
+
+def main():
+    from model_registry import MODEL_PATH
+
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--sizes', default='1000,100000', help='catalogue sizes (products)')
+    parser.add_argument('--concurrency', default='1,8,32', help='concurrent clients per run')
+    parser.add_argument('--requests', type=int, default=200, help='requests per scenario and concurrency level')
+    parser.add_argument('--warmup', type=int, default=10, help='unmeasured requests before each scenario')
+    parser.add_argument('--scenarios', default=','.join(SCENARIOS), help='subset of ' + ','.join(SCENARIOS))
+    parser.add_argument('--images', type=int, default=32, help='distinct synthetic images')
+    parser.add_argument('--image-size', type=int, default=1024, help='synthetic image width in pixels')
+    parser.add_argument('--model', default=MODEL_PATH, help='checkpoint (random weights if it does not exist)')
+    parser.add_argument('--model-timeout', type=float, default=300, help='seconds to wait for the model to load')
+    parser.add_argument('--warm-cache', action='store_true', help='leave the prediction and response caches on')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', help='also write the JSON report to this file')
+    args = parser.parse_args()
+
+    unknown = set(args.scenarios.split(',')) - set(SCENARIOS)
+    if unknown:
+        parser.error(f"unknown scenarios: {', '.join(sorted(unknown))}")
+
+    report = {'environment': environment(), 'args': vars(args), 'results': []}
+    with tempfile.TemporaryDirectory() as tmp:
+        model_path = args.model
+        if not os.path.exists(model_path):
+            model_path = os.path.join(tmp, 'random-efficientnet.pth')
+            random_checkpoint(model_path)
+            print(f"⚠️  {args.model} not found; using randomly initialized weights", file=sys.stderr)
+        report['random_weights'] = model_path != args.model
+
+        # spawn: every size gets a fresh interpreter, so RSS and caches start clean
+        ctx = multiprocessing.get_context('spawn')
+        for size in (int(s) for s in args.sizes.split(',')):
+            print(f"📦 {size} products...", file=sys.stderr)
+            results = ctx.Queue()
+            process = ctx.Process(target=bench_size,
+                                  args=(args, size, model_path, os.path.join(tmp, f"bench-{size}.db"), results))
+            process.start()
+            while True:
+                try:
+                    report['results'].append(results.get(timeout=1))
+                    break
+                except queue.Empty:
+                    if not process.is_alive():
+                        report['results'].append({'products': size, 'error': f"exit code {process.exitcode}"})
+                        break
+            process.join()
+
+    output = json.dumps(report, indent=2)
+    print(output)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(output + '\n')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,191 @@
+"""
+Checkout load test: many concurrent clients ordering one hot SKU
+
+Seeds a throwaway SQLite catalogue with one hot product (`--stock` units)
+and a few cold ones. Each API process runs the real app in-process (ASGI
+transport, lifespan included) and `--clients` coroutines POST /api/orders
+until the hot SKU sells out. `--overcommit` sets how many more orders
+are attempted than there is stock, and `--multi-line` sets the fraction of
+orders that also take a cold SKU in the same checkout.
+
+Several `--processes` hit the same database file at once, like gunicorn
+workers. Each `--batch-sizes` value is run from the same starting stock, so
+ORDER_BATCH_SIZE=1 (a commit per order) can be compared with group commit.
+
+After each run the database is audited: units sold of the hot SKU must
+equal the stock taken, stock must never go negative, and no cold SKU may
+lose stock without a matching order. Any difference is reported as
+oversold.
+
+    python benchmarks/bench_orders.py --stock 2000 --clients 64 --processes 2 --batch-sizes 1,64
+"""
+import argparse
+import asyncio
+import json
+import multiprocessing
+import os
+import random
+import statistics
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+HOT_ID = 1
+COLD_IDS = (2, 3, 4, 5)
+COLD_STOCK = 10_000_000
+
+
+def seed(db_url: str, stock: int):
+    from sqlalchemy import create_engine, delete, insert
+
+    from database import Base, Order, Product, Vendor
+
+    engine = create_engine(db_url)
+    Base.metadata.create_all(engine)
+    with engine.begin() as conn:
+        conn.execute(delete(Order))
+        conn.execute(delete(Product))
+        conn.execute(delete(Vendor))
+        conn.execute(insert(Vendor), [{'id': 1, 'name': 'Vendor', 'email': 'v@example.com', 'location': 'Dhaka'}])
+        conn.execute(insert(Product), [
+            {'id': product_id, 'name': f"Part {product_id}", 'category': 'LED', 'price': 10.0 + product_id,
+             'stock': stock if product_id == HOT_ID else COLD_STOCK, 'vendor_id': 1}
+            for product_id in (HOT_ID, *COLD_IDS)
+        ])
+    engine.dispose()
+
+
+def audit(db_url: str, stock: int) -> dict:
+    from sqlalchemy import create_engine, func, select
+
+    from database import Order, Product
+
+    engine = create_engine(db_url)
+    with engine.connect() as conn:
+        stocks = dict(conn.execute(select(Product.id, Product.stock)).all())
+        sold = dict(conn.execute(select(Order.product_id, func.sum(Order.quantity)).group_by(Order.product_id)).all())
+    engine.dispose()
+
+    hot_sold = sold.get(HOT_ID, 0)
+    oversold = max(0, hot_sold - stock)
+    # Stock taken without a matching order, or orders without stock taken
+    mismatched = abs((stock - stocks[HOT_ID]) - hot_sold) + sum(
+        abs((COLD_STOCK - stocks[product_id]) - sold.get(product_id, 0)) for product_id in COLD_IDS
+    )
+    return {
+        'hot_sold': hot_sold,
+        'hot_stock_left': stocks[HOT_ID],
+        'oversold': oversold + mismatched + (1 if stocks[HOT_ID] < 0 else 0),
+    }
+
+
+def api_process(db_url: str, batch_size: int, clients: int, attempts: int, multi_line: float, seed_value: int, results):
+    """One API worker: boots the app in-process and drives `attempts` orders through it"""
+    os.environ['DATABASE_URL'] = db_url
+    os.environ['ORDER_BATCH_SIZE'] = str(batch_size)
+    os.environ['MODEL_PATH'] = os.path.join(ROOT, 'benchmarks', 'no-model.pth')  # the model isn't needed
+    os.chdir(ROOT)
+    results.put(asyncio.run(drive(clients, attempts, multi_line, seed_value)))
+
+
+async def drive(clients: int, attempts: int, multi_line: float, seed_value: int) -> dict:
+    import httpx
+
+    import api_server
+
+    remaining = attempts
+    latencies, statuses = [], {}
+
+    async def client(http: httpx.AsyncClient, rng: random.Random):
+        nonlocal remaining
+        while remaining > 0:
+            remaining -= 1
+            items = [{'product_id': HOT_ID, 'quantity': 1}]
+            if rng.random() < multi_line:
+                items.append({'product_id': rng.choice(COLD_IDS), 'quantity': rng.randint(1, 3)})
+            started = time.perf_counter()
+            response = await http.post('/api/orders', json={'items': items})
+            latencies.append((time.perf_counter() - started) * 1000)
+            statuses[response.status_code] = statuses.get(response.status_code, 0) + 1
+
+    async with api_server.app.router.lifespan_context(api_server.app):
+        transport = httpx.ASGITransport(app=api_server.app)
+        async with httpx.AsyncClient(transport=transport, base_url='http://bench') as http:
+            started = time.perf_counter()
+            await asyncio.gather(*(client(http, random.Random(seed_value * 1000 + i)) for i in range(clients)))
+            elapsed = time.perf_counter() - started
+        stats = api_server.order_batcher.stats()
+
+    return {'elapsed': elapsed, 'latencies': latencies, 'statuses': statuses,
+            'orders_per_batch': stats['orders_per_batch']}
+
+
+def run(db_url: str, args, batch_size: int) -> dict:
+    seed(db_url, args.stock)
+    attempts = int(args.stock * args.overcommit)
+    per_process = [attempts // args.processes + (1 if i < attempts % args.processes else 0)
+                   for i in range(args.processes)]
+
+    # spawn: each worker imports torch and the app fresh, like a real server process
+    ctx = multiprocessing.get_context('spawn')
+    results = ctx.Queue()
+    processes = [
+        ctx.Process(target=api_process, args=(db_url, batch_size, args.clients, n, args.multi_line, i, results))
+        for i, n in enumerate(per_process)
+    ]
+    for process in processes:
+        process.start()
+    outcomes = [results.get() for _ in processes]
+    for process in processes:
+        process.join()
+
+    latencies = sorted(ms for outcome in outcomes for ms in outcome['latencies'])
+    statuses = {}
+    for outcome in outcomes:
+        for status, count in outcome['statuses'].items():
+            statuses[status] = statuses.get(status, 0) + count
+    elapsed = max(outcome['elapsed'] for outcome in outcomes)
+    placed = statuses.get(201, 0)
+
+    return {
+        'batch_size': batch_size,
+        'processes': args.processes,
+        'clients_per_process': args.clients,
+        'attempts': attempts,
+        'placed': placed,
+        'refused': statuses.get(409, 0),
+        'statuses': {str(k): v for k, v in sorted(statuses.items())},
+        'orders_per_sec': round(placed / elapsed, 1),
+        'attempts_per_sec': round(len(latencies) / elapsed, 1),
+        'p50_ms': round(statistics.median(latencies), 2),
+        'p95_ms': round(latencies[int(0.95 * (len(latencies) - 1))], 2),
+        'p99_ms': round(latencies[int(0.99 * (len(latencies) - 1))], 2),
+        'orders_per_batch': [outcome['orders_per_batch'] for outcome in outcomes],
+        **audit(db_url, args.stock),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--stock', type=int, default=2000, help='units of the hot SKU')
+    parser.add_argument('--overcommit', type=float, default=1.5, help='orders attempted per unit of stock')
+    parser.add_argument('--clients', type=int, default=64, help='concurrent clients per process')
+    parser.add_argument('--processes', type=int, default=2, help='API worker processes sharing the database')
+    parser.add_argument('--multi-line', type=float, default=0.3, help='fraction of orders with a second line')
+    parser.add_argument('--batch-sizes', default='1,64', help='ORDER_BATCH_SIZE values to compare')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        db_url = f"sqlite:///{tmp}/orders.db"
+        report = [run(db_url, args, int(size)) for size in args.batch_sizes.split(',')]
+
+    print(json.dumps({'stock': args.stock, 'results': report}, indent=2))
+    if any(result['oversold'] for result in report):
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,98 @@
+"""
+Listing latency vs catalogue size
+
+Seeds throwaway SQLite databases with synthetic products through the
+database.py models and times the /api/products listing queries built by
+catalog.build_listing_query: first pages, category-filtered pages and deep
+keyset pages reached by following cursors. With the composite indexes the
+p95 should stay flat as the catalogue grows.
+
+    python benchmarks/bench_pagination.py --sizes 1000,10000,100000,1000000
+"""
+import argparse
+import json
+import os
+import random
+import statistics
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from sqlalchemy import create_engine  # noqa: E402
+
+from catalog import build_listing_query, paginate  # noqa: E402
+from database import ensure_indexes  # noqa: E402
+
+from common import CATEGORIES, percentile, seed_catalogue  # noqa: E402
+SCENARIOS = {
+    'first_page': dict(sort='id'),
+    'price_asc': dict(sort='price_asc'),
+    'newest': dict(sort='newest'),
+    'category_price': dict(sort='price_asc', category=True),
+    'category_stock': dict(sort='stock', category=True),
+}
+
+
+def seed(engine, size: int):
+    seed_catalogue(engine, size, seed=size)
+    ensure_indexes(engine)
+
+
+def run_page(conn, limit: int, cursor=None, **filters):
+    query, sort, offset = build_listing_query(cursor=cursor, limit=limit, **filters)
+    started = time.perf_counter()
+    rows = conn.execute(query).mappings().all()
+    _, next_cursor = paginate(rows, sort, offset, limit)
+    return (time.perf_counter() - started) * 1000, next_cursor
+
+
+def bench_size(size: int, repeats: int, depth: int, limit: int) -> dict:
+    with tempfile.TemporaryDirectory() as tmp:
+        engine = create_engine(f"sqlite:///{tmp}/bench.db")
+        started = time.perf_counter()
+        seed(engine, size)
+        seed_seconds = time.perf_counter() - started
+        rng = random.Random(0)
+
+        results = {}
+        with engine.connect() as conn:
+            for name, scenario in SCENARIOS.items():
+                first, deep = [], []
+                for _ in range(repeats):
+                    filters = {'sort': scenario['sort']}
+                    if scenario.get('category'):
+                        filters['category'] = rng.choice(CATEGORIES)
+                    ms, cursor = run_page(conn, limit, **filters)
+                    first.append(ms)
+                    # Follow cursors `depth` pages in; keyset cost must not grow with depth
+                    for _ in range(depth):
+                        if cursor is None:
+                            break
+                        ms, cursor = run_page(conn, limit, cursor=cursor, **filters)
+                    deep.append(ms)
+                results[name] = {
+                    'first_p50_ms': round(statistics.median(first), 3),
+                    'first_p95_ms': round(percentile(first, 95), 3),
+                    'deep_p50_ms': round(statistics.median(deep), 3),
+                    'deep_p95_ms': round(percentile(deep, 95), 3),
+                }
+        engine.dispose()
+    return {'products': size, 'seed_seconds': round(seed_seconds, 1), 'scenarios': results}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--sizes', default='1000,10000,100000,1000000')
+    parser.add_argument('--repeats', type=int, default=50)
+    parser.add_argument('--depth', type=int, default=20, help='pages followed for the deep-page timing')
+    parser.add_argument('--limit', type=int, default=50)
+    args = parser.parse_args()
+
+    report = [bench_size(int(size), args.repeats, args.depth, args.limit) for size in args.sizes.split(',')]
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == '__main__':
+    main()
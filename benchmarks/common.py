@@ -0,0 +1,53 @@
+"""
+Shared fixtures for the benchmark scripts
+
+Seeds a synthetic catalogue through the database.py models and computes
+latency percentiles. Only the product names, descriptions and manufacturers
+differ between benchmarks, so each script passes its own `product` factory.
+"""
+import random
+from datetime import datetime, timedelta
+
+CATEGORIES = [f"category-{i:02d}" for i in range(36)]
+NUM_VENDORS = 50
+
+
+def plain_product(rng: random.Random, n: int) -> dict:
+    return {'name': f"Part {n}", 'description': "Synthetic benchmark part", 'manufacturer': 'Generic'}
+
+
+def seed_catalogue(engine, size: int, seed: int, categories=CATEGORIES, product=plain_product,
+                   batch: int = 50_000):
+    """Fill an empty database with NUM_VENDORS vendors and `size` synthetic products
+
+    `product(rng, n)` supplies the name, description and manufacturer of
+    product n; category, price, stock, vendor and created_at are filled here.
+    """
+    # Imported here: bench_endpoints sets DATABASE_URL in the child process first
+    from sqlalchemy import insert
+
+    from database import Base, Product, Vendor
+
+    Base.metadata.create_all(engine)
+    rng = random.Random(seed)
+    start = datetime(2024, 1, 1)
+    with engine.begin() as conn:
+        conn.execute(insert(Vendor), [
+            {'id': i, 'name': f"Vendor {i}", 'email': f"v{i}@example.com", 'location': 'Dhaka', 'rating': 4.5}
+            for i in range(1, NUM_VENDORS + 1)
+        ])
+        for offset in range(0, size, batch):
+            conn.execute(insert(Product), [
+                {
+                    **product(rng, n),
+                    'category': rng.choice(categories), 'price': round(rng.uniform(1, 5000), 2),
+                    'stock': rng.randint(0, 1000), 'vendor_id': rng.randint(1, NUM_VENDORS),
+                    'created_at': start + timedelta(seconds=n)
+                }
+                for n in range(offset, min(offset + batch, size))
+            ])
+
+
+def percentile(samples, pct):
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))]
@@ -0,0 +1,115 @@
+"""
+Per-worker memory measurement for multi-worker mode
+
+Starts gunicorn with N uvicorn workers, waits until every worker has loaded
+the model, pushes a few identify requests through, then reads RSS, PSS and
+private memory of each worker from /proc/<pid>/smaps_rollup (Linux only).
+
+    python benchmarks/worker_rss.py --workers 4 --mmap 0
+    python benchmarks/worker_rss.py --workers 4 --mmap 1
+
+PSS splits shared pages evenly between the processes mapping them, so the
+sum of PSS is the real memory cost of the worker pool.
+"""
+import argparse
+import io
+import json
+import os
+import subprocess
+import sys
+import time
+import urllib.request
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def smaps_rollup(pid: int) -> dict:
+    fields = {}
+    with open(f"/proc/{pid}/smaps_rollup") as f:
+        for line in f:
+            parts = line.split()
+            if len(parts) >= 2 and parts[1].isdigit():
+                fields[parts[0].rstrip(':')] = int(parts[1])  # kB
+    return {
+        'rss_mb': round(fields.get('Rss', 0) / 1024, 1),
+        'pss_mb': round(fields.get('Pss', 0) / 1024, 1),
+        'private_mb': round((fields.get('Private_Clean', 0) + fields.get('Private_Dirty', 0)) / 1024, 1),
+    }
+
+
+def children(pid: int) -> list:
+    with open(f"/proc/{pid}/task/{pid}/children") as f:
+        return [int(p) for p in f.read().split()]
+
+
+def wait_ready(url: str, timeout: float) -> bool:
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            with urllib.request.urlopen(f"{url}/readyz", timeout=2) as resp:
+                if resp.status == 200:
+                    return True
+        except Exception:
+            pass
+        time.sleep(0.5)
+    return False
+
+
+def identify(url: str, image_bytes: bytes):
+    boundary = "----rss-bench"
+    body = (
+        f"--{boundary}\r\nContent-Disposition: form-data; name=\"file\"; filename=\"x.jpg\"\r\n"
+        f"Content-Type: image/jpeg\r\n\r\n"
+    ).encode() + image_bytes + f"\r\n--{boundary}--\r\n".encode()
+    req = urllib.request.Request(f"{url}/api/identify-part", data=body, method="POST",
+                                 headers={"Content-Type": f"multipart/form-data; boundary={boundary}"})
+    urllib.request.urlopen(req, timeout=30).read()
+
+
+def synthetic_jpeg(seed: int) -> bytes:
+    from PIL import Image
+    image = Image.effect_noise((640, 480), 64 + seed).convert('RGB')
+    buf = io.BytesIO()
+    image.save(buf, format='JPEG')
+    return buf.getvalue()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--workers', type=int, default=4)
+    parser.add_argument('--mmap', choices=['0', '1'], default='1')
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--requests', type=int, default=32, help='identify calls before measuring')
+    parser.add_argument('--timeout', type=float, default=300)
+    args = parser.parse_args()
+
+    env = dict(os.environ, PORT=str(args.port), API_WORKERS=str(args.workers), MODEL_MMAP=args.mmap)
+    server = subprocess.Popen(
+        [sys.executable, '-m', 'gunicorn', 'api_server:app', '-c', 'gunicorn.conf.py'],
+        cwd=ROOT, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+    )
+    url = f"http://127.0.0.1:{args.port}"
+    try:
+        if not wait_ready(url, args.timeout):
+            sys.exit("server did not become ready")
+        # /readyz only proves one worker is ready; give the rest time to finish loading
+        time.sleep(10)
+        for i in range(args.requests):
+            identify(url, synthetic_jpeg(i))
+
+        workers = [dict(pid=pid, **smaps_rollup(pid)) for pid in children(server.pid)]
+        report = {
+            'mmap': args.mmap == '1',
+            'workers': workers,
+            'master': smaps_rollup(server.pid),
+            'total_pss_mb': round(sum(w['pss_mb'] for w in workers), 1),
+            'mean_private_mb': round(sum(w['private_mb'] for w in workers) / max(1, len(workers)), 1),
+        }
+        print(json.dumps(report, indent=2))
+    finally:
+        server.terminate()
+        server.wait()
+
+
+if __name__ == '__main__':
+    main()
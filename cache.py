@@ -0,0 +1,213 @@
+"""
+In-process caches for current nai
+Bounded LRU cache with per-entry TTL and hit/miss counters, and the
+versioned response cache (in-process or Redis) for catalogue read endpoints
+"""
+import asyncio
+import hashlib
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Hashable, Optional, Tuple
+
+# Response cache backend: memory (per process) or redis (shared by all workers)
+RESPONSE_CACHE = os.getenv("RESPONSE_CACHE", "memory")
+RESPONSE_CACHE_SIZE = int(os.getenv("RESPONSE_CACHE_SIZE", "1024"))
+# Upper bound on staleness for writes the version bump can't see (other processes, raw SQL)
+RESPONSE_CACHE_TTL = float(os.getenv("RESPONSE_CACHE_TTL", "300"))
+REDIS_URL = os.getenv("REDIS_URL", "redis://localhost:6379/0")
+
+
+class TTLCache:
+    """Thread-safe LRU cache whose entries also expire after `ttl` seconds.
+
+    `ttl` of 0 or less disables expiry, leaving plain LRU eviction.
+    """
+
+    def __init__(self, max_entries: int = 1024, ttl: float = 0):
+        self.max_entries = max(1, max_entries)
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._data: "OrderedDict[Hashable, tuple]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: Hashable) -> Optional[Any]:
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            value, expires_at = entry
+            if expires_at and expires_at < time.monotonic():
+                del self._data[key]
+                self.misses += 1
+                return None
+            self._data.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def set(self, key: Hashable, value: Any):
+        expires_at = time.monotonic() + self.ttl if self.ttl > 0 else 0
+        with self._lock:
+            self._data[key] = (value, expires_at)
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_entries:
+                self._data.popitem(last=False)
+                self.evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    @property
+    def hit_ratio(self) -> float:
+        total = self.hits + self.misses
+        return self.hits / total if total else 0.0
+
+    def stats(self) -> dict:
+        return {
+            'entries': len(self._data),
+            'max_entries': self.max_entries,
+            'ttl_seconds': self.ttl,
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+            'hit_ratio': round(self.hit_ratio, 4)
+        }
+
+
+# (etag, pre-serialized JSON body)
+CachedResponse = Tuple[str, bytes]
+
+
+def make_etag(body: bytes) -> str:
+    return '"' + hashlib.blake2b(body, digest_size=16).hexdigest() + '"'
+
+
+class MemoryResponseCache:
+    """Pre-serialized responses in a TTLCache, keyed under a catalogue version.
+
+    Bumping the version orphans every existing entry at once; they age out
+    through LRU eviction. The version is per process, so writes made by
+    other processes are only picked up when entries expire.
+    """
+    name = "memory"
+
+    def __init__(self, max_entries: int = RESPONSE_CACHE_SIZE, ttl: float = RESPONSE_CACHE_TTL):
+        self._cache = TTLCache(max_entries, ttl)
+        self._version = 0
+
+    async def version(self) -> int:
+        return self._version
+
+    def bump(self):
+        self._version += 1
+
+    async def get(self, key: str) -> Optional[CachedResponse]:
+        return self._cache.get(key)
+
+    async def set(self, key: str, value: CachedResponse):
+        self._cache.set(key, value)
+
+    def stats(self) -> dict:
+        return {'backend': self.name, 'version': self._version, **self._cache.stats()}
+
+
+class RedisResponseCache:
+    """Pre-serialized responses in Redis, shared by every worker.
+
+    The catalogue version is a Redis counter, so a write in any process
+    invalidates all of them. Redis errors degrade to cache misses.
+    """
+    name = "redis"
+    VERSION_KEY = "nai:catalogue:version"
+
+    def __init__(self, url: str = REDIS_URL, ttl: float = RESPONSE_CACHE_TTL):
+        import redis
+        import redis.asyncio
+
+        self.ttl = int(ttl) if ttl > 0 else None
+        self._client = redis.asyncio.Redis.from_url(url)
+        # For bumps from threads without an event loop (imports, CLI scripts)
+        self._sync_client = redis.Redis.from_url(url)
+        self._pending_bumps = set()
+        self.hits = 0
+        self.misses = 0
+        self.errors = 0
+
+    async def version(self) -> int:
+        try:
+            return int(await self._client.get(self.VERSION_KEY) or 0)
+        except Exception:
+            self.errors += 1
+            return -1
+
+    def bump(self):
+        """Called from synchronous SQLAlchemy events. On the event loop (the
+        async engine) the increment is scheduled on the async client rather
+        than blocking the loop on a Redis round trip."""
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            try:
+                self._sync_client.incr(self.VERSION_KEY)
+            except Exception as e:
+                self._bump_failed(e)
+            return
+        task = loop.create_task(self._bump())
+        # The loop only keeps weak references to tasks
+        self._pending_bumps.add(task)
+        task.add_done_callback(self._pending_bumps.discard)
+
+    async def _bump(self):
+        try:
+            await self._client.incr(self.VERSION_KEY)
+        except Exception as e:
+            self._bump_failed(e)
+
+    def _bump_failed(self, e: Exception):
+        self.errors += 1
+        print(f"⚠️  Response cache version bump failed: {e}")
+
+    async def get(self, key: str) -> Optional[CachedResponse]:
+        try:
+            value = await self._client.get(f"nai:response:{key}")
+        except Exception:
+            self.errors += 1
+            value = None
+        if value is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        etag, _, body = value.partition(b"\n")
+        return etag.decode(), body
+
+    async def set(self, key: str, value: CachedResponse):
+        etag, body = value
+        try:
+            await self._client.set(f"nai:response:{key}", etag.encode() + b"\n" + body, ex=self.ttl)
+        except Exception:
+            self.errors += 1
+
+    def stats(self) -> dict:
+        total = self.hits + self.misses
+        return {'backend': self.name, 'ttl_seconds': self.ttl, 'hits': self.hits, 'misses': self.misses,
+                'errors': self.errors, 'hit_ratio': round(self.hits / total, 4) if total else 0.0}
+
+
+def make_response_cache(kind: str = RESPONSE_CACHE):
+    if kind == "redis":
+        try:
+            return RedisResponseCache()
+        except ImportError:
+            print("⚠️  RESPONSE_CACHE=redis but the redis package is not installed; using memory")
+            return MemoryResponseCache()
+    if kind == "memory":
+        return MemoryResponseCache()
+    raise ValueError(f"Unknown RESPONSE_CACHE '{kind}' (expected memory or redis)")
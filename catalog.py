@@ -0,0 +1,303 @@
+"""
+Catalogue queries for current nai marketplace
+Product listing projections, keyset pagination and catalogue joins
+"""
+import base64
+import json
+from datetime import datetime
+from typing import Callable, List, Optional, Sequence, Tuple
+
+from sqlalchemy import Select, event, func, literal_column, select, tuple_
+from sqlalchemy.sql.dml import UpdateBase
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import joinedload
+
+from database import (
+    SessionLocal, Product, Vendor, async_engine, engine,
+    FTS_BM25_WEIGHTS, PG_SEARCH_DOCUMENT, fts_match_query, pg_tsquery, products_fts
+)
+
+# SQLite searches the FTS5 table; PostgreSQL a GIN-indexed tsvector expression
+SEARCH_DIALECT = engine.dialect.name
+
+# Flat column projections: rows are serialized directly, no ORM objects are
+# built and no per-row vendor lazy-load can fire
+PRODUCT_COLUMNS = (
+    Product.id, Product.name, Product.description, Product.category, Product.price,
+    Product.stock, Product.manufacturer, Product.image_url
+)
+VENDOR_COLUMNS = (
+    Vendor.name.label('vendor_name'),
+    Vendor.location.label('vendor_location'),
+    Vendor.rating.label('vendor_rating')
+)
+
+# Sort options: (column, descending). Ties are broken on id in the same
+# direction, which is what the composite indexes on Product cover.
+SORT_OPTIONS = {
+    'id': (Product.id, False),
+    'price_asc': (Product.price, False),
+    'price_desc': (Product.price, True),
+    'newest': (Product.created_at, True),
+    'stock': (Product.stock, True),
+}
+# Search results ordered by rank (BM25 / ts_rank_cd); paged by offset since rank isn't indexable
+RELEVANCE = 'relevance'
+
+
+class InvalidListingRequest(ValueError):
+    """Unknown sort, or a cursor that is malformed or was issued for a different sort"""
+
+
+def serialize_product_row(row, vendor_fields=('name', 'location', 'rating')) -> dict:
+    product = {column.key: row[column.key] for column in PRODUCT_COLUMNS}
+    product['vendor'] = {field: row[f'vendor_{field}'] for field in vendor_fields}
+    return product
+
+
+def encode_cursor(payload: dict) -> str:
+    raw = json.dumps(payload, separators=(',', ':'), default=lambda v: v.isoformat())
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip('=')
+
+
+def decode_cursor(cursor: str, sort: str) -> dict:
+    try:
+        payload = json.loads(base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)))
+    except (ValueError, TypeError):
+        raise InvalidListingRequest("Malformed cursor")
+    if not isinstance(payload, dict) or payload.get('s') != sort:
+        raise InvalidListingRequest("Cursor does not match the requested sort")
+    # Cursors are client input: check every field the query will bind
+    if sort == RELEVANCE:
+        offset = payload.get('o', 0)
+        if not _is_int(offset) or offset < 0:
+            raise InvalidListingRequest("Malformed cursor")
+        return payload
+    if not _is_int(payload.get('id')):
+        raise InvalidListingRequest("Malformed cursor")
+    if SORT_OPTIONS[sort][0] is not Product.id:
+        if 'v' not in payload:
+            raise InvalidListingRequest("Malformed cursor")
+        value = payload['v']
+        if sort == 'newest' and value is not None:
+            try:
+                payload['v'] = datetime.fromisoformat(value)
+            except (TypeError, ValueError):
+                raise InvalidListingRequest("Malformed cursor")
+        elif sort != 'newest' and value is not None and (
+                isinstance(value, bool) or not isinstance(value, (int, float))):
+            raise InvalidListingRequest("Malformed cursor")
+    return payload
+
+
+def _is_int(value) -> bool:
+    return isinstance(value, int) and not isinstance(value, bool)
+
+
+def build_listing_query(
+    category: Optional[str] = None,
+    search: Optional[str] = None,
+    sort: Optional[str] = None,
+    cursor: Optional[str] = None,
+    limit: int = 50,
+) -> Tuple[Optional[Select], str, int]:
+    """Listing statement for one page (fetching limit + 1 rows to detect a next page).
+
+    Returns (statement, effective sort, offset). The statement is None when
+    the search has no usable terms, meaning the page is empty.
+    """
+    sort = sort or (RELEVANCE if search else 'id')
+    if sort != RELEVANCE and sort not in SORT_OPTIONS:
+        raise InvalidListingRequest(f"Unknown sort '{sort}'")
+    if sort == RELEVANCE and not search:
+        raise InvalidListingRequest("Sort 'relevance' requires a search")
+    position = decode_cursor(cursor, sort) if cursor else None
+
+    query = select(*PRODUCT_COLUMNS, *VENDOR_COLUMNS).join(Vendor, Product.vendor_id == Vendor.id)
+
+    if category:
+        query = query.where(Product.category == category)
+
+    rank = None
+    if search and SEARCH_DIALECT == 'postgresql':
+        # tsvector: every term prefix-matched, ranked by ts_rank_cd, with a highlighted snippet
+        match = pg_tsquery(search)
+        if match is None:
+            return None, sort, 0
+        document = literal_column(PG_SEARCH_DOCUMENT.format(t='products.'))
+        tsquery = func.to_tsquery('simple', match)
+        headline = func.ts_headline(
+            'simple', func.concat_ws(' ', Product.name, Product.description), tsquery,
+            'StartSel=<mark>, StopSel=</mark>, MaxWords=12, MinWords=4'
+        )
+        query = query.add_columns(headline.label('snippet')).where(document.op('@@')(tsquery))
+        rank = func.ts_rank_cd(document, tsquery).desc()
+    elif search:
+        # FTS5: every term prefix-matched, ranked by BM25, with a highlighted snippet
+        match = fts_match_query(search)
+        if match is None:
+            return None, sort, 0
+        fts = literal_column('products_fts')
+        query = (
+            query.add_columns(func.snippet(fts, -1, '<mark>', '</mark>', '…', 12).label('snippet'))
+            .join(products_fts, products_fts.c.rowid == Product.id)
+            .where(fts.op('MATCH')(match))
+        )
+        rank = func.bm25(fts, *FTS_BM25_WEIGHTS)
+
+    offset = 0
+    if sort == RELEVANCE:
+        query = query.order_by(rank, Product.id)
+        offset = position.get('o', 0) if position else 0
+        query = query.offset(offset)
+    else:
+        column, descending = SORT_OPTIONS[sort]
+        if position is not None:
+            # Keyset: resume strictly after the last row of the previous page
+            if column is Product.id:
+                key, last = Product.id, position['id']
+            else:
+                key, last = tuple_(column, Product.id), tuple_(position['v'], position['id'])
+            query = query.where(key < last if descending else key > last)
+        if column is not Product.id:
+            # Carried along so paginate can build the next cursor
+            query = query.add_columns(column.label('sort_value'))
+        if column is Product.id:
+            order = (Product.id.desc(),) if descending else (Product.id,)
+        elif descending:
+            order = (column.desc(), Product.id.desc())
+        else:
+            order = (column, Product.id)
+        query = query.order_by(*order)
+
+    return query.limit(limit + 1), sort, offset
+
+
+def paginate(rows: Sequence, sort: str, offset: int, limit: int) -> Tuple[List[dict], Optional[str]]:
+    """Serialize one page of listing rows and build the cursor for the next page"""
+    has_more = len(rows) > limit
+    rows = rows[:limit]
+    products = [serialize_product_row(row) for row in rows]
+    if rows and 'snippet' in rows[0]:
+        for product, row in zip(products, rows):
+            product['snippet'] = row['snippet']
+
+    next_cursor = None
+    if has_more:
+        if sort == RELEVANCE:
+            next_cursor = encode_cursor({'s': sort, 'o': offset + limit})
+        else:
+            column, _ = SORT_OPTIONS[sort]
+            last = rows[-1]
+            payload = {'s': sort, 'id': last['id']}
+            if column is not Product.id:
+                payload['v'] = last['sort_value']
+            next_cursor = encode_cursor(payload)
+    return products, next_cursor
+
+
+async def fetch_listings(db: AsyncSession, product_ids: List[int]) -> dict:
+    """Listing rows for the given ids in one query, keyed by id"""
+    if not product_ids:
+        return {}
+    query = (
+        select(*PRODUCT_COLUMNS, *VENDOR_COLUMNS)
+        .join(Vendor, Product.vendor_id == Vendor.id)
+        .where(Product.id.in_(product_ids))
+    )
+    rows = (await db.execute(query)).mappings().all()
+    return {row['id']: serialize_product_row(row) for row in rows}
+
+
+def fetch_catalogue_matches(categories: List[str], per_category: int) -> dict:
+    """Cheapest listings and price range for each category, in a single query.
+
+    Window functions rank and aggregate within each category, and the
+    vendor is joined-eager-loaded in the same statement.
+    """
+    db = SessionLocal()
+    try:
+        ranked = (
+            db.query(
+                Product.id.label('id'),
+                func.row_number().over(partition_by=Product.category, order_by=(Product.price, Product.id)).label('rank'),
+                func.min(Product.price).over(partition_by=Product.category).label('min_price'),
+                func.max(Product.price).over(partition_by=Product.category).label('max_price'),
+                func.count().over(partition_by=Product.category).label('listings')
+            )
+            .filter(Product.category.in_(categories))
+            .subquery()
+        )
+
+        rows = (
+            db.query(Product, ranked.c.min_price, ranked.c.max_price, ranked.c.listings)
+            .join(ranked, Product.id == ranked.c.id)
+            .options(joinedload(Product.vendor))
+            # Keep one row per category even when no listings are requested, for the price range
+            .filter(ranked.c.rank <= max(per_category, 1))
+            .order_by(Product.category, ranked.c.rank)
+            .all()
+        )
+
+        matches = {}
+        for product, min_price, max_price, listings in rows:
+            match = matches.setdefault(product.category, {
+                'price_range': {'min': min_price, 'max': max_price, 'currency': 'BDT', 'listings': listings},
+                'products': []
+            })
+            if len(match['products']) < per_category:
+                match['products'].append({
+                    'id': product.id,
+                    'name': product.name,
+                    'price': product.price,
+                    'stock': product.stock,
+                    'image_url': product.image_url,
+                    'vendor': {
+                        'id': product.vendor.id,
+                        'name': product.vendor.name,
+                        'location': product.vendor.location,
+                        'rating': product.vendor.rating
+                    }
+                })
+        return matches
+    finally:
+        db.close()
+
+
+# Tables whose writes change what the catalogue read endpoints return
+CATALOGUE_TABLES = frozenset({Product.__tablename__, Vendor.__tablename__})
+
+
+def watch_catalogue_writes(on_write: Callable[[], None], engines=None):
+    """Call `on_write` whenever a transaction that wrote products or vendors commits.
+
+    Covers ORM flushes and Core insert/update/delete alike, on the sync and
+    async engines. SQLAlchemy's commit event fires before the database
+    commit, so a read racing it could cache the old rows under the new
+    version; `on_write` is called again once the connection is returned to
+    the pool, after the commit has completed, which orphans those entries.
+    """
+    engines = engines or (engine, async_engine.sync_engine)
+
+    def after_execute(conn, clauseelement, multiparams, params, execution_options, result):
+        if isinstance(clauseelement, UpdateBase) and clauseelement.table.name in CATALOGUE_TABLES:
+            conn.info['catalogue_dirty'] = True
+
+    def commit(conn):
+        if conn.info.pop('catalogue_dirty', False):
+            conn.info['catalogue_committed'] = True
+            on_write()
+
+    def rollback(conn):
+        conn.info.pop('catalogue_dirty', None)
+
+    def checkin(dbapi_connection, connection_record):
+        # Connection.info is the pool record's info, so the flag set above is here
+        if connection_record is not None and connection_record.info.pop('catalogue_committed', False):
+            on_write()
+
+    for bind in engines:
+        event.listen(bind, 'after_execute', after_execute)
+        event.listen(bind, 'commit', commit)
+        event.listen(bind, 'rollback', rollback)
+        event.listen(bind, 'checkin', checkin)
@@ -0,0 +1,341 @@
+"""
+Bulk catalogue import for current nai
+Streams vendor inventories (CSV or JSONL) into products with batched upserts
+
+    python catalog_import.py inventory.csv
+    python catalog_import.py inventory.jsonl --batch-size 10000 --errors errors.jsonl
+
+Rows are parsed one at a time and written in batches of `batch_size`, so
+memory stays flat however large the file is. Each row is keyed on
+(vendor, sku): existing listings are updated, new ones inserted. Invalid
+rows are reported with their line number and skipped; the rest of the file
+still imports.
+"""
+import argparse
+import codecs
+import csv
+import json
+import math
+import os
+import time
+from dataclasses import dataclass, field
+from typing import IO, Iterable, Iterator, List, Optional, Sequence, Tuple
+
+from sqlalchemy import select
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.exc import DBAPIError
+
+from database import Product, SessionLocal, Vendor, engine, prepare_database
+
+IMPORT_BATCH_SIZE = int(os.getenv("IMPORT_BATCH_SIZE", "5000"))
+# Errors kept in the report; the total is always counted
+IMPORT_MAX_ERRORS = int(os.getenv("IMPORT_MAX_ERRORS", "1000"))
+
+FORMATS = ("csv", "jsonl")
+UPDATE_COLUMNS = ("name", "description", "category", "price", "stock", "manufacturer", "image_url")
+
+
+class RowError(ValueError):
+    """A row that can't be imported"""
+
+
+@dataclass
+class ImportReport:
+    """Counters plus the first `max_errors` row errors; every error also goes to `error_sink`"""
+    max_errors: int = IMPORT_MAX_ERRORS
+    error_sink: Optional[IO[str]] = None
+    rows: int = 0
+    upserted: int = 0
+    failed: int = 0
+    # Rows replaced by a later row for the same (vendor, sku) in the same batch
+    superseded: int = 0
+    errors: List[dict] = field(default_factory=list)
+    started: float = field(default_factory=time.perf_counter)
+    elapsed: float = 0.0
+
+    def error(self, line: int, message: str):
+        self.failed += 1
+        error = {'line': line, 'error': message}
+        if len(self.errors) < self.max_errors:
+            self.errors.append(error)
+        if self.error_sink is not None:
+            self.error_sink.write(json.dumps(error) + "\n")
+
+    def to_dict(self) -> dict:
+        return {
+            'rows': self.rows,
+            'upserted': self.upserted,
+            'failed': self.failed,
+            'superseded': self.superseded,
+            'errors': self.errors,
+            'errors_truncated': self.failed > len(self.errors),
+            'elapsed_seconds': round(self.elapsed, 2),
+            'rows_per_second': round(self.rows / self.elapsed, 1) if self.elapsed else None,
+        }
+
+
+def detect_format(filename: Optional[str]) -> str:
+    ext = os.path.splitext(filename or "")[1].lower().lstrip(".")
+    if ext in ("jsonl", "ndjson", "json"):
+        return "jsonl"
+    if ext == "csv":
+        return "csv"
+    raise ValueError(f"Cannot tell the format of '{filename}'; pass csv or jsonl explicitly")
+
+
+def decode_lines(stream: IO[bytes], bad_lines: set) -> Iterator[str]:
+    """UTF-8 lines (BOM tolerated); a line that doesn't decode is replaced and its number recorded"""
+    for line_num, raw in enumerate(stream, start=1):
+        if line_num == 1:
+            raw = raw.removeprefix(codecs.BOM_UTF8)
+        try:
+            yield raw.decode("utf-8")
+        except UnicodeDecodeError:
+            bad_lines.add(line_num)
+            yield raw.decode("utf-8", errors="replace")
+
+
+def read_rows(stream: IO[bytes], fmt: str) -> Iterator[Tuple[int, object]]:
+    """(line number, raw row) pairs; a line that can't be decoded or parsed yields the error instead"""
+    bad_lines = set()
+    lines = decode_lines(stream, bad_lines)
+    if fmt == "csv":
+        reader = csv.DictReader(lines)
+        try:
+            reader.fieldnames
+        except csv.Error as e:
+            yield reader.line_num, RowError(f"Invalid CSV header: {e}")
+            return
+        if bad_lines:
+            yield 1, RowError("Header is not valid UTF-8")
+            return
+        last_line = reader.line_num
+        while True:
+            try:
+                row = next(reader)
+            except StopIteration:
+                break
+            except csv.Error as e:
+                # The reader resets and carries on with the next line
+                row = RowError(f"Invalid CSV: {e}")
+            # DictReader.line_num isn't updated when a record fails to parse
+            line_num = reader.reader.line_num
+            # A quoted field can span lines: check every line the record used
+            if any(line in bad_lines for line in range(last_line + 1, line_num + 1)):
+                row = RowError("Not valid UTF-8")
+            last_line = line_num
+            yield line_num, row
+    elif fmt == "jsonl":
+        for line_num, line in enumerate(lines, start=1):
+            if line_num in bad_lines:
+                yield line_num, RowError("Not valid UTF-8")
+                continue
+            if not line.strip():
+                continue
+            try:
+                yield line_num, json.loads(line)
+            except json.JSONDecodeError as e:
+                yield line_num, RowError(f"Invalid JSON: {e.msg}")
+    else:
+        raise ValueError(f"Unknown format '{fmt}' (expected one of {', '.join(FORMATS)})")
+
+
+def _text(row: dict, key: str, max_length: int, required: bool = False) -> Optional[str]:
+    value = row.get(key)
+    value = str(value).strip() if value is not None else ""
+    if not value:
+        if required:
+            raise RowError(f"Missing '{key}'")
+        return None
+    if len(value) > max_length:
+        raise RowError(f"'{key}' is longer than {max_length} characters")
+    return value
+
+
+def _number(row: dict, key: str, integer: bool = False, default=None):
+    value = row.get(key)
+    if value is None or str(value).strip() == "":
+        if default is None:
+            raise RowError(f"Missing '{key}'")
+        return default
+    try:
+        number = float(value)
+    except (TypeError, ValueError):
+        raise RowError(f"'{key}' is not a number: {value!r}")
+    if not math.isfinite(number) or number < 0:
+        raise RowError(f"'{key}' must be a non-negative number")
+    if integer:
+        if not number.is_integer():
+            raise RowError(f"'{key}' must be a whole number")
+        return int(number)
+    return number
+
+
+class RowValidator:
+    """Turns raw rows into product values, resolving vendors and canonical category names"""
+
+    def __init__(self, class_names: Sequence[str]):
+        self.categories = {name.lower(): name for name in class_names}
+        with SessionLocal() as db:
+            vendors = db.execute(select(Vendor.id, Vendor.email)).all()
+        self.vendor_ids = {vendor_id for vendor_id, _ in vendors}
+        self.vendor_emails = {email.lower(): vendor_id for vendor_id, email in vendors if email}
+
+    def _vendor(self, row: dict) -> int:
+        email = _text(row, "vendor_email", 200)
+        if email:
+            vendor_id = self.vendor_emails.get(email.lower())
+            if vendor_id is None:
+                raise RowError(f"Unknown vendor_email '{email}'")
+            return vendor_id
+        raw = row.get("vendor_id")
+        if raw is None or str(raw).strip() == "":
+            raise RowError("Missing 'vendor_id' or 'vendor_email'")
+        try:
+            vendor_id = int(raw)
+        except (TypeError, ValueError):
+            raise RowError(f"'vendor_id' is not an integer: {raw!r}")
+        if vendor_id not in self.vendor_ids:
+            raise RowError(f"Unknown vendor_id {vendor_id}")
+        return vendor_id
+
+    def __call__(self, row) -> dict:
+        if isinstance(row, RowError):
+            raise row
+        if not isinstance(row, dict):
+            raise RowError("Row is not an object")
+        category = _text(row, "category", 100, required=True)
+        canonical = self.categories.get(category.lower())
+        if canonical is None:
+            raise RowError(f"Unknown category '{category}' (not one of the model's classes)")
+        return {
+            'vendor_id': self._vendor(row),
+            'sku': _text(row, "sku", 100, required=True),
+            'name': _text(row, "name", 200, required=True),
+            'description': _text(row, "description", 65535),
+            'category': canonical,
+            'price': _number(row, "price"),
+            'stock': _number(row, "stock", integer=True, default=0),
+            'manufacturer': _text(row, "manufacturer", 100),
+            'image_url': _text(row, "image_url", 500),
+        }
+
+
+def upsert_statement():
+    """INSERT ... ON CONFLICT (vendor_id, sku) DO UPDATE for the engine's dialect"""
+    insert = postgresql.insert if engine.dialect.name == "postgresql" else sqlite.insert
+    stmt = insert(Product)
+    return stmt.on_conflict_do_update(
+        index_elements=[Product.vendor_id, Product.sku],
+        set_={column: stmt.excluded[column] for column in UPDATE_COLUMNS},
+    )
+
+
+def write_batch(batch: dict, report: ImportReport):
+    """Upsert one batch in a transaction; if it fails, retry row by row to isolate the bad ones"""
+    if not batch:
+        return
+    stmt = upsert_statement()
+    rows = list(batch.values())
+    try:
+        with engine.begin() as conn:
+            conn.execute(stmt, [values for _, values in rows])
+        report.upserted += len(rows)
+        return
+    except DBAPIError:
+        pass
+    for line, values in rows:
+        try:
+            with engine.begin() as conn:
+                conn.execute(stmt, values)
+            report.upserted += 1
+        except DBAPIError as e:
+            report.error(line, str(e.orig).splitlines()[0])
+
+
+def import_rows(
+    rows: Iterable[Tuple[int, object]],
+    class_names: Sequence[str],
+    batch_size: int = IMPORT_BATCH_SIZE,
+    report: Optional[ImportReport] = None,
+    progress_every: int = 0,
+) -> ImportReport:
+    """Validate and upsert rows in batches, collecting per-row errors"""
+    validate = RowValidator(class_names)
+    report = report or ImportReport()
+    report.started = time.perf_counter()
+    # Keyed by (vendor, sku): a key repeated within one batch keeps its last
+    # row, since one ON CONFLICT statement can't update the same row twice;
+    # the earlier row is counted as superseded
+    batch = {}
+    for line, row in rows:
+        report.rows += 1
+        try:
+            values = validate(row)
+        except RowError as e:
+            report.error(line, str(e))
+            continue
+        key = (values['vendor_id'], values['sku'])
+        if key in batch:
+            report.superseded += 1
+        batch[key] = (line, values)
+        if len(batch) >= batch_size:
+            write_batch(batch, report)
+            batch = {}
+        if progress_every and report.rows % progress_every == 0:
+            elapsed = time.perf_counter() - report.started
+            print(f"   {report.rows} rows, {report.failed} errors, {report.rows / elapsed:.0f} rows/s")
+    write_batch(batch, report)
+    report.elapsed = time.perf_counter() - report.started
+    return report
+
+
+def import_file(
+    stream: IO[bytes],
+    fmt: str,
+    class_names: Sequence[str],
+    batch_size: int = IMPORT_BATCH_SIZE,
+    report: Optional[ImportReport] = None,
+    progress_every: int = 0,
+) -> ImportReport:
+    """Import a binary CSV/JSONL stream (utf-8, BOM tolerated)"""
+    return import_rows(read_rows(stream, fmt), class_names, batch_size, report, progress_every)
+
+
+def main():
+    from model_registry import MODEL_PATH, read_class_names
+
+    parser = argparse.ArgumentParser(description="Bulk import products from CSV or JSONL")
+    parser.add_argument("path", help="inventory file (.csv or .jsonl)")
+    parser.add_argument("--format", choices=FORMATS, help="file format (default: from the extension)")
+    parser.add_argument("--model", default=MODEL_PATH, help="checkpoint whose class_names are the valid categories")
+    parser.add_argument("--batch-size", type=int, default=IMPORT_BATCH_SIZE, help="rows per upsert transaction")
+    parser.add_argument("--errors", help="write every row error to this JSONL file")
+    args = parser.parse_args()
+
+    fmt = args.format or detect_format(args.path)
+    class_names = read_class_names(args.model)
+    prepare_database()
+    print(f"📦 Importing {args.path} ({fmt}), {len(class_names)} valid categories, batch {args.batch_size}")
+
+    error_sink = open(args.errors, "w") if args.errors else None
+    try:
+        with open(args.path, "rb") as f:
+            report = import_file(f, fmt, class_names, args.batch_size,
+                                 ImportReport(max_errors=20, error_sink=error_sink), progress_every=100_000)
+    finally:
+        if error_sink is not None:
+            error_sink.close()
+
+    summary = report.to_dict()
+    if args.errors:
+        print(f"📝 {report.failed} errors written to {args.errors}")
+    for error in report.errors:
+        print(f"⚠️  Line {error['line']}: {error['error']}")
+    print(f"✅ Imported {summary['upserted']} of {summary['rows']} rows in {summary['elapsed_seconds']}s "
+          f"({summary['rows_per_second']} rows/s), {summary['failed']} failed, "
+          f"{summary['superseded']} superseded by a later row")
+
+
+if __name__ == "__main__":
+    main()
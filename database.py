@@ -1,10 +1,17 @@
 """
 Database models and setup for current nai marketplace
 """
-from sqlalchemy import create_engine, Column, Integer, String, Float, DateTime, ForeignKey, Text
+from sqlalchemy import create_engine, event, inspect, Column, Integer, String, Float, DateTime, ForeignKey, Text, Index, LargeBinary, text, column, table
+from sqlalchemy.engine import make_url
+from sqlalchemy.ext.asyncio import AsyncEngine, AsyncSession, async_sessionmaker, create_async_engine
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker, relationship
+from sqlalchemy.types import TypeDecorator
 from datetime import datetime
+from typing import AsyncIterator, Optional
+import numpy as np
+import os
+import re
 
 Base = declarative_base()
 
@@ -20,11 +27,27 @@ class Product(Base):
     stock = Column(Integer, default=0)
     manufacturer = Column(String(100))
     image_url = Column(String(500))
+    sku = Column(String(100))  # vendor's own stock-keeping unit; the bulk import upsert key
     vendor_id = Column(Integer, ForeignKey('vendors.id'))
     created_at = Column(DateTime, default=datetime.utcnow)
     
     vendor = relationship("Vendor", back_populates="products")
     
+    # Composite indexes back every listing sort, with and without a category
+    # filter; the trailing id makes them usable for keyset pagination.
+    # Descending sorts scan the same indexes backwards.
+    __table_args__ = (
+        Index('ix_products_category_id', 'category', 'id'),
+        Index('ix_products_category_price', 'category', 'price', 'id'),
+        Index('ix_products_category_created', 'category', 'created_at', 'id'),
+        Index('ix_products_category_stock', 'category', 'stock', 'id'),
+        Index('ix_products_price', 'price', 'id'),
+        Index('ix_products_created', 'created_at', 'id'),
+        Index('ix_products_stock', 'stock', 'id'),
+        Index('ix_products_vendor_id', 'vendor_id'),
+        Index('ux_products_vendor_sku', 'vendor_id', 'sku', unique=True),
+    )
+    
 class Vendor(Base):
     __tablename__ = 'vendors'
     
@@ -55,16 +78,291 @@ class Order(Base):
     quantity = Column(Integer, default=1)
     total_price = Column(Float)
     status = Column(String(50), default='pending')  # pending, confirmed, shipped, delivered
+    reference = Column(String(32))  # shared by every line of one checkout
     created_at = Column(DateTime, default=datetime.utcnow)
+    
+    __table_args__ = (
+        Index('ix_orders_user_created', 'user_id', 'created_at'),
+        Index('ix_orders_product_id', 'product_id'),
+        Index('ix_orders_reference', 'reference'),
+    )
+
+# Penultimate-layer (pooled features) size of EfficientNet-B0
+EMBEDDING_DIM = 1280
+
+class Embedding(TypeDecorator):
+    """float32 vector: pgvector `vector(dim)` on PostgreSQL, raw bytes elsewhere"""
+    impl = LargeBinary
+    cache_ok = True
+    
+    def __init__(self, dim: int = EMBEDDING_DIM):
+        super().__init__()
+        self.dim = dim
+    
+    def load_dialect_impl(self, dialect):
+        if dialect.name == 'postgresql':
+            from pgvector.sqlalchemy import Vector
+            return dialect.type_descriptor(Vector(self.dim))
+        return dialect.type_descriptor(LargeBinary())
+    
+    def process_bind_param(self, value, dialect):
+        if value is None:
+            return None
+        value = np.asarray(value, dtype=np.float32)
+        return value if dialect.name == 'postgresql' else value.tobytes()
+    
+    def process_result_value(self, value, dialect):
+        if value is None:
+            return None
+        if dialect.name == 'postgresql':
+            return np.asarray(value, dtype=np.float32)
+        return np.frombuffer(value, dtype=np.float32)
+
+class ProductEmbedding(Base):
+    __tablename__ = 'product_embeddings'
+    
+    # One vector per product per model, so a new checkpoint can be backfilled
+    # while the serving one keeps its vectors
+    product_id = Column(Integer, ForeignKey('products.id', ondelete='CASCADE'), primary_key=True)
+    model = Column(String(32), primary_key=True)  # weights fingerprint of the model the vector came from
+    embedding = Column(Embedding(EMBEDDING_DIM), nullable=False)
+    updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+    
+    __table_args__ = (
+        Index('ix_product_embeddings_model', 'model'),
+    )
 
 # Database connection
-DATABASE_URL = "sqlite:///./marketplace.db"
-engine = create_engine(DATABASE_URL, connect_args={"check_same_thread": False})
+DATABASE_URL = os.getenv("DATABASE_URL", "sqlite:///./marketplace.db")
+
+# Async pool sizing for the request path
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "10"))
+DB_MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", "10"))
+DB_BUSY_TIMEOUT_MS = int(os.getenv("DB_BUSY_TIMEOUT_MS", "5000"))
+
+def _sqlite_pragmas(dbapi_connection, connection_record):
+    # WAL lets readers run concurrently with a writer; NORMAL sync is safe under WAL
+    cursor = dbapi_connection.cursor()
+    cursor.execute("PRAGMA journal_mode=WAL")
+    cursor.execute("PRAGMA synchronous=NORMAL")
+    cursor.execute(f"PRAGMA busy_timeout={DB_BUSY_TIMEOUT_MS}")
+    cursor.close()
+
+def async_url(url: str) -> str:
+    """Async driver URL for a sync database URL"""
+    parsed = make_url(url.replace("postgres://", "postgresql://", 1))
+    backend = parsed.get_backend_name()
+    if backend == "sqlite":
+        return parsed.set(drivername="sqlite+aiosqlite").render_as_string(hide_password=False)
+    if backend == "postgresql":
+        return parsed.set(drivername="postgresql+asyncpg").render_as_string(hide_password=False)
+    return url
+
+def sync_url(url: str) -> str:
+    """Normalize Heroku/Render style postgres:// URLs, which SQLAlchemy rejects"""
+    return url.replace("postgres://", "postgresql://", 1)
+
+def _register_pgvector(dbapi_connection, connection_record):
+    # asyncpg needs a codec for the vector type; requires the extension to exist
+    from pgvector.asyncpg import register_vector
+    dbapi_connection.run_async(register_vector)
+
+def make_async_engine(url: str) -> AsyncEngine:
+    """Async engine with a sized pool (WAL pragmas on SQLite, pgvector codec on PostgreSQL)"""
+    url = async_url(url)
+    async_engine = create_async_engine(url, pool_size=DB_POOL_SIZE, max_overflow=DB_MAX_OVERFLOW, pool_pre_ping=True)
+    if async_engine.dialect.name == "sqlite":
+        event.listen(async_engine.sync_engine, "connect", _sqlite_pragmas)
+    elif async_engine.dialect.name == "postgresql":
+        event.listen(async_engine.sync_engine, "connect", _register_pgvector)
+    return async_engine
+
+if DATABASE_URL.startswith("sqlite"):
+    engine = create_engine(DATABASE_URL, connect_args={"check_same_thread": False})
+    event.listen(engine, "connect", _sqlite_pragmas)
+else:
+    engine = create_engine(sync_url(DATABASE_URL), pool_size=DB_POOL_SIZE, max_overflow=DB_MAX_OVERFLOW, pool_pre_ping=True)
 SessionLocal = sessionmaker(bind=engine)
 
+# Async engine/session for request handlers
+async_engine = make_async_engine(DATABASE_URL)
+AsyncSessionLocal = async_sessionmaker(async_engine, expire_on_commit=False)
+
+# ============================================
+# FULL-TEXT SEARCH (SQLite FTS5 / PostgreSQL tsvector)
+# ============================================
+
+# External-content FTS5 index over products, kept in sync by triggers.
+# prefix='2 3 4' pre-indexes short prefixes so part-number lookups like
+# "LM35*" or "2N39*" don't scan the whole term list.
+PRODUCTS_FTS_DDL = [
+    """CREATE VIRTUAL TABLE IF NOT EXISTS products_fts USING fts5(
+        name, description, manufacturer, category,
+        content='products', content_rowid='id',
+        tokenize='unicode61 remove_diacritics 2', prefix='2 3 4'
+    )""",
+    """CREATE TRIGGER IF NOT EXISTS products_fts_ai AFTER INSERT ON products BEGIN
+        INSERT INTO products_fts(rowid, name, description, manufacturer, category)
+        VALUES (new.id, new.name, new.description, new.manufacturer, new.category);
+    END""",
+    """CREATE TRIGGER IF NOT EXISTS products_fts_ad AFTER DELETE ON products BEGIN
+        INSERT INTO products_fts(products_fts, rowid, name, description, manufacturer, category)
+        VALUES ('delete', old.id, old.name, old.description, old.manufacturer, old.category);
+    END""",
+    """CREATE TRIGGER IF NOT EXISTS products_fts_au AFTER UPDATE OF name, description, manufacturer, category ON products BEGIN
+        INSERT INTO products_fts(products_fts, rowid, name, description, manufacturer, category)
+        VALUES ('delete', old.id, old.name, old.description, old.manufacturer, old.category);
+        INSERT INTO products_fts(rowid, name, description, manufacturer, category)
+        VALUES (new.id, new.name, new.description, new.manufacturer, new.category);
+    END""",
+]
+
+# Lightweight table construct for joining the FTS index in queries
+products_fts = table('products_fts', column('rowid'))
+
+# BM25 column weights: name, description, manufacturer, category
+FTS_BM25_WEIGHTS = (10.0, 2.0, 5.0, 3.0)
+
+def fts_match_query(search: str) -> Optional[str]:
+    """Turn free text into an FTS5 query: every term must match, each as a prefix"""
+    terms = re.findall(r'\w+', search)
+    if not terms:
+        return None
+    # Quoting neutralizes FTS5 operators (AND/OR/NEAR, column filters) in user input
+    return ' '.join(f'"{term}"*' for term in terms)
+
+# PostgreSQL: weighted tsvector over the same fields, backed by a GIN
+# expression index. `{t}` is the optional table qualifier; the planner
+# matches the qualified query expression against the unqualified index one.
+PG_SEARCH_DOCUMENT = (
+    "(setweight(to_tsvector('simple', coalesce({t}name, '')), 'A') || "
+    "setweight(to_tsvector('simple', coalesce({t}manufacturer, '')), 'B') || "
+    "setweight(to_tsvector('simple', coalesce({t}category, '')), 'B') || "
+    "setweight(to_tsvector('simple', coalesce({t}description, '')), 'C'))"
+)
+
+def pg_tsquery(search: str) -> Optional[str]:
+    """Turn free text into a to_tsquery string: every term must match, each as a prefix"""
+    terms = re.findall(r'\w+', search)
+    if not terms:
+        return None
+    return ' & '.join(f'{term}:*' for term in terms)
+
+def ensure_search_index(bind=None):
+    """Create the search index (and FTS5 triggers) if missing, backfilling existing products"""
+    bind = bind or engine
+    if bind.dialect.name == 'postgresql':
+        with bind.begin() as conn:
+            conn.execute(text(
+                "CREATE INDEX IF NOT EXISTS ix_products_search ON products "
+                f"USING gin ({PG_SEARCH_DOCUMENT.format(t='')})"
+            ))
+        return
+    if bind.dialect.name != 'sqlite':
+        return
+    with bind.begin() as conn:
+        exists = conn.execute(text(
+            "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'products_fts'"
+        )).first()
+        for statement in PRODUCTS_FTS_DDL:
+            conn.execute(text(statement))
+        if not exists:
+            conn.execute(text("INSERT INTO products_fts(products_fts) VALUES ('rebuild')"))
+            print("✅ Product search index built")
+
+def ensure_columns(bind=None):
+    """Add nullable columns missing from databases made before they were declared"""
+    bind = bind or engine
+    inspector = inspect(bind)
+    for table in Base.metadata.sorted_tables:
+        if not inspector.has_table(table.name):
+            continue
+        existing = {column['name'] for column in inspector.get_columns(table.name)}
+        for column in table.columns:
+            if column.name in existing or not column.nullable:
+                continue
+            column_type = column.type.compile(dialect=bind.dialect)
+            with bind.begin() as conn:
+                conn.execute(text(f'ALTER TABLE {table.name} ADD COLUMN {column.name} {column_type}'))
+            print(f"✅ Added column {table.name}.{column.name}")
+
+def ensure_embedding_key(bind=None):
+    """Widen a product_embeddings primary key made before it included model"""
+    bind = bind or engine
+    inspector = inspect(bind)
+    if not inspector.has_table('product_embeddings'):
+        return
+    primary_key = inspector.get_pk_constraint('product_embeddings')
+    if primary_key['constrained_columns'] != ['product_id']:
+        return
+    with bind.begin() as conn:
+        if bind.dialect.name == 'postgresql':
+            conn.execute(text(
+                f"ALTER TABLE product_embeddings DROP CONSTRAINT {primary_key['name']}, "
+                "ADD PRIMARY KEY (product_id, model)"
+            ))
+        else:
+            # SQLite can't alter a primary key: rebuild the table and copy the rows
+            indexes = [index['name'] for index in inspector.get_indexes('product_embeddings')]
+            conn.execute(text("ALTER TABLE product_embeddings RENAME TO product_embeddings_old"))
+            for name in indexes:
+                conn.execute(text(f"DROP INDEX IF EXISTS {name}"))
+            ProductEmbedding.__table__.create(conn)
+            conn.execute(text(
+                "INSERT INTO product_embeddings (product_id, model, embedding, updated_at) "
+                "SELECT product_id, model, embedding, updated_at FROM product_embeddings_old"
+            ))
+            conn.execute(text("DROP TABLE product_embeddings_old"))
+    print("✅ product_embeddings keyed on (product_id, model)")
+
+def ensure_indexes(bind=None):
+    """Create model indexes missing from databases made before they were declared"""
+    bind = bind or engine
+    for table in Base.metadata.sorted_tables:
+        for index in table.indexes:
+            index.create(bind=bind, checkfirst=True)
+
+# ============================================
+# VECTOR SEARCH (pgvector)
+# ============================================
+
+# HNSW graph parameters for the product embedding index
+HNSW_M = int(os.getenv("HNSW_M", "16"))
+HNSW_EF_CONSTRUCTION = int(os.getenv("HNSW_EF_CONSTRUCTION", "64"))
+
+def ensure_vector_extension(bind=None):
+    """pgvector must exist before product_embeddings can be created"""
+    bind = bind or engine
+    if bind.dialect.name == 'postgresql':
+        with bind.begin() as conn:
+            conn.execute(text("CREATE EXTENSION IF NOT EXISTS vector"))
+
+def ensure_vector_index(bind=None):
+    """HNSW cosine index over product embeddings (PostgreSQL only)"""
+    bind = bind or engine
+    if bind.dialect.name != 'postgresql':
+        return
+    with bind.begin() as conn:
+        conn.execute(text(
+            "CREATE INDEX IF NOT EXISTS ix_product_embeddings_hnsw ON product_embeddings "
+            "USING hnsw (embedding vector_cosine_ops) "
+            f"WITH (m = {HNSW_M}, ef_construction = {HNSW_EF_CONSTRUCTION})"
+        ))
+
+def prepare_database(bind=None):
+    """Create missing tables, indexes and search structures; safe to run on every start"""
+    bind = bind or engine
+    ensure_vector_extension(bind)
+    Base.metadata.create_all(bind=bind)
+    ensure_embedding_key(bind)
+    ensure_columns(bind)
+    ensure_indexes(bind)
+    ensure_search_index(bind)
+    ensure_vector_index(bind)
+
 def init_db():
     """Create all tables"""
-    Base.metadata.create_all(bind=engine)
+    prepare_database()
     print("✅ Database tables created!")
 
 def get_db():
@@ -75,6 +373,11 @@ def get_db():
     finally:
         db.close()
 
+async def get_async_session() -> AsyncIterator[AsyncSession]:
+    """FastAPI dependency: one async session per request, closed afterwards"""
+    async with AsyncSessionLocal() as session:
+        yield session
+
 def seed_sample_data():
     """Add sample products matching trained AI model categories"""
     db = SessionLocal()
@@ -0,0 +1,25 @@
+"""
+Gunicorn configuration for current nai
+Multi-worker mode: uvicorn workers sharing one memory-mapped copy of the model weights
+
+    gunicorn api_server:app -c gunicorn.conf.py
+"""
+import multiprocessing
+import os
+
+bind = f"0.0.0.0:{os.getenv('PORT', '8000')}"
+workers = int(os.getenv("API_WORKERS", "4"))
+worker_class = "uvicorn.workers.UvicornWorker"
+
+# Import api_server (and torch) once in the master; workers fork from it and
+# share those pages copy-on-write. The model itself is loaded per worker by
+# the lifespan hook, memory-mapped so the weight pages are shared too.
+preload_app = True
+
+# Model load + backend selection can take a while on small instances
+timeout = int(os.getenv("GUNICORN_TIMEOUT", "120"))
+
+# Settings read by model_registry when each worker loads the model
+os.environ.setdefault("MODEL_MMAP", "1")
+# One intra-op pool per worker; split the cores instead of oversubscribing them
+os.environ.setdefault("TORCH_NUM_THREADS", str(max(1, multiprocessing.cpu_count() // workers)))
@@ -0,0 +1,333 @@
+"""
+Inference runtime for current nai
+Image decode/preprocess worker pool and dynamic micro-batching of
+EfficientNet forward passes behind the identify API
+"""
+import asyncio
+import hashlib
+import io
+import multiprocessing
+import os
+import time
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from typing import Callable, List, Optional, Tuple
+
+import torch
+import torch.nn as nn
+import torchvision.transforms as transforms
+from PIL import Image
+from torchvision import models
+
+# Batching configuration
+MAX_BATCH_SIZE = int(os.getenv("INFERENCE_MAX_BATCH_SIZE", "16"))
+MAX_WAIT_MS = float(os.getenv("INFERENCE_MAX_WAIT_MS", "5"))
+INFERENCE_MAX_QUEUE = int(os.getenv("INFERENCE_MAX_QUEUE", "256"))
+
+# Decode/preprocess pool configuration
+PREPROCESS_EXECUTOR = os.getenv("PREPROCESS_EXECUTOR", "thread")  # thread | process
+PREPROCESS_WORKERS = int(os.getenv("PREPROCESS_WORKERS", str(os.cpu_count() or 2)))
+PREPROCESS_MAX_QUEUE = int(os.getenv("PREPROCESS_MAX_QUEUE", "256"))
+
+IMAGE_SIZE = 224
+
+# Image preprocessing
+preprocess = transforms.Compose([
+    transforms.Resize((IMAGE_SIZE, IMAGE_SIZE)),
+    transforms.ToTensor(),
+    transforms.Normalize([0.485, 0.456, 0.406], [0.229, 0.224, 0.225])
+])
+
+
+def build_model(num_classes: int) -> nn.Module:
+    """EfficientNet-B0 with the classifier head sized for our categories"""
+    model = models.efficientnet_b0(weights=None)
+    model.classifier[1] = nn.Linear(model.classifier[1].in_features, num_classes)
+    return model
+
+
+class QueueFullError(Exception):
+    """Raised when a stage is at its queue-depth limit; maps to HTTP 429"""
+
+
+def _open_rgb(contents: bytes) -> Image.Image:
+    image = Image.open(io.BytesIO(contents))
+    # JPEGs: let libjpeg decode at 1/2, 1/4 or 1/8 scale while staying >= the
+    # model input size. A 12 MP phone photo decodes ~8x faster this way.
+    image.draft('RGB', (IMAGE_SIZE, IMAGE_SIZE))
+    return image.convert('RGB')
+
+
+def decode_image(contents: bytes) -> torch.Tensor:
+    """Decode uploaded bytes into a normalized (C, H, W) tensor"""
+    return preprocess(_open_rgb(contents))
+
+
+def decode_image_timed(contents: bytes) -> Tuple[torch.Tensor, float, float]:
+    """decode_image, also returning (PIL decode seconds, preprocess seconds)"""
+    started = time.perf_counter()
+    image = _open_rgb(contents)
+    decoded = time.perf_counter()
+    tensor = preprocess(image)
+    return tensor, decoded - started, time.perf_counter() - decoded
+
+
+def content_key(contents: bytes) -> str:
+    """Content address of an upload, used as the prediction cache key"""
+    return hashlib.blake2b(contents, digest_size=20).hexdigest()
+
+
+def checkpoint_stamp(path: str) -> str:
+    """Cheap identity of a checkpoint file from stat(); changes whenever the file is replaced"""
+    st = os.stat(path)
+    ident = f"{os.path.abspath(path)}:{st.st_size}:{st.st_mtime_ns}"
+    return hashlib.blake2b(ident.encode(), digest_size=8).hexdigest()
+
+
+def weights_fingerprint(state_dict: dict, class_names: List[str]) -> str:
+    """Content hash of a model's weights and labels.
+
+    Keys everything derived from the model (stored embeddings, ONNX exports,
+    cached predictions), so the same weights copied to another path or
+    re-saved keep their key.
+    """
+    digest = hashlib.blake2b(digest_size=8)
+    digest.update("\n".join(class_names).encode())
+    for name in sorted(state_dict):
+        tensor = state_dict[name].detach().cpu().contiguous()
+        digest.update(f"{name}:{tensor.dtype}:{tuple(tensor.shape)}".encode())
+        digest.update(tensor.reshape(-1).view(torch.uint8).numpy())
+    return digest.hexdigest()
+
+
+def _init_process_worker():
+    # One intra-op thread per process; parallelism comes from the pool itself
+    torch.set_num_threads(1)
+
+
+class PreprocessPool:
+    """Bounded thread/process pool running `decode_image` off the event loop.
+
+    At most `max_queue` images may be queued or in progress at once; beyond
+    that `run` raises QueueFullError instead of letting latency grow without
+    limit.
+    """
+
+    def __init__(
+        self,
+        kind: str = PREPROCESS_EXECUTOR,
+        workers: int = PREPROCESS_WORKERS,
+        max_queue: int = PREPROCESS_MAX_QUEUE,
+    ):
+        if kind not in ("thread", "process"):
+            raise ValueError(f"Unknown PREPROCESS_EXECUTOR '{kind}' (expected thread or process)")
+        self.kind = kind
+        self.workers = max(1, workers)
+        self.max_queue = max(1, max_queue)
+        self.in_flight = 0
+        self.rejected = 0
+        self._executor: Optional[Executor] = None
+
+    def start(self):
+        if self._executor is not None:
+            return
+        if self.kind == "process":
+            # spawn, not fork: forking a process that already runs torch threads can deadlock
+            self._executor = ProcessPoolExecutor(
+                max_workers=self.workers,
+                mp_context=multiprocessing.get_context("spawn"),
+                initializer=_init_process_worker,
+            )
+        else:
+            self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="preprocess")
+
+    def stop(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+
+    def has_capacity(self, count: int = 1) -> bool:
+        return self.in_flight + count <= self.max_queue
+
+    async def run(self, contents: bytes, timed: bool = False):
+        """Decoded tensor; with timed=True, (tensor, decode seconds, preprocess seconds)"""
+        if self._executor is None:
+            raise RuntimeError("Preprocess pool is not running")
+        if not self.has_capacity():
+            self.rejected += 1
+            raise QueueFullError("Image preprocessing queue is full")
+        self.in_flight += 1
+        try:
+            loop = asyncio.get_running_loop()
+            return await loop.run_in_executor(self._executor, decode_image_timed if timed else decode_image, contents)
+        finally:
+            self.in_flight -= 1
+
+
+class BatchInferenceEngine:
+    """Collects pending requests into batches and runs one forward pass per batch.
+
+    `forward_fn` takes a stacked (N, C, H, W) tensor and returns an (N, ...)
+    tensor. Each submitted request may itself carry several rows; the engine
+    packs requests until `max_batch_size` rows are queued or `max_wait_ms`
+    has passed since the first request of the batch arrived. A request that
+    would take the batch past `max_batch_size` waits for the next one (a
+    single request larger than that runs alone). Once `max_queue` requests
+    are waiting, `submit` raises QueueFullError.
+    """
+
+    def __init__(
+        self,
+        forward_fn: Callable[[torch.Tensor], torch.Tensor],
+        max_batch_size: int = MAX_BATCH_SIZE,
+        max_wait_ms: float = MAX_WAIT_MS,
+        max_queue: int = INFERENCE_MAX_QUEUE,
+    ):
+        self.forward_fn = forward_fn
+        self.max_batch_size = max(1, max_batch_size)
+        self.max_wait = max(0.0, max_wait_ms) / 1000.0
+        self.max_queue = max(1, max_queue)
+        self._queue: Optional[asyncio.Queue] = None
+        self._worker: Optional[asyncio.Task] = None
+        self._executor: Optional[ThreadPoolExecutor] = None
+        # A dequeued request that didn't fit the last batch; it starts the next one
+        self._carry: Optional[tuple] = None
+        # Requests taken off the queue for the batch being collected or run
+        self._batch: List[tuple] = []
+        self.batches_run = 0
+        self.rows_run = 0
+        self.rejected = 0
+
+    async def start(self):
+        if self._worker is not None:
+            return
+        self._queue = asyncio.Queue()
+        # Single thread so forward passes never compete with each other for cores
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="inference")
+        self._worker = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._worker is None:
+            return
+        self._worker.cancel()
+        try:
+            await self._worker
+        except asyncio.CancelledError:
+            pass
+        self._worker = None
+        # Fail anything still waiting, including the batch the worker was
+        # collecting or running when cancelled, so callers don't hang on shutdown
+        waiting = self._batch + ([self._carry] if self._carry is not None else [])
+        self._batch, self._carry = [], None
+        while not self._queue.empty():
+            waiting.append(self._queue.get_nowait())
+        for _, future, _ in waiting:
+            if not future.done():
+                future.set_exception(RuntimeError("Inference engine stopped"))
+        self._executor.shutdown(wait=False)
+        self._executor = None
+
+    @property
+    def queue_depth(self) -> int:
+        if self._queue is None:
+            return 0
+        return self._queue.qsize() + (self._carry is not None)
+
+    async def submit(self, batch: torch.Tensor, timings: Optional[dict] = None) -> torch.Tensor:
+        """Queue an (N, C, H, W) tensor and wait for its N output rows.
+
+        If `timings` is given, it receives 'queue' (seconds waiting for a
+        batch) and 'forward' (seconds in the batched forward pass).
+        """
+        if self._worker is None:
+            raise RuntimeError("Inference engine is not running")
+        if self._queue.qsize() >= self.max_queue:
+            self.rejected += 1
+            raise QueueFullError("Inference queue is full")
+        future = asyncio.get_running_loop().create_future()
+        self._queue.put_nowait((batch, future, (time.perf_counter(), timings)))
+        return await future
+
+    async def _collect(self) -> List[Tuple[torch.Tensor, asyncio.Future, tuple]]:
+        loop = asyncio.get_running_loop()
+        if self._carry is not None:
+            pending, self._carry = [self._carry], None
+        else:
+            pending = [await self._queue.get()]
+        self._batch = pending
+        rows = pending[0][0].shape[0]
+        deadline = loop.time() + self.max_wait
+
+        while rows < self.max_batch_size:
+            # Take whatever is already queued without waiting
+            if not self._queue.empty():
+                item = self._queue.get_nowait()
+            else:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    item = await asyncio.wait_for(self._queue.get(), timeout)
+                except asyncio.TimeoutError:
+                    break
+            if rows + item[0].shape[0] > self.max_batch_size:
+                self._carry = item
+                break
+            pending.append(item)
+            rows += item[0].shape[0]
+
+        return pending
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            pending = await self._collect()
+            # Drop requests whose callers have gone away (client disconnects)
+            pending = [item for item in pending if not item[1].cancelled()]
+            if not pending:
+                continue
+
+            sizes = [t.shape[0] for t, _, _ in pending]
+            stacked = torch.cat([t for t, _, _ in pending], dim=0)
+
+            started = time.perf_counter()
+            try:
+                outputs = await loop.run_in_executor(self._executor, self._forward, stacked)
+            except Exception as e:
+                for _, future, _ in pending:
+                    if not future.done():
+                        future.set_exception(e)
+                continue
+
+            finished = time.perf_counter()
+            self.batches_run += 1
+            self.rows_run += stacked.shape[0]
+
+            for _, _, (queued, timings) in pending:
+                if timings is not None:
+                    timings['queue'] = started - queued
+                    timings['forward'] = finished - started
+
+            for (_, future, _), chunk in zip(pending, torch.split(outputs, sizes, dim=0)):
+                if not future.done():
+                    future.set_result(chunk)
+            self._batch = []
+
+    def _forward(self, batch: torch.Tensor) -> torch.Tensor:
+        with torch.no_grad():
+            return self.forward_fn(batch)
+
+
+def make_classifier_fn(forward: Callable[[torch.Tensor], torch.Tensor], device: torch.device) -> Callable[[torch.Tensor], torch.Tensor]:
+    """Wrap a logits forward (model or backend) to return softmax probabilities on the CPU"""
+    def classify(batch: torch.Tensor) -> torch.Tensor:
+        outputs = forward(batch.to(device))
+        return torch.nn.functional.softmax(outputs, dim=1).cpu()
+    return classify
+
+
+def make_embedding_fn(model: nn.Module, device: torch.device) -> Callable[[torch.Tensor], torch.Tensor]:
+    """Penultimate-layer embeddings: pooled features, L2-normalized so dot product is cosine"""
+    def embed(batch: torch.Tensor) -> torch.Tensor:
+        features = model.avgpool(model.features(batch.to(device)))
+        return torch.nn.functional.normalize(torch.flatten(features, 1), dim=1).cpu()
+    return embed
@@ -194,6 +194,20 @@ function displayRealResults(data) {
         ).join('');
     }
     
+    // Format the runner-up predictions (the top one is shown above) with their catalogue matches
+    let predictionsHTML = '';
+    if (data.predictions && data.predictions.length > 1) {
+        predictionsHTML = data.predictions.slice(1).map(prediction => `
+            <div class="prediction-row">
+                <span class="prediction-name">${prediction.name}</span>
+                <span class="prediction-probability">${prediction.probability.toFixed(1)}%</span>
+                <span class="prediction-price">${prediction.price_range
+                    ? `৳${prediction.price_range.min.toFixed(0)}-${prediction.price_range.max.toFixed(0)} • ${prediction.price_range.listings} listings`
+                    : 'Not listed'}</span>
+            </div>
+        `).join('');
+    }
+    
     // Format vendors
     let vendorsHTML = '';
     if (data.vendors && data.vendors.length > 0) {
@@ -263,6 +277,13 @@ function displayRealResults(data) {
                 </div>
             ` : ''}
 
+            ${predictionsHTML ? `
+                <div class="predictions-section">
+                    <h4>🔎 Other Possible Matches</h4>
+                    ${predictionsHTML}
+                </div>
+            ` : ''}
+
             ${vendorsHTML ? `
                 <div class="vendors-section">
                     <h4>🏪 Available Vendors</h4>
@@ -22,6 +22,15 @@ async function loadProducts() {
     }
 }
 
+// Dataset images are full-size training photos; cards load server-made thumbnails instead
+function productImageAttrs(imageUrl) {
+    if (!imageUrl.startsWith('/dataset/')) {
+        return `src="${imageUrl}"`;
+    }
+    const path = imageUrl.slice('/dataset/'.length);
+    return `src="/thumbnails/320/${path}" srcset="/thumbnails/320/${path} 1x, /thumbnails/640/${path} 2x"`;
+}
+
 // Display products in grid
 function displayProducts(products) {
     const grid = document.getElementById('partsGrid');
@@ -39,7 +48,7 @@ function displayProducts(products) {
             </div>
             <div class="card-image">
                 ${product.image_url ? 
-                    `<img src="${product.image_url}" alt="${product.name}" style="width: 100%; height: 200px; object-fit: contain; background: #fff; border-radius: 8px; padding: 10px;">` 
+                    `<img ${productImageAttrs(product.image_url)} loading="lazy" decoding="async" alt="${product.name}" style="width: 100%; height: 200px; object-fit: contain; background: #fff; border-radius: 8px; padding: 10px;">` 
                     : '<i class="fas fa-microchip fa-4x"></i>'}
             </div>
             <div class="card-content">
@@ -0,0 +1,375 @@
+"""
+Metrics for current nai
+Prometheus text-format counters, histograms and gauges, per-request database
+accounting through SQLAlchemy engine events, and an opt-in request profiler
+
+Metrics are per process: with several workers, scrape each one (or read
+them through the worker that answers) rather than expecting a global sum.
+"""
+import contextvars
+import cProfile
+import importlib.util
+import os
+import random
+import threading
+import time
+from bisect import bisect_left
+from typing import Callable, Dict, Iterable, List, Optional, Sequence, Tuple
+
+from sqlalchemy import event
+
+# Latency buckets in seconds, from sub-millisecond DB calls to slow uploads
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+COUNT_BUCKETS = (0, 1, 2, 3, 5, 10, 20, 50, 100)
+# Top-1 confidence, in percent
+CONFIDENCE_BUCKETS = (10, 20, 30, 40, 50, 60, 70, 80, 90, 95, 99)
+
+# Request profiling: off unless PROFILE_REQUESTS=1. Then a request is profiled
+# when it sends `X-Profile: cprofile|pyinstrument`, or at PROFILE_SAMPLE_RATE.
+PROFILE_REQUESTS = os.getenv("PROFILE_REQUESTS", "0") == "1"
+PROFILE_SAMPLE_RATE = float(os.getenv("PROFILE_SAMPLE_RATE", "0"))
+PROFILE_DIR = os.getenv("PROFILE_DIR", "./profiles")
+PROFILERS = ("cprofile", "pyinstrument")
+# pyinstrument is optional; requests for it fall back to cProfile without it
+HAS_PYINSTRUMENT = importlib.util.find_spec("pyinstrument") is not None
+
+LabelValues = Tuple[str, ...]
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _format_labels(names: Sequence[str], values: Iterable[str], extra: str = "") -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+class Counter:
+    def __init__(self, name: str, help: str, labels: Sequence[str] = ()):
+        self.name, self.help, self.labels = name, help, tuple(labels)
+        self._values: Dict[LabelValues, float] = {}
+        self._lock = threading.Lock()
+
+    def inc(self, *labels: str, amount: float = 1.0):
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0.0) + amount
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            for labels, value in sorted(self._values.items()):
+                lines.append(f"{self.name}{_format_labels(self.labels, labels)} {value:g}")
+        return lines
+
+
+class Histogram:
+    def __init__(self, name: str, help: str, labels: Sequence[str] = (), buckets: Sequence[float] = LATENCY_BUCKETS):
+        self.name, self.help, self.labels = name, help, tuple(labels)
+        self.buckets = tuple(sorted(buckets))
+        # labels -> (per-bucket counts, +Inf count, sum)
+        self._values: Dict[LabelValues, list] = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, *labels: str):
+        with self._lock:
+            entry = self._values.get(labels)
+            if entry is None:
+                entry = self._values[labels] = [[0] * len(self.buckets), 0, 0.0]
+            index = bisect_left(self.buckets, value)
+            if index < len(self.buckets):
+                entry[0][index] += 1
+            entry[1] += 1
+            entry[2] += value
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            for labels, (counts, total, value_sum) in sorted(self._values.items()):
+                cumulative = 0
+                for bound, count in zip(self.buckets, counts):
+                    cumulative += count
+                    le = 'le="%g"' % bound
+                    lines.append(f"{self.name}_bucket{_format_labels(self.labels, labels, le)} {cumulative}")
+                le = 'le="+Inf"'
+                lines.append(f"{self.name}_bucket{_format_labels(self.labels, labels, le)} {total}")
+                lines.append(f"{self.name}_sum{_format_labels(self.labels, labels)} {value_sum:g}")
+                lines.append(f"{self.name}_count{_format_labels(self.labels, labels)} {total}")
+        return lines
+
+
+class Gauge:
+    """Value read from a callback at scrape time; the callback returns {label values: value}.
+
+    kind="counter" exposes a monotonic count kept elsewhere (engine, cache
+    stats) as a counter.
+    """
+
+    def __init__(self, name: str, help: str, labels: Sequence[str], read: Callable[[], Dict[LabelValues, float]],
+                 kind: str = "gauge"):
+        self.name, self.help, self.labels, self.read, self.kind = name, help, tuple(labels), read, kind
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+        try:
+            values = self.read()
+        except Exception as e:
+            print(f"⚠️  Metric {self.name} unavailable: {e}")
+            values = {}
+        for labels, value in sorted(values.items()):
+            lines.append(f"{self.name}{_format_labels(self.labels, labels)} {float(value):g}")
+        return lines
+
+
+class Registry:
+    def __init__(self):
+        self.metrics = []
+
+    def register(self, metric):
+        self.metrics.append(metric)
+        return metric
+
+    def render(self) -> str:
+        return "\n".join(line for metric in self.metrics for line in metric.render()) + "\n"
+
+
+registry = Registry()
+
+http_requests = registry.register(Counter(
+    "http_requests_total", "HTTP requests by route and status", ("method", "route", "status")))
+http_latency = registry.register(Histogram(
+    "http_request_duration_seconds", "Time to the response start, by route", ("method", "route")))
+identify_stages = registry.register(Histogram(
+    "identify_stage_duration_seconds", "identify-part latency by stage", ("stage",)))
+db_queries = registry.register(Histogram(
+    "db_queries_per_request", "SQL statements executed per request", ("route",), COUNT_BUCKETS))
+db_request_time = registry.register(Histogram(
+    "db_time_per_request_seconds", "Time spent in SQL per request", ("route",)))
+db_query_latency = registry.register(Histogram(
+    "db_query_duration_seconds", "Individual SQL statement latency", ()))
+model_latency = registry.register(Histogram(
+    "model_inference_duration_seconds", "Decode through probabilities per identify request, by model",
+    ("variant", "model")))
+model_confidence = registry.register(Histogram(
+    "model_top1_confidence_percent", "Top-1 confidence of identify predictions, by model",
+    ("variant", "model"), CONFIDENCE_BUCKETS))
+
+
+# ============================================
+# DATABASE ACCOUNTING
+# ============================================
+
+class QueryStats:
+    __slots__ = ("count", "seconds")
+
+    def __init__(self):
+        self.count = 0
+        self.seconds = 0.0
+
+
+# Set per request by the middleware; asyncio.to_thread and SQLAlchemy's async
+# greenlets both carry the context, so sync and async queries are counted
+current_query_stats: contextvars.ContextVar[Optional[QueryStats]] = contextvars.ContextVar(
+    "current_query_stats", default=None)
+
+
+def instrument_engine(engine):
+    """Time every statement on a (sync) engine and charge it to the current request"""
+    def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault("query_started", []).append(time.perf_counter())
+
+    def after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        elapsed = time.perf_counter() - conn.info["query_started"].pop()
+        db_query_latency.observe(elapsed)
+        stats = current_query_stats.get()
+        if stats is not None:
+            stats.count += 1
+            stats.seconds += elapsed
+
+    def handle_error(exception_context):
+        started = exception_context.connection.info.get("query_started") if exception_context.connection else None
+        if started:
+            started.pop()
+
+    event.listen(engine, "before_cursor_execute", before_cursor_execute)
+    event.listen(engine, "after_cursor_execute", after_cursor_execute)
+    event.listen(engine, "handle_error", handle_error)
+
+
+# ============================================
+# STAGE TIMING
+# ============================================
+
+class StageTimer:
+    """Accumulates named stage durations for one request"""
+
+    def __init__(self):
+        self.stages: Dict[str, float] = {}
+        self._last = time.perf_counter()
+
+    def mark(self, stage: str, breakdown: Optional[Dict[str, float]] = None):
+        """Charge the time since the previous mark to `stage`.
+
+        With `breakdown`, those stages get their own measured seconds and
+        `stage` only the remainder (hand-off and waiting around them).
+        """
+        now = time.perf_counter()
+        elapsed = now - self._last
+        for part, seconds in (breakdown or {}).items():
+            self.add(part, seconds)
+            elapsed -= seconds
+        self.add(stage, max(elapsed, 0.0))
+        self._last = now
+
+    def add(self, stage: str, seconds: float):
+        self.stages[stage] = self.stages.get(stage, 0.0) + seconds
+
+    def observe(self, histogram: Histogram = identify_stages):
+        for stage, seconds in self.stages.items():
+            histogram.observe(seconds, stage)
+
+    def server_timing(self) -> str:
+        return ", ".join(f"{stage};dur={seconds * 1000:.2f}" for stage, seconds in self.stages.items())
+
+
+# ============================================
+# REQUEST PROFILING
+# ============================================
+
+# Only one profiler can be attached to the interpreter at a time
+_profiling = threading.Lock()
+
+
+def choose_profiler(header: Optional[str]) -> Optional[str]:
+    """Profiler for this request, if profiling is enabled and requested or sampled"""
+    if not PROFILE_REQUESTS or _profiling.locked():
+        return None
+    if header:
+        kind = header.lower()
+        if kind == "pyinstrument" and not HAS_PYINSTRUMENT:
+            return "cprofile"
+        return kind if kind in PROFILERS else "cprofile"
+    if PROFILE_SAMPLE_RATE > 0 and random.random() < PROFILE_SAMPLE_RATE:
+        return "cprofile"
+    return None
+
+
+class RequestProfiler:
+    """Profiles one request and writes the result under PROFILE_DIR.
+
+    cProfile sees only the event-loop thread and, under concurrency, other
+    requests interleaved with this one; pyinstrument's async mode attributes
+    time across awaits to this request, so prefer it when it is installed.
+    """
+
+    def __init__(self, kind: str, label: str):
+        self.kind = kind
+        self.label = label.strip("/").replace("/", "_").replace("{", "").replace("}", "") or "root"
+        if kind == "pyinstrument":
+            from pyinstrument import Profiler
+            self._profiler = Profiler(async_mode="enabled")
+        else:
+            self._profiler = cProfile.Profile()
+
+    def start(self) -> bool:
+        """False if another request is already being profiled"""
+        if not _profiling.acquire(blocking=False):
+            return False
+        if self.kind == "pyinstrument":
+            self._profiler.start()
+        else:
+            self._profiler.enable()
+        return True
+
+    def stop(self) -> str:
+        try:
+            return self._dump()
+        finally:
+            _profiling.release()
+
+    def _dump(self) -> str:
+        os.makedirs(PROFILE_DIR, exist_ok=True)
+        stem = os.path.join(PROFILE_DIR, f"{time.strftime('%Y%m%d-%H%M%S')}-{os.getpid()}-{self.label}")
+        if self.kind == "pyinstrument":
+            self._profiler.stop()
+            path = stem + ".html"
+            with open(path, "w") as f:
+                f.write(self._profiler.output_html())
+        else:
+            self._profiler.disable()
+            path = stem + ".prof"
+            self._profiler.dump_stats(path)
+        return path
+
+
+# ============================================
+# REQUEST METRICS MIDDLEWARE
+# ============================================
+
+def _header(scope: dict, name: bytes) -> Optional[str]:
+    for key, value in scope.get("headers", ()):
+        if key == name:
+            return value.decode("latin-1")
+    return None
+
+
+class MetricsMiddleware:
+    """Latency and status per route, SQL per request, and optional profiling.
+
+    Plain ASGI rather than @app.middleware("http"), which runs every
+    request (static files and NDJSON streams included) through an extra
+    task and body stream wrapper.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        stats = QueryStats()
+        token = current_query_stats.set(stats)
+        profiler = None
+        kind = choose_profiler(_header(scope, b"x-profile"))
+        if kind:
+            profiler = RequestProfiler(kind, scope["path"])
+            if not profiler.start():
+                profiler = None
+        started = time.perf_counter()
+        recorded = False
+
+        def record(status: int):
+            nonlocal recorded, profiler
+            recorded = True
+            elapsed = time.perf_counter() - started
+            # Label by route template (/api/products/{product_id}), never the raw path
+            label = getattr(scope.get("route"), "path", None) or "unmatched"
+            http_latency.observe(elapsed, scope["method"], label)
+            http_requests.inc(scope["method"], label, str(status))
+            db_queries.observe(stats.count, label)
+            db_request_time.observe(stats.seconds, label)
+            profile_path = profiler.stop() if profiler else None
+            profiler = None
+            return profile_path
+
+        async def send_with_metrics(message):
+            if message["type"] == "http.response.start":
+                profile_path = record(message["status"])
+                # Streaming bodies are still being sent: these cover time to the first byte
+                headers = list(message.get("headers", ()))
+                headers.append((b"server-timing", f'db;dur={stats.seconds * 1000:.2f};desc="{stats.count} queries"'.encode()))
+                if profile_path:
+                    headers.append((b"x-profile-path", profile_path.encode()))
+                message = {**message, "headers": headers}
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_metrics)
+        finally:
+            current_query_stats.reset(token)
+            if not recorded:
+                record(500)
@@ -0,0 +1,362 @@
+"""
+Model lifecycle for current nai
+Loads the EfficientNet checkpoint off the request path and tracks readiness
+"""
+import asyncio
+import os
+import random
+import time
+from collections import deque
+from contextlib import contextmanager
+from dataclasses import dataclass, field
+from typing import List, Optional, Set
+
+import torch
+import torch.nn as nn
+
+from backends import INFERENCE_BACKEND, select_backend
+from inference import (
+    IMAGE_SIZE, BatchInferenceEngine, build_model, checkpoint_stamp, make_classifier_fn, make_embedding_fn,
+    weights_fingerprint
+)
+
+MODEL_PATH = os.getenv("MODEL_PATH", "./models/electronics_best_model.pth")
+
+# Memory-map checkpoint weights so every worker process shares one copy via the page cache
+MODEL_MMAP = os.getenv("MODEL_MMAP", "0") == "1"
+
+# Intra-op threads per process; set to cores / workers when running several workers
+TORCH_NUM_THREADS = int(os.getenv("TORCH_NUM_THREADS", "0"))
+
+# Hot reload: poll MODEL_PATH every MODEL_WATCH_SECONDS (0 = off); a swapped-out
+# model keeps serving its in-flight requests for up to MODEL_DRAIN_SECONDS
+MODEL_WATCH_SECONDS = float(os.getenv("MODEL_WATCH_SECONDS", "0"))
+MODEL_DRAIN_SECONDS = float(os.getenv("MODEL_DRAIN_SECONDS", "30"))
+
+# A/B routing: a second checkpoint gets MODEL_CANDIDATE_WEIGHT of identify traffic
+MODEL_CANDIDATE_PATH = os.getenv("MODEL_CANDIDATE_PATH", "")
+MODEL_CANDIDATE_WEIGHT = float(os.getenv("MODEL_CANDIDATE_WEIGHT", "0.1"))
+# Recent identify requests kept per model for latency/confidence percentiles
+MODEL_STATS_WINDOW = int(os.getenv("MODEL_STATS_WINDOW", "1000"))
+
+
+class ModelStats:
+    """Rolling latency and top-1 confidence of one model's identify requests"""
+
+    def __init__(self, window: int = MODEL_STATS_WINDOW):
+        self.requests = 0
+        self.latencies = deque(maxlen=window)
+        self.confidences = deque(maxlen=window)
+
+    def record(self, seconds: float, confidence: float):
+        self.requests += 1
+        self.latencies.append(seconds)
+        self.confidences.append(confidence)
+
+    def summary(self) -> dict:
+        if not self.latencies:
+            return {'requests': self.requests}
+        latencies = sorted(self.latencies)
+        confidences = list(self.confidences)
+
+        def pct(p):
+            return round(latencies[min(len(latencies) - 1, int(p / 100 * len(latencies)))] * 1000, 2)
+
+        return {
+            'requests': self.requests,
+            'window': len(latencies),
+            'latency_p50_ms': pct(50),
+            'latency_p95_ms': pct(95),
+            'latency_p99_ms': pct(99),
+            'mean_confidence': round(sum(confidences) / len(confidences), 2),
+            'low_confidence_ratio': round(sum(1 for c in confidences if c < 50) / len(confidences), 4),
+        }
+
+
+@dataclass
+class LoadedModel:
+    """A checkpoint that is built, backend-selected and ready to run"""
+    path: str
+    # Content hash of the weights; keys embeddings, ONNX exports and cached predictions
+    fingerprint: str
+    # stat() identity of the file it was loaded from, for the watcher
+    stamp: str
+    class_names: List[str]
+    val_acc: float
+    model: nn.Module
+    backend_name: str
+    backend_report: dict
+    engine: BatchInferenceEngine
+    embed_engine: BatchInferenceEngine
+    loaded_at: float = field(default_factory=time.time)
+    variant: str = "primary"
+    stats: ModelStats = field(default_factory=ModelStats)
+    # Requests currently holding this model; a retired model drains these first
+    active: int = 0
+
+    @property
+    def num_classes(self) -> int:
+        return len(self.class_names)
+
+    @contextmanager
+    def serving(self):
+        self.active += 1
+        try:
+            yield self
+        finally:
+            self.active -= 1
+
+    def info(self) -> dict:
+        return {
+            'variant': self.variant,
+            'path': self.path,
+            'fingerprint': self.fingerprint,
+            'num_classes': self.num_classes,
+            'val_acc': self.val_acc,
+            'backend': self.backend_report,
+            'loaded_at': self.loaded_at
+        }
+
+
+def read_class_names(path: str = MODEL_PATH) -> List[str]:
+    """Category names from a checkpoint without loading the model (weights stay unmapped)"""
+    return torch.load(path, map_location="cpu", mmap=True)['class_names']
+
+
+def load_model(path: str, device: torch.device, backend: str = INFERENCE_BACKEND) -> LoadedModel:
+    """Blocking checkpoint load; run it in a thread, never on the event loop"""
+    print(f"Loading Electronic Components AI Model from {path}...")
+    if TORCH_NUM_THREADS > 0:
+        torch.set_num_threads(TORCH_NUM_THREADS)
+
+    use_mmap = MODEL_MMAP and device.type == "cpu"
+    stamp = checkpoint_stamp(path)
+    checkpoint = torch.load(path, map_location="cpu" if use_mmap else device, mmap=use_mmap)
+    class_names = checkpoint['class_names']
+    fingerprint = weights_fingerprint(checkpoint['model_state_dict'], class_names)
+    print(f"✅ Found {len(class_names)} categories")
+
+    if use_mmap:
+        # Build on the meta device (no weight allocation), then assign=True makes
+        # the parameters views of the mapped file instead of private copies.
+        # Optimizer state in the checkpoint is never touched, so never paged in.
+        with torch.device("meta"):
+            model = build_model(len(class_names))
+        model.load_state_dict(checkpoint['model_state_dict'], assign=True)
+        print("✅ Weights memory-mapped (shared across workers)")
+    else:
+        model = build_model(len(class_names))
+        model.load_state_dict(checkpoint['model_state_dict'])
+        model = model.to(device)
+    model.eval()
+    val_acc = checkpoint['val_acc']
+    print(f"✅ Model loaded! Accuracy: {val_acc:.2f}%")
+
+    # Pick the inference backend; regressions fall back to eager
+    backend_name, forward, report = select_backend(
+        backend, model, device, class_names, val_acc, fingerprint
+    )
+    engine = BatchInferenceEngine(make_classifier_fn(forward, device))
+    # Embeddings always come from the eager model: the backends only expose logits
+    embed_engine = BatchInferenceEngine(make_embedding_fn(model, device))
+    return LoadedModel(path, fingerprint, stamp, class_names, val_acc, model, backend_name, report, engine, embed_engine)
+
+
+class ModelRegistry:
+    """Holds the serving model(s) and their load state (loading, ready, failed).
+
+    `current` is the primary model. An optional `candidate` gets
+    `candidate_weight` of identify traffic for A/B comparison. Replacing
+    either one is atomic: the new checkpoint is loaded, started and warmed
+    up in the background, then a single assignment swaps it in. Requests
+    already holding the old model finish on it before its engines stop.
+    """
+
+    def __init__(self, path: str = MODEL_PATH, device: Optional[torch.device] = None):
+        self.path = path
+        self.device = device or torch.device("cuda" if torch.cuda.is_available() else "cpu")
+        self.current: Optional[LoadedModel] = None
+        self.candidate: Optional[LoadedModel] = None
+        self.candidate_weight = 0.0
+        self.state = "loading"
+        self.error: Optional[str] = None
+        self.reloading = False
+        self._lock = asyncio.Lock()
+        self._retiring: Set[asyncio.Task] = set()
+        self._watcher: Optional[asyncio.Task] = None
+
+    @property
+    def ready(self) -> bool:
+        return self.current is not None
+
+    async def _load(self, path: str, variant: str) -> LoadedModel:
+        """Load a checkpoint in a worker thread, start its engines and run one warm-up batch"""
+        started = time.perf_counter()
+        loaded = await asyncio.to_thread(load_model, path, self.device)
+        loaded.variant = variant
+        await loaded.engine.start()
+        await loaded.embed_engine.start()
+        try:
+            # First forward passes are slow (allocator, kernel selection); pay that before serving
+            await loaded.engine.submit(torch.zeros(1, 3, IMAGE_SIZE, IMAGE_SIZE))
+        except Exception:
+            await self._stop_model(loaded)
+            raise
+        print(f"✅ Model ready in {time.perf_counter() - started:.1f}s ({variant} {loaded.fingerprint}, "
+              f"batch ≤ {loaded.engine.max_batch_size}, wait ≤ {loaded.engine.max_wait * 1000:.0f} ms)")
+        return loaded
+
+    async def load(self):
+        """Initial load of the primary (and candidate, if configured); then watch the file"""
+        try:
+            self.current = await self._load(self.path, "primary")
+        except Exception as e:
+            self.state = "failed"
+            self.error = str(e)
+            print(f"❌ Model failed to load: {e}")
+        else:
+            self.state = "ready"
+            self.error = None
+        if MODEL_CANDIDATE_PATH and self.current is not None:
+            try:
+                await self.load_candidate(MODEL_CANDIDATE_PATH, MODEL_CANDIDATE_WEIGHT)
+            except Exception as e:
+                print(f"⚠️  Candidate model {MODEL_CANDIDATE_PATH} failed to load: {e}")
+        if MODEL_WATCH_SECONDS > 0 and self._watcher is None:
+            self._watcher = asyncio.create_task(self.watch(MODEL_WATCH_SECONDS))
+
+    async def reload(self, path: Optional[str] = None) -> LoadedModel:
+        """Load `path` (default: the current path) and swap it in as the primary.
+
+        If loading fails the old model keeps serving and the error is raised.
+        """
+        path = path or self.path
+        async with self._lock:
+            self.reloading = True
+            try:
+                loaded = await self._load(path, "primary")
+            except Exception as e:
+                self.error = str(e)
+                print(f"❌ Reload of {path} failed, still serving the previous model: {e}")
+                raise
+            finally:
+                self.reloading = False
+            old, self.current, self.path = self.current, loaded, path
+            self.state, self.error = "ready", None
+            self._retire(old)
+        return loaded
+
+    async def load_candidate(self, path: str, weight: float) -> LoadedModel:
+        """Load a second model and route `weight` (0-1) of identify requests to it"""
+        async with self._lock:
+            loaded = await self._load(path, "candidate")
+            old, self.candidate = self.candidate, loaded
+            self.candidate_weight = min(max(weight, 0.0), 1.0)
+            self._retire(old)
+        return loaded
+
+    async def remove_candidate(self):
+        async with self._lock:
+            old, self.candidate, self.candidate_weight = self.candidate, None, 0.0
+            self._retire(old)
+
+    async def promote(self) -> LoadedModel:
+        """Make the candidate the primary; the old primary is retired"""
+        async with self._lock:
+            if self.candidate is None:
+                raise ValueError("No candidate model loaded")
+            old, self.current = self.current, self.candidate
+            self.current.variant = "primary"
+            self.path = self.current.path
+            self.candidate, self.candidate_weight = None, 0.0
+            self.state, self.error = "ready", None
+            self._retire(old)
+        return self.current
+
+    def set_weight(self, weight: float):
+        if self.candidate is None:
+            raise ValueError("No candidate model loaded")
+        self.candidate_weight = min(max(weight, 0.0), 1.0)
+
+    def route(self) -> Optional[LoadedModel]:
+        """Model for one identify request: the candidate with probability candidate_weight"""
+        candidate = self.candidate
+        if candidate is not None and random.random() < self.candidate_weight:
+            return candidate
+        return self.current
+
+    def models(self) -> List[LoadedModel]:
+        return [loaded for loaded in (self.current, self.candidate) if loaded is not None]
+
+    def _retire(self, loaded: Optional[LoadedModel]):
+        if loaded is None:
+            return
+        task = asyncio.create_task(self._drain(loaded))
+        self._retiring.add(task)
+        task.add_done_callback(self._retiring.discard)
+
+    async def _drain(self, loaded: LoadedModel, timeout: float = MODEL_DRAIN_SECONDS):
+        """Stop a swapped-out model once its in-flight requests are done (or `timeout` passes)"""
+        deadline = time.perf_counter() + timeout
+        while loaded.active and time.perf_counter() < deadline:
+            await asyncio.sleep(0.05)
+        if loaded.active:
+            print(f"⚠️  Stopping model {loaded.fingerprint} with {loaded.active} requests still in flight")
+        await self._stop_model(loaded)
+        print(f"📦 Retired model {loaded.fingerprint}")
+
+    @staticmethod
+    async def _stop_model(loaded: LoadedModel):
+        await loaded.engine.stop()
+        await loaded.embed_engine.stop()
+
+    async def watch(self, interval: float):
+        """Reload the primary when its checkpoint file is replaced.
+
+        A new file stamp must be seen on two polls in a row, so a file that
+        is still being copied into place isn't loaded half-written. Write
+        the new checkpoint elsewhere and rename it over MODEL_PATH.
+        """
+        print(f"👀 Watching {self.path} for new checkpoints every {interval:g}s")
+        seen = failed = None
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                stamp = checkpoint_stamp(self.path)
+            except OSError:
+                continue
+            current = self.current.stamp if self.current is not None else None
+            if stamp in (current, failed):
+                seen = None
+                continue
+            if stamp != seen:
+                seen = stamp
+                continue
+            print(f"📦 Checkpoint {self.path} changed; reloading")
+            try:
+                await self.reload()
+            except Exception:
+                failed = stamp
+            seen = None
+
+    async def stop(self):
+        if self._watcher is not None:
+            self._watcher.cancel()
+            self._watcher = None
+        for task in list(self._retiring):
+            task.cancel()
+        for loaded in self.models():
+            await self._stop_model(loaded)
+
+    def status(self) -> dict:
+        status = {'state': self.state, 'path': self.path}
+        if self.error:
+            status['error'] = self.error
+        if self.current is not None:
+            status['model'] = self.current.fingerprint
+        if self.candidate is not None:
+            status['candidate'] = self.candidate.fingerprint
+            status['candidate_weight'] = self.candidate_weight
+        if self.reloading:
+            status['reloading'] = True
+        return status
@@ -0,0 +1,297 @@
+"""
+Order placement for current nai
+Atomic stock reservation, with checkouts group-committed in batches under load
+"""
+import asyncio
+import os
+import uuid
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from sqlalchemy import insert, select, update
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker
+
+from database import AsyncSessionLocal, Order, Product
+from inference import QueueFullError
+
+# Group commit: checkouts arriving within ORDER_BATCH_WAIT_MS share one transaction
+ORDER_BATCH_SIZE = int(os.getenv("ORDER_BATCH_SIZE", "64"))
+ORDER_BATCH_WAIT_MS = float(os.getenv("ORDER_BATCH_WAIT_MS", "2"))
+ORDER_MAX_QUEUE = int(os.getenv("ORDER_MAX_QUEUE", "1024"))
+ORDER_MAX_LINES = int(os.getenv("ORDER_MAX_LINES", "50"))
+
+Lines = List[Tuple[int, int]]  # (product id, quantity), sorted by product id
+
+
+class OrderError(Exception):
+    """A checkout that can't be placed; nothing of it is reserved"""
+    status_code = 409
+
+    def __init__(self, message: str, product_id: int, available: Optional[int] = None):
+        super().__init__(message)
+        self.product_id = product_id
+        self.available = available
+
+    def to_dict(self) -> dict:
+        detail = {'error': str(self), 'product_id': self.product_id}
+        if self.available is not None:
+            detail['available'] = self.available
+        return detail
+
+
+class InsufficientStock(OrderError):
+    status_code = 409
+
+
+class UnknownProduct(OrderError):
+    status_code = 404
+
+
+def normalize_lines(items: Iterable[Tuple[int, int]]) -> Lines:
+    """Merge repeated products and sort by id, so concurrent checkouts lock rows in one order"""
+    merged: Dict[int, int] = {}
+    for product_id, quantity in items:
+        merged[product_id] = merged.get(product_id, 0) + quantity
+    return sorted(merged.items())
+
+
+async def place_order(db: AsyncSession, lines: Lines) -> dict:
+    """Reserve stock for every line and record the order, inside the caller's transaction.
+
+    Each line is one conditional UPDATE ... WHERE stock >= :quantity, so two
+    checkouts can never both take the last unit. If a later line fails, the
+    lines already reserved are put back before OrderError is raised, which
+    leaves the surrounding transaction usable for other orders.
+    """
+    reserved = []
+    try:
+        for product_id, quantity in lines:
+            price = (await db.execute(
+                update(Product)
+                .where(Product.id == product_id, Product.stock >= quantity)
+                .values(stock=Product.stock - quantity)
+                .returning(Product.price)
+                .execution_options(synchronize_session=False)
+            )).scalar_one_or_none()
+            if price is None:
+                available = await db.scalar(select(Product.stock).where(Product.id == product_id))
+                if available is None:
+                    raise UnknownProduct(f"Product {product_id} not found", product_id)
+                raise InsufficientStock(
+                    f"Only {available} of product {product_id} in stock", product_id, available
+                )
+            reserved.append((product_id, quantity, float(price)))
+    except OrderError:
+        for product_id, quantity, _ in reserved:
+            await db.execute(
+                update(Product)
+                .where(Product.id == product_id)
+                .values(stock=Product.stock + quantity)
+                .execution_options(synchronize_session=False)
+            )
+        raise
+
+    reference = uuid.uuid4().hex
+    items = [
+        {'product_id': product_id, 'quantity': quantity, 'unit_price': price,
+         'total_price': round(price * quantity, 2)}
+        for product_id, quantity, price in reserved
+    ]
+    await db.execute(insert(Order), [
+        {'product_id': item['product_id'], 'quantity': item['quantity'], 'total_price': item['total_price'],
+         'status': 'confirmed', 'reference': reference}
+        for item in items
+    ])
+    return {
+        'reference': reference,
+        'status': 'confirmed',
+        'items': items,
+        'total': round(sum(item['total_price'] for item in items), 2),
+        'currency': 'BDT'
+    }
+
+
+async def lock_products(db: AsyncSession, product_ids: Iterable[int]):
+    """Row-lock every product a batch touches, in ascending id order, up front.
+
+    Each order's lines are sorted, but a batch runs several orders one after
+    another, so without this two batches could lock the same rows in
+    opposite orders and deadlock. SQLite locks the whole database for a
+    write transaction instead, so it is skipped there.
+    """
+    connection = await db.connection()
+    if connection.dialect.name == "sqlite":
+        return
+    await db.execute(
+        select(Product.id)
+        .where(Product.id.in_(sorted(set(product_ids))))
+        .order_by(Product.id)
+        .with_for_update()
+    )
+
+
+class OrderBatcher:
+    """Collects pending checkouts and commits each batch in one transaction.
+
+    Under load this turns one commit (one fsync on SQLite, one WAL flush on
+    PostgreSQL) per order into one per batch. All rows the batch touches are
+    locked first in product id order, then orders run one after another, so
+    a rejected order never affects the others. If the batch transaction
+    itself fails, each order is retried on its own.
+    """
+
+    def __init__(
+        self,
+        session_factory: async_sessionmaker = AsyncSessionLocal,
+        max_batch_size: int = ORDER_BATCH_SIZE,
+        max_wait_ms: float = ORDER_BATCH_WAIT_MS,
+        max_queue: int = ORDER_MAX_QUEUE,
+    ):
+        self.session_factory = session_factory
+        self.max_batch_size = max(1, max_batch_size)
+        self.max_wait = max(0.0, max_wait_ms) / 1000.0
+        self.max_queue = max(1, max_queue)
+        self._queue: Optional[asyncio.Queue] = None
+        self._worker: Optional[asyncio.Task] = None
+        # Checkouts taken off the queue for the batch being collected, and its commit
+        self._batch: List[Tuple[Lines, asyncio.Future]] = []
+        self._committing: Optional[asyncio.Future] = None
+        self.batches_committed = 0
+        self.orders_placed = 0
+        self.orders_refused = 0
+        self.rejected = 0
+
+    async def start(self):
+        if self._worker is not None:
+            return
+        self._queue = asyncio.Queue()
+        self._worker = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._worker is None:
+            return
+        self._worker.cancel()
+        try:
+            await self._worker
+        except asyncio.CancelledError:
+            pass
+        self._worker = None
+        # A batch already committing is shielded from the cancel: let it finish,
+        # so its callers learn whether their orders were placed
+        if self._committing is not None:
+            await asyncio.wait([self._committing])
+            self._committing = None
+        waiting, self._batch = self._batch, []
+        while not self._queue.empty():
+            waiting.append(self._queue.get_nowait())
+        for _, future in waiting:
+            if not future.done():
+                future.set_exception(RuntimeError("Order batcher stopped"))
+
+    @property
+    def queue_depth(self) -> int:
+        return self._queue.qsize() if self._queue is not None else 0
+
+    async def submit(self, lines: Lines) -> dict:
+        """Queue a checkout and wait for its committed order (or OrderError)"""
+        if self._worker is None:
+            raise RuntimeError("Order batcher is not running")
+        if self._queue.qsize() >= self.max_queue:
+            self.rejected += 1
+            raise QueueFullError("Order queue is full")
+        future = asyncio.get_running_loop().create_future()
+        self._queue.put_nowait((lines, future))
+        return await future
+
+    async def _collect(self) -> List[Tuple[Lines, asyncio.Future]]:
+        loop = asyncio.get_running_loop()
+        pending = [await self._queue.get()]
+        self._batch = pending
+        deadline = loop.time() + self.max_wait
+
+        while len(pending) < self.max_batch_size:
+            if not self._queue.empty():
+                pending.append(self._queue.get_nowait())
+                continue
+            timeout = deadline - loop.time()
+            if timeout <= 0:
+                break
+            try:
+                pending.append(await asyncio.wait_for(self._queue.get(), timeout))
+            except asyncio.TimeoutError:
+                break
+
+        return pending
+
+    async def _run(self):
+        while True:
+            pending = await self._collect()
+            # Callers that already gave up never get an order placed for them
+            pending = [(lines, f) for lines, f in pending if not f.cancelled()]
+            self._batch = []
+            if pending:
+                self._committing = asyncio.ensure_future(self._commit(pending))
+                await asyncio.shield(self._committing)
+                self._committing = None
+
+    async def _commit(self, pending: List[Tuple[Lines, asyncio.Future]]):
+        outcomes = []
+        try:
+            async with self.session_factory() as db:
+                async with db.begin():
+                    await lock_products(db, [product_id for lines, _ in pending for product_id, quantity in lines])
+                    for lines, _ in pending:
+                        try:
+                            outcomes.append(await place_order(db, lines))
+                        except OrderError as e:
+                            outcomes.append(e)
+        except Exception as e:
+            if len(pending) > 1:
+                print(f"⚠️  Order batch of {len(pending)} failed ({e}); retrying individually")
+                for item in pending:
+                    await self._commit([item])
+                return
+            if not pending[0][1].done():
+                pending[0][1].set_exception(e)
+            return
+
+        self.batches_committed += 1
+        for (_, future), outcome in zip(pending, outcomes):
+            if isinstance(outcome, OrderError):
+                self.orders_refused += 1
+                if not future.done():
+                    future.set_exception(outcome)
+            else:
+                self.orders_placed += 1
+                if not future.done():
+                    future.set_result(outcome)
+
+    def stats(self) -> dict:
+        return {
+            'queue_depth': self.queue_depth,
+            'max_batch_size': self.max_batch_size,
+            'max_wait_ms': self.max_wait * 1000,
+            'batches_committed': self.batches_committed,
+            'orders_placed': self.orders_placed,
+            'orders_refused': self.orders_refused,
+            'orders_per_batch': round((self.orders_placed + self.orders_refused) / self.batches_committed, 2)
+            if self.batches_committed else 0.0,
+            'rejected': self.rejected
+        }
+
+
+async def fetch_order(db: AsyncSession, reference: str) -> Optional[dict]:
+    rows = (await db.execute(
+        select(Order.product_id, Order.quantity, Order.total_price, Order.status, Order.created_at)
+        .where(Order.reference == reference)
+        .order_by(Order.product_id)
+    )).all()
+    if not rows:
+        return None
+    return {
+        'reference': reference,
+        'status': rows[0].status,
+        'created_at': rows[0].created_at.isoformat() if rows[0].created_at else None,
+        'items': [{'product_id': r.product_id, 'quantity': r.quantity, 'total_price': r.total_price} for r in rows],
+        'total': round(sum(r.total_price for r in rows), 2),
+        'currency': 'BDT'
+    }
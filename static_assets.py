@@ -0,0 +1,347 @@
+"""
+Static assets for current nai
+Build-time precompression and content hashing of pages, CSS, JS and images,
+a StaticFiles that serves the precompressed variants, and on-demand
+thumbnails of /dataset images cached on disk
+
+    python static_assets.py                # build into STATIC_BUILD_DIR
+    STATIC_MODE=build python api_server.py # serve the build
+
+The build copies every asset under its own name and under a content-hashed
+name (styles.3f2a9c1b7e04.css). Pages, CSS and JS are rewritten to reference
+the hashed names, which are served with a one-year immutable Cache-Control;
+anything else is revalidated with ETag/Last-Modified. Text assets get .gz
+(and .br, when the brotli package is installed) siblings, chosen by the
+client's Accept-Encoding at request time.
+"""
+import argparse
+import asyncio
+import contextlib
+import gzip
+import hashlib
+import json
+import mimetypes
+import os
+import re
+import shutil
+import tempfile
+import threading
+import time
+from typing import Dict, Optional, Tuple
+
+from PIL import Image
+from starlette.datastructures import Headers
+from starlette.exceptions import HTTPException
+from starlette.responses import FileResponse, Response
+from starlette.staticfiles import NotModifiedResponse, StaticFiles
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+# source: serve css/, js/, images/ and pages from the repo; build: serve STATIC_BUILD_DIR
+STATIC_MODE = os.getenv("STATIC_MODE", "source")
+STATIC_BUILD_DIR = os.getenv("STATIC_BUILD_DIR", "./build/static")
+
+DATASET_DIR = os.getenv("DATASET_DIR", "dataset")
+THUMBNAIL_DIR = os.getenv("THUMBNAIL_DIR", "./build/thumbnails")
+# Only these widths are generated, so clients can't fill the disk with arbitrary sizes
+THUMBNAIL_SIZES = tuple(int(s) for s in os.getenv("THUMBNAIL_SIZES", "160,320,640").split(","))
+THUMBNAIL_QUALITY = int(os.getenv("THUMBNAIL_QUALITY", "80"))
+
+ASSET_DIRS = ("css", "js", "images")
+PAGES = ("index.html", "identify.html", "marketplace.html", "vendors.html", "pricing.html")
+COMPRESSIBLE = {".html", ".css", ".js", ".json", ".svg", ".txt", ".map"}
+# Skip compressing tiny files: the headers cost more than the bytes saved
+MIN_COMPRESS_BYTES = 256
+ENCODINGS = (("br", ".br"), ("gzip", ".gz"))
+
+IMMUTABLE = "public, max-age=31536000, immutable"
+REVALIDATE = "no-cache"
+THUMBNAIL_CACHE_CONTROL = "public, max-age=86400"
+HASHED_NAME = re.compile(r"\.[0-9a-f]{12}\.[A-Za-z0-9]+$")
+MANIFEST = "manifest.json"
+
+# href="css/x.css", src="/js/x.js?v=2", url('/images/x.png'), url(../images/x.png)
+ASSET_REFERENCE = re.compile(
+    r"""(?P<prefix>(?:href|src)=["']|url\(\s*["']?)(?:\.\./|/)?(?P<path>(?:css|js|images)/[^"'?#)\s]+)(?:\?[^"')\s]*)?"""
+)
+
+
+# ============================================
+# BUILD
+# ============================================
+
+def content_hash(data: bytes) -> str:
+    return hashlib.blake2b(data, digest_size=6).hexdigest()
+
+
+def hashed_name(path: str, data: bytes) -> str:
+    stem, ext = os.path.splitext(path)
+    return f"{stem}.{content_hash(data)}{ext}"
+
+
+def rewrite_references(text: str, manifest: Dict[str, str]) -> str:
+    """Point asset references at their hashed names; unknown paths are left alone"""
+    def replace(match):
+        hashed = manifest.get(match.group("path"))
+        if hashed is None:
+            return match.group(0)
+        return f"{match.group('prefix')}/{hashed}"
+    return ASSET_REFERENCE.sub(replace, text)
+
+
+def write_compressed(path: str, data: bytes) -> Dict[str, int]:
+    """Write .gz (and .br) siblings when they are smaller than the original"""
+    sizes = {}
+    if os.path.splitext(path)[1] not in COMPRESSIBLE or len(data) < MIN_COMPRESS_BYTES:
+        return sizes
+    # mtime=0 keeps the .gz bytes (and so its ETag) identical across builds
+    variants = [("gzip", ".gz", gzip.compress(data, compresslevel=9, mtime=0))]
+    if brotli is not None:
+        variants.insert(0, ("br", ".br", brotli.compress(data, quality=11)))
+    for encoding, suffix, compressed in variants:
+        if len(compressed) < len(data):
+            with open(path + suffix, "wb") as f:
+                f.write(compressed)
+            sizes[encoding] = len(compressed)
+    return sizes
+
+
+def _write(out_dir: str, rel_path: str, data: bytes) -> Dict[str, int]:
+    path = os.path.join(out_dir, rel_path)
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    with open(path, "wb") as f:
+        f.write(data)
+    return write_compressed(path, data)
+
+
+def build(source_dir: str = ".", out_dir: str = STATIC_BUILD_DIR) -> dict:
+    """Hash, rewrite and precompress every asset and page into out_dir"""
+    started = time.perf_counter()
+    tmp_dir = out_dir.rstrip("/") + ".tmp"
+    shutil.rmtree(tmp_dir, ignore_errors=True)
+    os.makedirs(tmp_dir)
+
+    sources = {}
+    for asset_dir in ASSET_DIRS:
+        for root, _, files in os.walk(os.path.join(source_dir, asset_dir)):
+            for name in files:
+                full = os.path.join(root, name)
+                with open(full, "rb") as f:
+                    sources[os.path.relpath(full, source_dir).replace(os.sep, "/")] = f.read()
+
+    # Images first, then CSS and JS (which reference images), so every hash
+    # covers the rewritten bytes that are actually served
+    manifest: Dict[str, str] = {}
+    report = {'files': 0, 'bytes': 0, 'compressed': {}}
+    order = sorted(sources, key=lambda p: (os.path.splitext(p)[1] in (".css", ".js"), p))
+    for rel_path in order:
+        data = sources[rel_path]
+        if os.path.splitext(rel_path)[1] in (".css", ".js"):
+            data = rewrite_references(data.decode("utf-8"), manifest).encode("utf-8")
+        manifest[rel_path] = hashed_name(rel_path, data)
+        # The plain name stays available for URLs built at runtime (revalidated, not immutable)
+        _write(tmp_dir, rel_path, data)
+        for encoding, size in _write(tmp_dir, manifest[rel_path], data).items():
+            report['compressed'][encoding] = report['compressed'].get(encoding, 0) + size
+        report['files'] += 1
+        report['bytes'] += len(data)
+
+    for page in PAGES:
+        page_path = os.path.join(source_dir, page)
+        if not os.path.exists(page_path):
+            continue
+        with open(page_path, encoding="utf-8") as f:
+            html = rewrite_references(f.read(), manifest)
+        data = html.encode("utf-8")
+        for encoding, size in _write(tmp_dir, page, data).items():
+            report['compressed'][encoding] = report['compressed'].get(encoding, 0) + size
+        report['files'] += 1
+        report['bytes'] += len(data)
+
+    with open(os.path.join(tmp_dir, MANIFEST), "w") as f:
+        json.dump(manifest, f, indent=2, sort_keys=True)
+
+    # Build beside the live directory and swap it in with renames, never writing into it
+    old_dir = out_dir.rstrip("/") + ".old"
+    shutil.rmtree(old_dir, ignore_errors=True)
+    if os.path.exists(out_dir):
+        os.rename(out_dir, old_dir)
+    os.rename(tmp_dir, out_dir)
+    shutil.rmtree(old_dir, ignore_errors=True)
+
+    report['elapsed_seconds'] = round(time.perf_counter() - started, 2)
+    return report
+
+
+# ============================================
+# SERVING
+# ============================================
+
+def accepted_encodings(headers: Headers) -> set:
+    accepted = set()
+    for part in headers.get("accept-encoding", "").split(","):
+        name, _, params = part.strip().partition(";")
+        if name and params.replace(" ", "") not in ("q=0", "q=0.0"):
+            accepted.add(name.lower())
+    return accepted
+
+
+class PrecompressedStaticFiles(StaticFiles):
+    """StaticFiles that serves a .br/.gz sibling when the client accepts it.
+
+    Content-hashed names get an immutable Cache-Control; everything else is
+    revalidated every time through ETag/Last-Modified (304 Not Modified).
+    """
+
+    def __init__(self, *args, cache_control: Optional[str] = None, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.cache_control = cache_control
+
+    def file_response(self, full_path, stat_result: os.stat_result, scope, status_code: int = 200) -> Response:
+        request_headers = Headers(scope=scope)
+        full_path = str(full_path)
+        media_type = mimetypes.guess_type(full_path)[0] or "text/plain"
+        headers = {"Cache-Control": self.cache_control or (
+            IMMUTABLE if HASHED_NAME.search(full_path) else REVALIDATE)}
+
+        variant = None
+        if os.path.splitext(full_path)[1] in COMPRESSIBLE:
+            headers["Vary"] = "Accept-Encoding"
+            accepted = accepted_encodings(request_headers)
+            for encoding, suffix in ENCODINGS:
+                if encoding in accepted:
+                    try:
+                        variant = (encoding, full_path + suffix, os.stat(full_path + suffix))
+                        break
+                    except FileNotFoundError:
+                        continue
+
+        if variant is not None:
+            # Each encoding is its own file, so it also gets its own ETag
+            encoding, path, stat_result = variant
+            headers["Content-Encoding"] = encoding
+            response = FileResponse(path, status_code=status_code, stat_result=stat_result,
+                                    media_type=media_type, headers=headers)
+        else:
+            response = FileResponse(full_path, status_code=status_code, stat_result=stat_result,
+                                    media_type=media_type, headers=headers)
+        if self.is_not_modified(response.headers, request_headers):
+            return NotModifiedResponse(response.headers)
+        return response
+
+
+def static_root() -> str:
+    """Directory pages and assets are served from for the configured STATIC_MODE"""
+    if STATIC_MODE == "build":
+        if os.path.exists(os.path.join(STATIC_BUILD_DIR, MANIFEST)):
+            return STATIC_BUILD_DIR
+        print(f"⚠️  STATIC_MODE=build but {STATIC_BUILD_DIR} has no build; run python static_assets.py")
+    return "."
+
+
+# ============================================
+# THUMBNAILS
+# ============================================
+
+class ThumbnailCache:
+    """Downscaled JPEG copies of dataset images, generated on first request and kept on disk"""
+
+    def __init__(self, source_dir: str = DATASET_DIR, cache_dir: str = THUMBNAIL_DIR,
+                 sizes: Tuple[int, ...] = THUMBNAIL_SIZES, quality: int = THUMBNAIL_QUALITY):
+        self.source_dir = os.path.realpath(source_dir)
+        self.cache_dir = cache_dir
+        self.sizes = sizes
+        self.quality = quality
+        self.files = PrecompressedStaticFiles(directory=cache_dir, check_dir=False,
+                                              cache_control=THUMBNAIL_CACHE_CONTROL)
+        self._locks = [threading.Lock() for _ in range(64)]
+        self.generated = 0
+        self.served = 0
+
+    def source_path(self, path: str) -> str:
+        full = os.path.realpath(os.path.join(self.source_dir, path))
+        if not full.startswith(self.source_dir + os.sep) or not os.path.isfile(full):
+            raise HTTPException(status_code=404)
+        return full
+
+    def render(self, source: str, width: int) -> Image.Image:
+        """Decode and downscale a source image; raises 415 if it isn't a readable image"""
+        try:
+            with Image.open(source) as image:
+                image.draft("RGB", (width, width))
+                image = image.convert("RGB")
+                image.thumbnail((width, width), Image.LANCZOS)
+                return image
+        except (OSError, Image.DecompressionBombError) as e:
+            raise HTTPException(status_code=415, detail=f"Cannot make a thumbnail: {e}")
+
+    def write(self, image: Image.Image, target: str):
+        os.makedirs(os.path.dirname(target), exist_ok=True)
+        # Unique temp file then rename: other workers writing the same thumbnail
+        # never share a temp file, and readers only ever see complete files
+        tmp = tempfile.NamedTemporaryFile(dir=os.path.dirname(target), prefix=".", suffix=".tmp", delete=False)
+        try:
+            with tmp:
+                image.save(tmp, "JPEG", quality=self.quality, optimize=True, progressive=True)
+            os.replace(tmp.name, target)
+        except BaseException:
+            with contextlib.suppress(FileNotFoundError):
+                os.unlink(tmp.name)
+            raise
+
+    def _is_fresh(self, source: str, target: str) -> bool:
+        try:
+            return os.stat(target).st_mtime >= os.stat(source).st_mtime
+        except FileNotFoundError:
+            return False
+
+    def ensure(self, width: int, path: str) -> str:
+        """Relative path of the cached thumbnail, (re)generating it if missing or stale"""
+        if width not in self.sizes:
+            raise HTTPException(status_code=404, detail=f"Thumbnail widths: {', '.join(map(str, self.sizes))}")
+        source = self.source_path(path)
+        # Named after the resolved source, never the raw request path, whose
+        # `..` segments could otherwise climb out of the cache directory
+        rel_path = os.path.join(str(width), os.path.splitext(os.path.relpath(source, self.source_dir))[0] + ".jpg")
+        target = os.path.join(self.cache_dir, rel_path)
+        width_dir = os.path.realpath(os.path.join(self.cache_dir, str(width)))
+        if not os.path.realpath(target).startswith(width_dir + os.sep):
+            raise HTTPException(status_code=404)
+        if self._is_fresh(source, target):
+            return rel_path
+        # Concurrent cold requests for one thumbnail (a product grid) wait for a
+        # single render instead of each decoding the full-size image
+        with self._locks[hash(target) % len(self._locks)]:
+            if not self._is_fresh(source, target):
+                self.write(self.render(source, width), target)
+                self.generated += 1
+        return rel_path
+
+    async def response(self, width: int, path: str, scope) -> Response:
+        rel_path = await asyncio.to_thread(self.ensure, width, path)
+        self.served += 1
+        return await self.files.get_response(rel_path, scope)
+
+    def stats(self) -> dict:
+        return {'sizes': list(self.sizes), 'generated': self.generated, 'served': self.served}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Build precompressed, content-hashed static assets")
+    parser.add_argument("--source", default=".", help="repository root with css/, js/, images/ and pages")
+    parser.add_argument("--out", default=STATIC_BUILD_DIR, help="build directory")
+    args = parser.parse_args()
+
+    if brotli is None:
+        print("⚠️  brotli not installed; writing gzip variants only (pip install brotli)")
+    report = build(args.source, args.out)
+    compressed = ", ".join(f"{encoding} {size / 1024:.0f} KB" for encoding, size in report['compressed'].items())
+    print(f"✅ Built {report['files']} files ({report['bytes'] / 1024:.0f} KB; {compressed}) "
+          f"into {args.out} in {report['elapsed_seconds']}s")
+
+
+if __name__ == "__main__":
+    main()
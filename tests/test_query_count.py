@@ -0,0 +1,72 @@
+"""
+Query-count regression test for the product listing endpoint
+A page must cost a fixed number of SQL statements whatever its size: the
+listing is one joined SELECT, with no per-row vendor lookups.
+"""
+import os
+import tempfile
+
+import pytest
+
+# The app binds its engines at import time, so point it at a scratch database first
+_db_dir = tempfile.mkdtemp(prefix="nai-test-")
+os.environ["DATABASE_URL"] = f"sqlite:///{os.path.join(_db_dir, 'marketplace.db')}"
+os.environ["RESPONSE_CACHE"] = "memory"
+
+import httpx  # noqa: E402
+from sqlalchemy import event  # noqa: E402
+
+from database import Product, SessionLocal, Vendor, async_engine, prepare_database  # noqa: E402
+
+PRODUCTS = 150
+
+
+@pytest.fixture(scope="module")
+def app():
+    import api_server
+
+    prepare_database()
+    with SessionLocal() as db:
+        vendors = [Vendor(name=f"Vendor {i}", email=f"vendor{i}@example.com", location="Dhaka", rating=4.5)
+                   for i in range(5)]
+        db.add_all(vendors)
+        db.flush()
+        db.add_all(
+            Product(name=f"Part {i}", category="LED", price=10.0 + i, stock=i, sku=f"SKU{i}",
+                    vendor_id=vendors[i % len(vendors)].id, image_url=f"/dataset/{i}.jpg")
+            for i in range(PRODUCTS)
+        )
+        db.commit()
+    return api_server
+
+
+@pytest.fixture
+def statements():
+    executed = []
+
+    def count(conn, cursor, statement, parameters, context, executemany):
+        executed.append(statement)
+
+    event.listen(async_engine.sync_engine, "before_cursor_execute", count)
+    yield executed
+    event.remove(async_engine.sync_engine, "before_cursor_execute", count)
+
+
+@pytest.mark.parametrize("limit", [1, 10, 100])
+@pytest.mark.parametrize("params", [{}, {"category": "LED"}, {"sort": "price_desc"}])
+@pytest.mark.anyio
+async def test_product_listing_is_one_statement(app, statements, limit, params):
+    # Bypass the response cache so the request reaches the database
+    app.response_cache.bump()
+    transport = httpx.ASGITransport(app=app.app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+        response = await client.get("/api/products", params={**params, "limit": limit})
+
+    assert response.status_code == 200
+    assert response.json()["count"] == limit
+    assert len(statements) == 1, statements
+
+
+@pytest.fixture
+def anyio_backend():
+    return "asyncio"
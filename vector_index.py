@@ -0,0 +1,236 @@
+"""
+Visual similarity search for current nai
+Nearest-neighbour lookup over stored product image embeddings: pgvector HNSW
+on PostgreSQL, brute-force NumPy in process everywhere else
+"""
+import asyncio
+import json
+import os
+import shutil
+import time
+from typing import List, Optional, Tuple
+
+import numpy as np
+from sqlalchemy import Float, bindparam, select, text
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from database import EMBEDDING_DIM, ProductEmbedding, engine
+
+# auto picks pgvector on PostgreSQL and the in-memory index otherwise
+VECTOR_INDEX = os.getenv("VECTOR_INDEX", "auto")
+
+# HNSW candidate list size per query; higher is more accurate and slower
+HNSW_EF_SEARCH = int(os.getenv("HNSW_EF_SEARCH", "40"))
+
+# How long the in-memory index serves a snapshot before reloading embeddings
+VECTOR_INDEX_REFRESH_SECONDS = float(os.getenv("VECTOR_INDEX_REFRESH_SECONDS", "300"))
+
+# Memory-mapped embedding stores written by backfill_embeddings.py, one directory per checkpoint
+EMBEDDING_STORE_DIR = os.getenv("EMBEDDING_STORE_DIR", "./models/embeddings")
+
+Match = Tuple[int, float]  # (product id, cosine similarity)
+
+
+class EmbeddingStore:
+    """Embeddings for one checkpoint as memory-mapped .npy files.
+
+    vectors.npy (float32, capacity x dim) and ids.npy (int64) are preallocated
+    and filled in product id order; progress.json records how many rows are
+    complete. Rows past that count are ignored, so a crash between flushes
+    only loses work, never corrupts the store.
+    """
+
+    def __init__(self, model: str, root: str = EMBEDDING_STORE_DIR, dim: int = EMBEDDING_DIM):
+        self.model = model
+        self.dim = dim
+        self.path = os.path.join(root, model)
+        self.rows = 0
+        self.last_id = 0
+        self._vectors = None
+        self._ids = None
+        if self.exists():
+            with open(self._file('progress.json')) as f:
+                progress = json.load(f)
+            self.rows, self.last_id = progress['rows'], progress['last_id']
+
+    def _file(self, name: str) -> str:
+        return os.path.join(self.path, name)
+
+    def exists(self) -> bool:
+        return os.path.exists(self._file('progress.json'))
+
+    def reset(self):
+        shutil.rmtree(self.path, ignore_errors=True)
+        self.rows = self.last_id = 0
+
+    def open_for_write(self, capacity: int):
+        """Map the store read-write with room for `capacity` rows, growing it if needed"""
+        from numpy.lib.format import open_memmap
+
+        os.makedirs(self.path, exist_ok=True)
+        if os.path.exists(self._file('vectors.npy')):
+            vectors = open_memmap(self._file('vectors.npy'), mode='r+')
+            ids = open_memmap(self._file('ids.npy'), mode='r+')
+            if len(vectors) >= capacity:
+                self._vectors, self._ids = vectors, ids
+                return
+            # Catalogue grew since the store was created: copy into a larger file
+            old_vectors, old_ids = vectors, ids
+        else:
+            old_vectors = old_ids = None
+
+        vectors = open_memmap(self._file('vectors.npy.tmp'), mode='w+', dtype=np.float32, shape=(capacity, self.dim))
+        ids = open_memmap(self._file('ids.npy.tmp'), mode='w+', dtype=np.int64, shape=(capacity,))
+        if old_vectors is not None:
+            vectors[:self.rows] = old_vectors[:self.rows]
+            ids[:self.rows] = old_ids[:self.rows]
+            del old_vectors, old_ids
+        vectors.flush()
+        ids.flush()
+        os.replace(self._file('vectors.npy.tmp'), self._file('vectors.npy'))
+        os.replace(self._file('ids.npy.tmp'), self._file('ids.npy'))
+        self._vectors, self._ids = vectors, ids
+        self.flush()
+
+    def append(self, ids: np.ndarray, vectors: np.ndarray):
+        end = self.rows + len(ids)
+        if end > len(self._ids):
+            self.open_for_write(max(end, 2 * len(self._ids)))
+        self._ids[self.rows:end] = ids
+        self._vectors[self.rows:end] = vectors
+        self.rows = end
+        self.last_id = int(ids[-1])
+
+    def flush(self):
+        """Persist the mapped rows, then advance the progress marker"""
+        self._vectors.flush()
+        self._ids.flush()
+        tmp = self._file('progress.json.tmp')
+        with open(tmp, 'w') as f:
+            json.dump({'model': self.model, 'rows': self.rows, 'last_id': self.last_id, 'dim': self.dim}, f)
+        os.replace(tmp, self._file('progress.json'))
+
+    def load(self) -> Tuple[np.ndarray, np.ndarray]:
+        """(ids, vectors) for the completed rows, mapped read-only"""
+        ids = np.load(self._file('ids.npy'), mmap_mode='r')[:self.rows]
+        vectors = np.load(self._file('vectors.npy'), mmap_mode='r')[:self.rows]
+        return ids, vectors
+
+
+class PgVectorIndex:
+    """Approximate search through the HNSW index on product_embeddings"""
+    name = "pgvector"
+
+    async def search(self, db: AsyncSession, model: str, query: np.ndarray, k: int) -> List[Match]:
+        await db.execute(text(f"SET LOCAL hnsw.ef_search = {HNSW_EF_SEARCH}"))
+        vector = bindparam('query', query, type_=ProductEmbedding.embedding.type)
+        distance = ProductEmbedding.embedding.op('<=>', return_type=Float)(vector)
+        rows = await db.execute(
+            select(ProductEmbedding.product_id, distance.label('distance'))
+            .where(ProductEmbedding.model == model)
+            .order_by(distance)
+            .limit(k)
+        )
+        return [(product_id, 1.0 - distance) for product_id, distance in rows]
+
+    def stats(self) -> dict:
+        return {'index': self.name, 'ef_search': HNSW_EF_SEARCH}
+
+
+class InMemoryVectorIndex:
+    """Exact search over a NumPy matrix of all embeddings for one model.
+
+    Meant for local development and CPU-only deployments. Embeddings come
+    from the checkpoint's EmbeddingStore when one exists (memory-mapped, so
+    large catalogues are not copied into RAM), otherwise from
+    product_embeddings. They are loaded on first use and reloaded every
+    `refresh_seconds`, or when the serving model changes.
+    """
+    name = "memory"
+
+    def __init__(self, refresh_seconds: float = VECTOR_INDEX_REFRESH_SECONDS):
+        self.refresh_seconds = refresh_seconds
+        self._model: Optional[str] = None
+        self._ids = np.empty(0, dtype=np.int64)
+        self._matrix = np.empty((0, 0), dtype=np.float32)
+        self._loaded_at = 0.0
+        self._lock = asyncio.Lock()
+
+    def invalidate(self):
+        self._loaded_at = 0.0
+
+    def _stale(self, model: str) -> bool:
+        return self._model != model or time.monotonic() - self._loaded_at > self.refresh_seconds
+
+    @staticmethod
+    def _open_store(model: str) -> Optional[Tuple[EmbeddingStore, np.ndarray, np.ndarray]]:
+        store = EmbeddingStore(model)
+        if not store.exists():
+            return None
+        return (store, *store.load())
+
+    @staticmethod
+    def _stack(rows) -> Tuple[np.ndarray, np.ndarray]:
+        if not rows:
+            return np.empty(0, dtype=np.int64), np.empty((0, 0), dtype=np.float32)
+        ids = np.fromiter((row[0] for row in rows), dtype=np.int64, count=len(rows))
+        matrix = np.stack([row[1] for row in rows]).astype(np.float32, copy=False)
+        # Stored vectors are normalized already; renormalize to be safe
+        matrix /= np.maximum(np.linalg.norm(matrix, axis=1, keepdims=True), 1e-12)
+        return ids, matrix
+
+    @staticmethod
+    def _rank(ids: np.ndarray, matrix: np.ndarray, query: np.ndarray, k: int) -> List[Match]:
+        scores = matrix @ np.asarray(query, dtype=np.float32)
+        k = min(k, len(ids))
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top])]
+        return [(int(ids[i]), float(scores[i])) for i in top]
+
+    async def _load(self, db: AsyncSession, model: str):
+        # Stacking and scoring run in threads: over a large memory-mapped store
+        # they page in gigabytes, which would stall every other request
+        async with self._lock:
+            if not self._stale(model):
+                return
+            mapped = await asyncio.to_thread(self._open_store, model)
+            if mapped is not None:
+                store, self._ids, self._matrix = mapped
+                self._model = model
+                self._loaded_at = time.monotonic()
+                print(f"✅ Vector index mapped: {store.rows} embeddings from {store.path}")
+                return
+            rows = (await db.execute(
+                select(ProductEmbedding.product_id, ProductEmbedding.embedding)
+                .where(ProductEmbedding.model == model)
+                .order_by(ProductEmbedding.product_id)
+            )).all()
+            ids, matrix = await asyncio.to_thread(self._stack, rows)
+            self._ids, self._matrix = ids, matrix
+            self._model = model
+            self._loaded_at = time.monotonic()
+            print(f"✅ Vector index loaded: {len(ids)} embeddings for model {model}")
+
+    async def search(self, db: AsyncSession, model: str, query: np.ndarray, k: int) -> List[Match]:
+        if self._stale(model):
+            await self._load(db, model)
+        ids, matrix = self._ids, self._matrix
+        if not len(ids):
+            return []
+        return await asyncio.to_thread(self._rank, ids, matrix, query, k)
+
+    def stats(self) -> dict:
+        return {'index': self.name, 'model': self._model, 'embeddings': len(self._ids),
+                'refresh_seconds': self.refresh_seconds}
+
+
+def make_vector_index(kind: str = VECTOR_INDEX):
+    if kind == "auto":
+        kind = "pgvector" if engine.dialect.name == "postgresql" else "memory"
+    if kind == "pgvector":
+        if engine.dialect.name != "postgresql":
+            raise ValueError("VECTOR_INDEX=pgvector requires a PostgreSQL DATABASE_URL")
+        return PgVectorIndex()
+    if kind == "memory":
+        return InMemoryVectorIndex()
+    raise ValueError(f"Unknown VECTOR_INDEX '{kind}' (expected auto, pgvector or memory)")